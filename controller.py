@@ -4,11 +4,16 @@ Central automation engine that connects sensors with actuators
 Implements automation rules based on sensor data
 """
 
-import time
 import json
 import os
+import threading
+import time
 import logging
-from utils import create_mqtt_client, connect_with_retry
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+from checkpoint import Checkpointer
+from dispatch import dispatch_messages, dispatcher_from_env
+from profiling import install_signal_handlers
+import sim_clock as clock
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("AutomationController")
@@ -17,9 +22,13 @@ logger = logging.getLogger("AutomationController")
 class AutomationController:
     """Central controller for home automation rules"""
     
-    def __init__(self):
+    def __init__(self, thermostat_topic="home/thermostat/command", light_topic="home/light/command",
+                 log_config=True):
+        self.thermostat_topic = thermostat_topic
+        self.light_topic = light_topic
         self.current_temp = 25.0
         self.light_state = "OFF"
+        self.thermostat_mode = None
         self.motion_detected = False
         self.last_motion_time = 0
         
@@ -28,9 +37,22 @@ class AutomationController:
         self.temp_low_threshold = 20.0   # Turn on heating if temp < 20°C
         self.motion_light_timeout = 30   # Turn off light 30 seconds after no motion
         
-        logger.info("Automation Controller initialized")
-        logger.info(f"Temperature thresholds: {self.temp_low_threshold}°C - {self.temp_high_threshold}°C")
-        logger.info(f"Motion light timeout: {self.motion_light_timeout} seconds")
+        # Handlers run on dispatch workers while the main loop checks the motion timeout
+        self.lock = threading.RLock()
+        
+        # anomaly.AnomalyGuard screening sensor readings before the rules, None to trust every reading
+        self.anomaly_guard = None
+        
+        if log_config:
+            logger.info("Automation Controller initialized")
+            logger.info(f"Temperature thresholds: {self.temp_low_threshold}°C - {self.temp_high_threshold}°C")
+            logger.info(f"Motion light timeout: {self.motion_light_timeout} seconds")
+    
+    def admit(self, client, sensor_id, value, binary=False):
+        """True if a reading may drive the rules (not anomalous / quarantined)"""
+        if self.anomaly_guard is None:
+            return True
+        return self.anomaly_guard.check(client, sensor_id, value, binary=binary)
     
     def handle_temperature(self, temp, client):
         """
@@ -40,7 +62,7 @@ class AutomationController:
         - Normal temp: Set thermostat to AUTO mode
         """
         self.current_temp = temp
-        logger.info(f"🌡️ Temperature update: {temp}°C")
+        logger.info("🌡️ Temperature update: %s°C", temp)
         
         if temp > self.temp_high_threshold:
             # Too hot - activate cooling
@@ -49,9 +71,9 @@ class AutomationController:
                 "mode": "COOL",
                 "reason": f"Temperature {temp}°C exceeds threshold {self.temp_high_threshold}°C"
             }
-            client.publish("home/thermostat/command", json.dumps(command), qos=1)
-            logger.warning(f"🔥 HIGH TEMP! Activating COOL mode: {temp}°C > {self.temp_high_threshold}°C")
-            
+            publish(client, self.thermostat_topic, json.dumps(command))
+            logger.warning("🔥 HIGH TEMP! Activating COOL mode: %s°C > %s°C", temp, self.temp_high_threshold)
+        
         elif temp < self.temp_low_threshold:
             # Too cold - activate heating
             command = {
@@ -59,9 +81,9 @@ class AutomationController:
                 "mode": "HEAT",
                 "reason": f"Temperature {temp}°C below threshold {self.temp_low_threshold}°C"
             }
-            client.publish("home/thermostat/command", json.dumps(command), qos=1)
-            logger.warning(f"❄️ LOW TEMP! Activating HEAT mode: {temp}°C < {self.temp_low_threshold}°C")
-            
+            publish(client, self.thermostat_topic, json.dumps(command))
+            logger.warning("❄️ LOW TEMP! Activating HEAT mode: %s°C < %s°C", temp, self.temp_low_threshold)
+        
         else:
             # Normal temperature - use AUTO mode
             command = {
@@ -69,8 +91,8 @@ class AutomationController:
                 "mode": "AUTO",
                 "reason": "Temperature within normal range"
             }
-            client.publish("home/thermostat/command", json.dumps(command), qos=1)
-            logger.info(f"✓ Normal temperature. AUTO mode: {temp}°C")
+            publish(client, self.thermostat_topic, json.dumps(command))
+            logger.info("✓ Normal temperature. AUTO mode: %s°C", temp)
     
     def handle_motion(self, motion_data, client):
         """
@@ -84,39 +106,69 @@ class AutomationController:
         if motion_detected:
             # Motion detected - turn on lights
             self.motion_detected = True
-            self.last_motion_time = time.time()
-            logger.warning(f"🚨 Motion detected from {camera_id}!")
+            self.last_motion_time = clock.time()
+            logger.warning("🚨 Motion detected from %s!", camera_id)
             
             # Turn on light when motion is detected
             if self.light_state == "OFF":
                 command = {"command": "ON"}
-                client.publish("home/light/command", json.dumps(command), qos=1)
-                logger.info(f"💡 Motion detected - Light turned ON")
+                publish(client, self.light_topic, json.dumps(command))
+                logger.info("💡 Motion detected - Light turned ON")
                 self.light_state = "ON"
             else:
-                logger.info(f"💡 Lights already ON, motion timer refreshed")
+                logger.info("💡 Lights already ON, motion timer refreshed")
         else:
             # No motion detected
-            logger.info(f"✓ No motion from {camera_id}")
+            logger.info("✓ No motion from %s", camera_id)
             
             # Check if lights should be turned off due to timeout
             if self.motion_detected and self.light_state == "ON":
-                time_since_motion = time.time() - self.last_motion_time
+                time_since_motion = clock.time() - self.last_motion_time
                 
                 if time_since_motion >= self.motion_light_timeout:
                     # Timeout reached - turn off lights
                     command = {"command": "OFF"}
-                    client.publish("home/light/command", json.dumps(command), qos=1)
-                    logger.info(f"💡 No motion for {self.motion_light_timeout}s - Light turned OFF")
+                    publish(client, self.light_topic, json.dumps(command))
+                    logger.info("💡 No motion for %ss - Light turned OFF", self.motion_light_timeout)
                     self.light_state = "OFF"
                     self.motion_detected = False
                 else:
                     remaining = self.motion_light_timeout - time_since_motion
-                    logger.info(f"⏱️  Waiting for timeout: {remaining:.0f}s remaining")
+                    logger.info("⏱️  Waiting for timeout: %.0fs remaining", remaining)
+    
+    def get_state(self):
+        """
+        Runtime state that survives restarts (checkpoint) and moves with the
+        controller (cluster handoff). last_motion_time is an absolute timestamp,
+        so a pending motion-off timer keeps its deadline across a restart.
+        """
+        return {
+            "current_temp": self.current_temp,
+            "light_state": self.light_state,
+            "thermostat_mode": self.thermostat_mode,
+            "motion_detected": self.motion_detected,
+            "last_motion_time": self.last_motion_time,
+        }
+    
+    def load_state(self, state):
+        """Restore state produced by get_state"""
+        self.current_temp = state.get("current_temp", self.current_temp)
+        self.light_state = state.get("light_state", self.light_state)
+        self.thermostat_mode = state.get("thermostat_mode", self.thermostat_mode)
+        self.motion_detected = state.get("motion_detected", self.motion_detected)
+        self.last_motion_time = state.get("last_motion_time", self.last_motion_time)
     
     def handle_light_status(self, status_data):
-        """Track light status"""
-        self.light_state = status_data.get("state", "OFF")
+        """Track light status (the retained status also corrects restored state)"""
+        state = status_data.get("state", "OFF")
+        if state != self.light_state:
+            logger.info("💡 Light status reconciled: %s -> %s", self.light_state, state)
+        self.light_state = state
+    
+    def handle_thermostat_status(self, status_data):
+        """Track thermostat mode (for monitoring)"""
+        self.thermostat_mode = status_data.get("mode")
+        logger.info("📊 Thermostat: %s - %s", self.thermostat_mode, status_data.get('hvac_state'))
     
     def check_motion_timeout(self, client):
         """
@@ -124,55 +176,63 @@ class AutomationController:
         Called periodically from main loop
         """
         if self.motion_detected and self.light_state == "ON":
-            time_since_motion = time.time() - self.last_motion_time
+            time_since_motion = clock.time() - self.last_motion_time
             
             if time_since_motion > self.motion_light_timeout:
                 # No motion detected for timeout period - turn off lights
                 command = {"command": "OFF"}
-                client.publish("home/light/command", json.dumps(command), qos=1)
-                logger.info(f"🌑 Turning OFF lights - no motion for {int(time_since_motion)}s")
+                publish(client, self.light_topic, json.dumps(command))
+                logger.info("🌑 Turning OFF lights - no motion for %ss", int(time_since_motion))
                 self.motion_detected = False
                 self.light_state = "OFF"
 
 
-def run_automation_controller():
+def create_message_handler(controller, dispatcher=None):
     """
-    Main function for automation controller
-    Subscribes to sensors and publishes commands to actuators
-    """
-    # Get configuration from environment variables
-    broker = os.getenv("BROKER", "mosquitto")
-    port = int(os.getenv("PORT", "1883"))
-    client_id = os.getenv("CLIENT_ID", "automation_controller")
-    
-    logger.info("=" * 60)
-    logger.info("Starting Home Automation Controller")
-    logger.info("=" * 60)
-    logger.info(f"Broker: {broker}:{port}")
-    
-    # Create automation controller instance
-    controller = AutomationController()
+    Build the on_message callback that routes sensor topics to a controller
     
-    # Create MQTT client
-    client = create_mqtt_client(client_id, broker, port)
+    Args:
+        controller: AutomationController instance receiving the messages
+        dispatcher: KeyedDispatcher running the handlers off the network thread
+                    (one sensor topic at a time, in order), None to run them inline
     
+    Returns:
+        Callback with the paho on_message signature
+    """
     def on_message(client, userdata, msg):
         """Handle incoming MQTT messages from sensors"""
-        try:
-            payload = msg.payload.decode()
-            data = json.loads(payload)
-            topic = msg.topic
-            
+        route_message(controller, client, msg.topic, msg.payload)
+    
+    return dispatch_messages(on_message, dispatcher)
+
+
+def route_message(controller, client, topic, payload):
+    """
+    Decode a sensor message and pass it to the matching controller handler
+    
+    Args:
+        controller: AutomationController instance
+        client: MQTT client used for the resulting commands
+        topic: Sensor topic (home/sensor/temperature, home/security/motion, ...)
+        payload: Raw JSON payload
+    """
+    try:
+        data = json.loads(payload.decode())
+        
+        with controller.lock:
             # Route messages to appropriate handlers
             if topic == "home/sensor/temperature":
                 # Temperature sensor data
                 if "value" in data:
                     temp = float(data["value"])
-                    controller.handle_temperature(temp, client)
+                    if controller.admit(client, "sensor/temperature", temp):
+                        controller.handle_temperature(temp, client)
             
             elif topic == "home/security/motion":
                 # Motion detection event
-                controller.handle_motion(data, client)
+                sensor_id = f"security/motion/{data.get('camera_id', 'unknown')}"
+                if controller.admit(client, sensor_id, bool(data.get("motion_detected", False)), binary=True):
+                    controller.handle_motion(data, client)
             
             elif topic == "home/light/status":
                 # Light status update
@@ -180,15 +240,59 @@ def run_automation_controller():
             
             elif topic == "home/thermostat/status":
                 # Thermostat status (for monitoring)
-                logger.info(f"📊 Thermostat: {data.get('mode')} - {data.get('hvac_state')}")
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON: {e}")
-        except Exception as e:
-            logger.error(f"Error processing message from {msg.topic}: {e}")
+                controller.handle_thermostat_status(data)
+    
+    except json.JSONDecodeError as e:
+        logger.error("Invalid JSON: %s", e)
+    except Exception as e:
+        logger.error("Error processing message from %s: %s", topic, e)
+
+
+def run_automation_controller():
+    """
+    Main function for automation controller
+    Subscribes to sensors and publishes commands to actuators
+    """
+    # Get configuration from environment variables
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    client_id = os.getenv("CLIENT_ID", "automation_controller")
+    
+    logger.info("=" * 60)
+    logger.info("Starting Home Automation Controller")
+    logger.info("=" * 60)
+    logger.info(f"Broker: {broker}:{port}")
+    
+    # Create automation controller instance
+    controller = AutomationController()
     
-    # Set message callback
-    client.on_message = on_message
+    # Opt-in: screen sensor readings for anomalies before the rules (imports NumPy, set
+    # ANOMALY_DETECTION=true); flagged sensors are only kept from automation with ANOMALY_QUARANTINE=true
+    if os.getenv("ANOMALY_DETECTION", "false").lower() in ("1", "true", "yes"):
+        from anomaly import anomaly_guard_from_env
+        controller.anomaly_guard = anomaly_guard_from_env()
+        logger.info(f"Anomaly detection enabled, quarantine: {controller.anomaly_guard.analog.quarantine}")
+    
+    # Warm restart: resume from the last snapshot, retained status corrects it once subscribed
+    checkpointer = None
+    checkpoint_file = os.getenv("CHECKPOINT_FILE", f"{client_id}.ckpt")
+    if checkpoint_file:
+        checkpointer = Checkpointer(checkpoint_file, controller.get_state,
+                                    interval=float(os.getenv("CHECKPOINT_INTERVAL", "5")))
+        started = time.perf_counter()
+        state, age = checkpointer.restore()
+        if state is not None:
+            controller.load_state(state)
+            logger.info(f"♻️ Restored state from {checkpoint_file} in {(time.perf_counter() - started) * 1000:.1f} ms "
+                        f"(snapshot age {age:.0f}s): {state}")
+    
+    # Create MQTT client
+    client = create_mqtt_client(client_id, broker, port)
+    
+    # Set message callback; handlers run on dispatch workers, off paho's network thread
+    dispatcher = dispatcher_from_env("controller")
+    client.on_message = create_message_handler(controller, dispatcher)
+    stats_interval = int(os.getenv("DISPATCH_STATS_INTERVAL", "30"))
     
     # Connect to broker with retry
     if not connect_with_retry(client, broker, port):
@@ -204,7 +308,7 @@ def run_automation_controller():
     ]
     
     for topic in topics:
-        client.subscribe(topic)
+        add_subscription(client, topic)
         logger.info(f"✓ Subscribed to {topic}")
     
     # Start MQTT loop in background
@@ -217,22 +321,36 @@ def run_automation_controller():
     
     # Main loop for periodic checks
     try:
+        ticks = 0
         while True:
             # Check motion timeout periodically
-            controller.check_motion_timeout(client)
+            with controller.lock:
+                controller.check_motion_timeout(client)
             
-            # Sleep for 1 second before next check
-            time.sleep(1)
+            if checkpointer is not None:
+                checkpointer.tick()
+            
+            ticks += 1
+            if dispatcher is not None and stats_interval and ticks % stats_interval == 0:
+                publish(client, "home/controller/dispatch/status", json.dumps(dispatcher.stats()))
             
+            # Sleep for 1 second before next check
+            clock.sleep(1)
+    
     except KeyboardInterrupt:
         logger.info("Shutting down automation controller...")
     except Exception as e:
         logger.error(f"Error: {e}")
     finally:
         client.loop_stop()
+        if dispatcher is not None:
+            dispatcher.stop()
+        if checkpointer is not None:
+            checkpointer.save()
         client.disconnect()
         logger.info("Automation controller stopped.")
 
 
 if __name__ == "__main__":
+    install_signal_handlers()
     run_automation_controller()
@@ -0,0 +1,391 @@
+"""
+Clustered Automation Controller
+Runs several controller instances as one group. Sensor topics are consumed through
+$share/<group>/ subscriptions so the broker spreads the load, and every room is owned
+by exactly one instance (consistent hashing over the live members). A message that
+the broker hands to a non-owner is forwarded to the owner's inbox; room state moves
+with ownership when instances join or leave.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import socket
+import threading
+import logging
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish, wait_until_ready
+from controller import AutomationController, route_message
+from checkpoint import Checkpointer
+from dispatch import dispatcher_from_env
+from topic_policy import policy_for, KEEP_ALL
+import sim_clock as clock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("ControllerCluster")
+
+# Sensor topics handled by the cluster (room topics are sharded per room)
+SENSOR_TOPICS = [
+    "home/sensor/temperature",
+    "home/security/motion",
+    "home/light/status",
+    "home/thermostat/status",
+    "home/rooms/+/temperature",
+    "home/rooms/+/motion",
+    "home/rooms/+/light/status",
+    "home/rooms/+/thermostat/status",
+]
+
+# Room topic suffix -> equivalent single-home topic understood by route_message
+ROOM_TOPIC_KINDS = {
+    "temperature": "home/sensor/temperature",
+    "motion": "home/security/motion",
+    "light/status": "home/light/status",
+    "thermostat/status": "home/thermostat/status",
+}
+
+HOME_ENTITY = "home"
+
+# Inbox envelopes: one topic per node so forwarded messages and handoffs stay in order
+_MESSAGE = b"M"
+_HANDOFF = b"H"
+_MAX_HOPS = 2
+
+
+def entity_for(topic):
+    """Entity that owns a sensor topic: the room id, or 'home' for the single-home topics"""
+    parts = topic.split("/", 3)
+    if len(parts) > 3 and parts[1] == "rooms":
+        return parts[2]
+    return HOME_ENTITY
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+    
+    def __init__(self, members=(), vnodes=64):
+        self.vnodes = vnodes
+        self.members = []
+        self._keys = []
+        self._owners = []
+        self._cache = {}
+        self.set_members(members)
+    
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+    
+    def set_members(self, members):
+        points = sorted(
+            (self._hash(f"{member}#{i}"), member)
+            for member in members
+            for i in range(self.vnodes)
+        )
+        self.members = sorted(members)
+        self._keys = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+        self._cache = {}
+    
+    def owner(self, key):
+        """Member that owns key, None if the ring is empty"""
+        owner = self._cache.get(key)
+        if owner is None and self._keys:
+            index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+            owner = self._owners[index]
+            self._cache[key] = owner
+        return owner
+
+
+class ControllerClusterNode:
+    """
+    One member of a controller group
+    
+    Membership is a retained record per node under cluster/<group>/members/<node>,
+    refreshed every heartbeat_interval and cleared by the node's last will.
+    With shared=False the node uses plain subscriptions instead of $share/ (for
+    brokers without shared subscriptions): every node sees every message and
+    silently skips rooms it does not own, so nothing is forwarded.
+    """
+    
+    def __init__(self, node_id, group="controllers", vnodes=64, heartbeat_interval=5.0, shared=True):
+        self.node_id = node_id
+        self.group = group
+        self.shared = shared
+        self.heartbeat_interval = heartbeat_interval
+        self.member_prefix = f"cluster/{group}/members/"
+        self.inbox_topic = self.inbox_for(node_id)
+        
+        self.ring = HashRing([node_id], vnodes)
+        self.members = {node_id: clock.time()}   # node -> last heartbeat
+        self.controllers = {}                    # owned entity -> AutomationController
+        self.lock = threading.RLock()
+        self.client = None
+        self.dispatcher = None   # KeyedDispatcher for sensor messages, keyed by entity
+        
+        self.handled = 0
+        self.forwarded = 0
+        self.skipped = 0
+        self.handoffs_sent = 0
+        self.handoffs_received = 0
+    
+    def inbox_for(self, node_id):
+        return f"cluster/{self.group}/nodes/{node_id}/inbox"
+    
+    def subscription_topics(self):
+        if self.shared:
+            return [f"$share/{self.group}/{topic}" for topic in SENSOR_TOPICS]
+        return list(SENSOR_TOPICS)
+    
+    def controller_for(self, entity):
+        controller = self.controllers.get(entity)
+        if controller is None:
+            if entity == HOME_ENTITY:
+                controller = AutomationController(log_config=False)
+            else:
+                controller = AutomationController(
+                    thermostat_topic=f"home/rooms/{entity}/thermostat/command",
+                    light_topic=f"home/rooms/{entity}/light/command",
+                    log_config=False,
+                )
+            self.controllers[entity] = controller
+        return controller
+    
+    def on_message(self, client, userdata, msg):
+        topic = msg.topic
+        if topic.startswith(self.member_prefix):
+            self._on_member(topic[len(self.member_prefix):], msg.payload)
+        elif topic == self.inbox_topic:
+            self._on_inbox(msg.payload)
+        elif self.dispatcher is not None:
+            # Off the network thread; one entity's messages stay in order
+            self.dispatcher.submit(entity_for(topic), self.dispatch, topic, msg.payload,
+                                   block=policy_for(topic).queue_class == KEEP_ALL, latest=topic)
+        else:
+            self.dispatch(topic, msg.payload)
+    
+    def dispatch(self, topic, payload, hops=0):
+        """Handle a sensor message if this node owns its entity, otherwise forward or skip it"""
+        entity = entity_for(topic)
+        with self.lock:
+            owner = self.ring.owner(entity)
+            if owner == self.node_id or hops >= _MAX_HOPS:
+                # Hop limit: members briefly disagree about ownership, handle it here
+                self.handled += 1
+                controller = self.controller_for(entity)
+                if entity != HOME_ENTITY:
+                    topic = ROOM_TOPIC_KINDS.get(topic.split("/", 3)[3], topic)
+                route_message(controller, self.client, topic, payload)
+                return
+        
+        if not self.shared:
+            self.skipped += 1   # the owner received its own copy
+            return
+        
+        self.forwarded += 1
+        envelope = _MESSAGE + bytes([hops + 1]) + topic.encode("utf-8") + b"\n" + payload
+        publish(self.client, self.inbox_for(owner), envelope)
+    
+    def _on_inbox(self, payload):
+        kind = payload[:1]
+        if kind == _MESSAGE:
+            hops = payload[1]
+            topic, _, body = payload[2:].partition(b"\n")
+            self.dispatch(topic.decode("utf-8"), body, hops)
+        elif kind == _HANDOFF:
+            handoff = json.loads(payload[1:].decode("utf-8"))
+            with self.lock:
+                for entity, state in handoff["entities"].items():
+                    self.controller_for(entity).load_state(state)
+                self.handoffs_received += len(handoff["entities"])
+            logger.info(f"📥 Took over {len(handoff['entities'])} entities from {handoff['from']}")
+    
+    def _on_member(self, node_id, payload):
+        if node_id == self.node_id:
+            return
+        with self.lock:
+            if not payload:
+                # Retained record cleared: graceful leave or last will
+                if self.members.pop(node_id, None) is not None:
+                    logger.info(f"👋 Member {node_id} left")
+                    self._rebalance()
+                return
+            
+            record = json.loads(payload.decode("utf-8"))
+            now = clock.time()
+            if now - record["heartbeat"] > 3 * self.heartbeat_interval:
+                return   # stale retained record of a node that died without its will
+            joined = node_id not in self.members
+            self.members[node_id] = now
+            if joined:
+                logger.info(f"🤝 Member {node_id} joined")
+                self._rebalance()
+    
+    def expire_members(self):
+        """Drop members that stopped heartbeating (will not delivered yet)"""
+        now = clock.time()
+        with self.lock:
+            expired = [node for node, seen in self.members.items()
+                       if node != self.node_id and now - seen > 3 * self.heartbeat_interval]
+            for node in expired:
+                del self.members[node]
+                logger.warning(f"⚠️ Member {node} missed its heartbeats, removing it")
+            if expired:
+                self._rebalance()
+    
+    def _rebalance(self):
+        """Recompute ownership and hand off entities that now belong to another member"""
+        self.ring.set_members(list(self.members))
+        outgoing = {}
+        for entity in list(self.controllers):
+            owner = self.ring.owner(entity)
+            if owner != self.node_id:
+                outgoing.setdefault(owner, {})[entity] = self.controllers.pop(entity).get_state()
+        
+        for owner, entities in outgoing.items():
+            self._send_handoff(owner, entities)
+        
+        logger.info(f"🔄 Ring: {len(self.members)} member(s), {len(self.controllers)} entities owned here")
+    
+    def _send_handoff(self, owner, entities):
+        envelope = _HANDOFF + json.dumps({"from": self.node_id, "entities": entities}).encode("utf-8")
+        publish(self.client, self.inbox_for(owner), envelope)
+        self.handoffs_sent += len(entities)
+        logger.info(f"📤 Handed {len(entities)} entities to {owner}")
+    
+    def heartbeat(self):
+        record = {"node": self.node_id, "heartbeat": clock.time(), "owned": len(self.controllers)}
+        publish(self.client, self.member_prefix + self.node_id, json.dumps(record))
+    
+    def start(self, broker, port, client_id=None):
+        """Connect, learn the current members, then announce ourselves and take traffic"""
+        client = create_mqtt_client(client_id or f"controller_{self.node_id}", broker, port)
+        client.will_set(self.member_prefix + self.node_id, b"", qos=1, retain=True)
+        client.on_message = self.on_message
+        self.client = client
+        self.dispatcher = dispatcher_from_env(f"cluster-{self.node_id}")
+        
+        if not connect_with_retry(client, broker, port):
+            return False
+        
+        add_subscription(client, self.member_prefix + "+", qos=1)
+        add_subscription(client, self.inbox_topic, qos=1)
+        client.loop_start()
+        
+        # Retained member records arrive right after the SUBACK; give them a moment
+        # so we do not briefly claim every room
+        wait_until_ready(client, 10)
+        clock.sleep(0.2)
+        self.heartbeat()
+        
+        for topic in self.subscription_topics():
+            add_subscription(client, topic)
+        return True
+    
+    def leave(self):
+        """Leave the group gracefully, handing every owned entity to its next owner"""
+        publish(self.client, self.member_prefix + self.node_id, b"")
+        with self.lock:
+            del self.members[self.node_id]
+            if self.members:
+                self._rebalance()
+    
+    def get_state(self):
+        """State of every owned entity (checkpoint)"""
+        with self.lock:
+            return {entity: controller.get_state() for entity, controller in self.controllers.items()}
+    
+    def load_state(self, state):
+        """Restore owned entities; any that now belong elsewhere move on the next rebalance"""
+        with self.lock:
+            for entity, entity_state in state.items():
+                self.controller_for(entity).load_state(entity_state)
+    
+    def check_motion_timeouts(self):
+        with self.lock:
+            for controller in self.controllers.values():
+                controller.check_motion_timeout(self.client)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "node": self.node_id,
+                "members": sorted(self.members),
+                "owned": len(self.controllers),
+                "handled": self.handled,
+                "forwarded": self.forwarded,
+                "skipped": self.skipped,
+                "handoffs_sent": self.handoffs_sent,
+                "handoffs_received": self.handoffs_received,
+                "dispatch": self.dispatcher.stats() if self.dispatcher is not None else None,
+            }
+
+
+def run_controller_cluster():
+    """
+    Main function for one clustered controller instance
+    Start several (NODE_ID must differ) to scale the controller out
+    """
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    node_id = os.getenv("NODE_ID", socket.gethostname())
+    group = os.getenv("CLUSTER_GROUP", "controllers")
+    shared = os.getenv("CLUSTER_SHARED", "1") == "1"
+    heartbeat_interval = float(os.getenv("HEARTBEAT_INTERVAL", "5"))
+    
+    logger.info("=" * 60)
+    logger.info(f"Starting clustered controller {node_id} (group {group})")
+    logger.info("=" * 60)
+    logger.info(f"Broker: {broker}:{port}, shared subscriptions: {shared}")
+    
+    node = ControllerClusterNode(
+        node_id,
+        group=group,
+        vnodes=int(os.getenv("CLUSTER_VNODES", "64")),
+        heartbeat_interval=heartbeat_interval,
+        shared=shared,
+    )
+    checkpointer = None
+    checkpoint_file = os.getenv("CHECKPOINT_FILE", f"controller_{node_id}.ckpt")
+    if checkpoint_file:
+        checkpointer = Checkpointer(checkpoint_file, node.get_state,
+                                    interval=float(os.getenv("CHECKPOINT_INTERVAL", "5")))
+        state, age = checkpointer.restore()
+        if state is not None:
+            node.load_state(state)
+            logger.info(f"♻️ Restored {len(state)} entities from {checkpoint_file} (snapshot age {age:.0f}s)")
+    
+    if not node.start(broker, port, os.getenv("CLIENT_ID")):
+        logger.error("Failed to connect. Exiting.")
+        return
+    
+    next_heartbeat = clock.time() + heartbeat_interval
+    try:
+        while True:
+            node.check_motion_timeouts()
+            if checkpointer is not None:
+                checkpointer.tick()
+            if clock.time() >= next_heartbeat:
+                node.heartbeat()
+                node.expire_members()
+                next_heartbeat += heartbeat_interval
+                logger.info(f"📊 {node.stats()}")
+            clock.sleep(1)
+    
+    except KeyboardInterrupt:
+        logger.info("Shutting down clustered controller...")
+    except Exception as e:
+        logger.error(f"Error: {e}")
+    finally:
+        if checkpointer is not None:
+            checkpointer.save()
+        node.leave()
+        clock.sleep(0.5)   # let the handoff reach the broker
+        node.client.loop_stop()
+        if node.dispatcher is not None:
+            node.dispatcher.stop()
+        node.client.disconnect()
+        logger.info("Clustered controller stopped.")
+
+
+if __name__ == "__main__":
+    run_controller_cluster()
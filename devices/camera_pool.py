@@ -0,0 +1,491 @@
+"""
+Multi-Camera Motion Service
+One process ingests many cameras: decoder processes write frames into
+multiprocessing.shared_memory ring buffers, a pool of worker processes runs
+frame_motion detection straight from those buffers (frames are never pickled),
+and a single asyncio publisher in the main process emits motion events and status.
+
+Topics:
+    home/security/motion                       motion events (camera_id in the payload)
+    home/security/camera/<camera_id>/status    per-camera status
+    home/security/camera/status                pool summary (top-level fields stay compatible)
+    home/security/camera/command               command for every camera
+    home/security/camera/<camera_id>/command   command for one camera
+"""
+
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+from frame_motion import FrameMotionDetector, frame_source, parse_roi
+import sim_clock as clock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("CameraPool")
+
+# Control array columns (one row per camera), written by the publisher, read by workers
+ACTIVE = 0
+SENSITIVITY = 1
+
+
+def _attach(name):
+    """Attach to an existing segment without letting this process's resource tracker unlink it"""
+    shm = shared_memory.SharedMemory(name=name)
+    if mp.get_start_method() != "fork":
+        # Forked children share the creator's tracker; spawned ones have their own
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class FrameRing:
+    """
+    Fixed-size ring of frames in shared memory
+    
+    Layout: int64 header [latest seq, slot seq x slots] followed by `slots` frames.
+    The writer marks a slot -1 while filling it and stamps the sequence number
+    afterwards; a reader checks the stamp before and after using a frame and
+    drops it if the writer lapped it in between.
+    """
+    
+    def __init__(self, shape, slots=4, name=None, create=False):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frame_bytes = int(np.prod(self.shape))
+        self.header_bytes = 8 * (slots + 1)
+        size = self.header_bytes + slots * self.frame_bytes
+        
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size) if create else _attach(name)
+        self.name = self.shm.name
+        self.header = np.ndarray((slots + 1,), np.int64, buffer=self.shm.buf)
+        self.frames = np.ndarray((slots,) + self.shape, np.uint8, buffer=self.shm.buf, offset=self.header_bytes)
+        if create:
+            self.header.fill(-1)
+        self._seq = -1
+    
+    def spec(self):
+        return {"name": self.name, "shape": self.shape, "slots": self.slots}
+    
+    @classmethod
+    def open(cls, spec):
+        return cls(spec["shape"], spec["slots"], name=spec["name"])
+    
+    def write(self, frame):
+        self._seq += 1
+        slot = self._seq % self.slots
+        self.header[1 + slot] = -1
+        self.frames[slot][...] = frame
+        self.header[1 + slot] = self._seq
+        self.header[0] = self._seq
+        return self._seq
+    
+    def latest(self):
+        return int(self.header[0])
+    
+    def frame(self, seq):
+        """View of frame seq, None if it was already overwritten"""
+        slot = seq % self.slots
+        if self.header[1 + slot] != seq:
+            return None
+        return self.frames[slot]
+    
+    def valid(self, seq):
+        return self.header[1 + seq % self.slots] == seq
+    
+    def close(self):
+        self.header = self.frames = None
+        self.shm.close()
+    
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _decoder_main(ring_specs, source_specs, fps, width, height, stop):
+    """Decoder process: pull frames from each camera source and write them into its ring"""
+    rings = [FrameRing.open(spec) for spec in ring_specs]
+    sources = [iter(frame_source(spec, width, height)) for spec in source_specs]
+    interval = 1.0 / fps if fps > 0 else 0.0
+    next_frame = time.monotonic()
+    try:
+        while not stop.is_set():
+            for ring, source in zip(rings, sources):
+                ring.write(next(source))
+            if interval:
+                next_frame += interval
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame = time.monotonic()
+    except (KeyboardInterrupt, StopIteration):
+        pass
+    finally:
+        for ring in rings:
+            ring.close()
+
+
+def _worker_main(worker_id, cameras, ring_specs, control_name, n_cameras, scale, roi, results, stop,
+                 stats_interval=1.0):
+    """
+    Detection worker: owns a fixed subset of cameras (detector state stays local)
+    and always processes the newest frame of each, skipping frames it cannot keep up with
+    """
+    rings = {camera: FrameRing.open(spec) for camera, spec in zip(cameras, ring_specs)}
+    control_shm = _attach(control_name)
+    control = np.ndarray((n_cameras, 2), np.float64, buffer=control_shm.buf)
+    detectors = {camera: FrameMotionDetector(scale=scale, sensitivity=float(control[camera, SENSITIVITY]), roi=roi)
+                 for camera in cameras}
+    last_seq = {camera: -1 for camera in cameras}
+    # Private copy of the frame being processed: the decoder may overwrite the ring slot meanwhile
+    buffers = {camera: np.empty(rings[camera].shape, np.uint8) for camera in cameras}
+    motion_state = {camera: False for camera in cameras}
+    counters = {camera: {"processed": 0, "skipped": 0, "torn": 0} for camera in cameras}
+    next_stats = time.monotonic() + stats_interval
+    
+    try:
+        while not stop.is_set():
+            idle = True
+            for camera in cameras:
+                if control[camera, ACTIVE] == 0:
+                    continue
+                ring = rings[camera]
+                seq = ring.latest()
+                if seq <= last_seq[camera]:
+                    continue
+                frame = ring.frame(seq)
+                if frame is None:
+                    continue
+                idle = False
+                
+                detector = detectors[camera]
+                sensitivity = float(control[camera, SENSITIVITY])
+                if sensitivity != detector.sensitivity:
+                    detector.set_sensitivity(sensitivity)
+                
+                buffer = buffers[camera]
+                np.copyto(buffer, frame)
+                counters[camera]["skipped"] += max(0, seq - last_seq[camera] - 1)
+                last_seq[camera] = seq
+                if not ring.valid(seq):
+                    counters[camera]["torn"] += 1   # overwritten while we copied it, never reaches the model
+                    continue
+                motion = detector.process(buffer)
+                counters[camera]["processed"] += 1
+                
+                if motion != motion_state[camera]:
+                    motion_state[camera] = motion
+                    results.put(("motion", camera, motion, time.time()))
+            
+            if time.monotonic() >= next_stats:
+                next_stats += stats_interval
+                stats = {}
+                for camera in cameras:
+                    stats[camera] = dict(counters[camera], **detectors[camera].stats())
+                results.put(("stats", worker_id, stats))
+            
+            if idle:
+                time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for ring in rings.values():
+            ring.close()
+        control = None
+        control_shm.close()
+
+
+class CameraPool:
+    """
+    Shared-memory camera pipeline
+    
+    Cameras are spread over `decoders` decoder processes and `workers` detection
+    processes (camera i goes to worker i % workers), so detection runs on every
+    core and never competes with MQTT I/O in the main process.
+    """
+    
+    def __init__(self, camera_ids, source_specs, workers=None, decoders=None, fps=30.0,
+                 width=1280, height=720, scale=4, roi=None, sensitivity=0.3, slots=4):
+        self.camera_ids = list(camera_ids)
+        self.source_specs = list(source_specs)
+        self.workers = workers or max(1, min(len(self.camera_ids), os.cpu_count() or 1))
+        self.decoders = decoders or max(1, len(self.camera_ids) // 8)
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.roi = roi
+        self.slots = slots
+        
+        n = len(self.camera_ids)
+        self.control_shm = shared_memory.SharedMemory(create=True, size=n * 2 * 8)
+        self.control = np.ndarray((n, 2), np.float64, buffer=self.control_shm.buf)
+        self.control[:, ACTIVE] = 1
+        self.control[:, SENSITIVITY] = sensitivity
+        
+        self.rings = []
+        self.results = mp.Queue()
+        self.stop_event = mp.Event()
+        self.processes = []
+        self.stats = {}
+    
+    def _probe_shape(self, spec):
+        """Frame shape of a source (ring buffers are sized before decoding starts)"""
+        source = iter(frame_source(spec, self.width, self.height))
+        return next(source).shape
+    
+    def start(self):
+        for spec in self.source_specs:
+            self.rings.append(FrameRing(self._probe_shape(spec), self.slots, create=True))
+        
+        n = len(self.camera_ids)
+        for d in range(self.decoders):
+            cameras = list(range(d, n, self.decoders))
+            process = mp.Process(
+                target=_decoder_main, name=f"CameraDecoder-{d}", daemon=True,
+                args=([self.rings[c].spec() for c in cameras], [self.source_specs[c] for c in cameras],
+                      self.fps, self.width, self.height, self.stop_event),
+            )
+            self.processes.append(process)
+        
+        for w in range(self.workers):
+            cameras = list(range(w, n, self.workers))
+            process = mp.Process(
+                target=_worker_main, name=f"CameraWorker-{w}", daemon=True,
+                args=(w, cameras, [self.rings[c].spec() for c in cameras], self.control_shm.name, n,
+                      self.scale, self.roi, self.results, self.stop_event),
+            )
+            self.processes.append(process)
+        
+        for process in self.processes:
+            process.start()
+        logger.info(f"Started {len(self.camera_ids)} camera(s) on {self.decoders} decoder(s) "
+                    f"and {self.workers} worker(s)")
+    
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        for ring in self.rings:
+            ring.close()
+            ring.unlink()
+        self.control = None
+        self.control_shm.close()
+        self.control_shm.unlink()
+    
+    def camera_index(self, camera_id):
+        return self.camera_ids.index(camera_id)
+    
+    def set_active(self, camera, active):
+        self.control[camera, ACTIVE] = 1 if active else 0
+    
+    def set_sensitivity(self, camera, sensitivity):
+        self.control[camera, SENSITIVITY] = sensitivity
+    
+    def get_result(self, timeout=0.5):
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+    
+    def update_stats(self, worker_stats):
+        self.stats.update(worker_stats)
+    
+    def throughput(self):
+        """Frames processed per camera so far (from the last worker reports)"""
+        return sum(stats.get("processed", 0) for stats in self.stats.values())
+
+
+class CameraPoolPublisher:
+    """Single asyncio publisher: motion events on change, per-camera and pool status periodically"""
+    
+    def __init__(self, pool, client, motion_topic="home/security/motion",
+                 status_prefix="home/security/camera", status_interval=10.0, recording_window=10.0):
+        self.pool = pool
+        self.client = client
+        self.motion_topic = motion_topic
+        self.status_prefix = status_prefix
+        self.status_interval = status_interval
+        self.recording_window = recording_window
+        n = len(pool.camera_ids)
+        self.motion = [False] * n
+        self.last_motion = [0.0] * n
+    
+    def camera_status(self, camera):
+        camera_id = self.pool.camera_ids[camera]
+        now = clock.time()
+        stats = self.pool.stats.get(camera, {})
+        return {
+            "camera_id": camera_id,
+            "active": bool(self.pool.control[camera, ACTIVE]),
+            "motion_detected": self.motion[camera],
+            "recording": now - self.last_motion[camera] <= self.recording_window,
+            "sensitivity": float(self.pool.control[camera, SENSITIVITY]),
+            "last_motion": self.last_motion[camera] or None,
+            "detector": {key: stats[key] for key in ("processed", "skipped", "torn", "frame_ms", "frame_ms_p95")
+                         if key in stats},
+            "timestamp": now,
+        }
+    
+    def publish_status(self):
+        cameras = [self.camera_status(c) for c in range(len(self.pool.camera_ids))]
+        for status in cameras:
+            publish(self.client, f"{self.status_prefix}/{status['camera_id']}/status", json.dumps(status))
+        summary = {
+            "camera_id": "pool",
+            "active": any(status["active"] for status in cameras),
+            "motion_detected": any(status["motion_detected"] for status in cameras),
+            "recording": any(status["recording"] for status in cameras),
+            "sensitivity": float(self.pool.control[:, SENSITIVITY].mean()),
+            "cameras": len(cameras),
+            "motion_cameras": [status["camera_id"] for status in cameras if status["motion_detected"]],
+            "frames_processed": self.pool.throughput(),
+            "timestamp": clock.time(),
+        }
+        publish(self.client, f"{self.status_prefix}/status", json.dumps(summary))
+    
+    def handle_result(self, result):
+        kind = result[0]
+        if kind == "stats":
+            self.pool.update_stats(result[2])
+            return
+        _, camera, motion, timestamp = result
+        camera_id = self.pool.camera_ids[camera]
+        self.motion[camera] = motion
+        if motion:
+            self.last_motion[camera] = timestamp
+            logger.warning(f"🚨 MOTION DETECTED by camera {camera_id}!")
+        event = {
+            "camera_id": camera_id,
+            "motion_detected": motion,
+            "event": "MOTION_DETECTED" if motion else "NO_MOTION",
+            "location": camera_id,
+            "timestamp": timestamp,
+            "recording": motion or timestamp - self.last_motion[camera] <= self.recording_window,
+        }
+        publish(self.client, self.motion_topic, json.dumps(event))
+    
+    async def run_results(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            result = await loop.run_in_executor(None, self.pool.get_result)
+            if result is not None:
+                self.handle_result(result)
+    
+    async def run_status(self):
+        while True:
+            self.publish_status()
+            await asyncio.sleep(self.status_interval)
+    
+    async def run(self):
+        await asyncio.gather(self.run_results(), self.run_status())
+
+
+def create_command_handler(pool, publisher):
+    """on_message for home/security/camera/command and home/security/camera/<id>/command"""
+    def on_message(client, userdata, msg):
+        try:
+            parts = msg.topic.split("/")
+            cameras = range(len(pool.camera_ids)) if len(parts) == 4 else [pool.camera_index(parts[3])]
+            data = json.loads(msg.payload.decode())
+            command = data.get("command", "").upper()
+            for camera in cameras:
+                if command == "ACTIVATE":
+                    pool.set_active(camera, True)
+                elif command == "DEACTIVATE":
+                    pool.set_active(camera, False)
+                elif command == "SET_SENSITIVITY":
+                    sensitivity = float(data.get("sensitivity", 0.3))
+                    if 0 <= sensitivity <= 1:
+                        pool.set_sensitivity(camera, sensitivity)
+            publisher.publish_status()
+            logger.info(f"📩 {command} applied to {len(cameras)} camera(s)")
+        except Exception as e:
+            logger.error(f"Error processing command on {msg.topic}: {e}")
+    return on_message
+
+
+def benchmark_pool(cameras=8, workers=(1, 2, 4), seconds=5.0, width=1280, height=720):
+    """
+    Frames processed per second with unpaced decoders, for each worker count
+    Throughput grows with workers up to the number of free cores
+    """
+    results = {}
+    for n_workers in workers:
+        pool = CameraPool([f"cam_{i:02d}" for i in range(cameras)], ["synthetic"] * cameras,
+                          workers=n_workers, fps=0, width=width, height=height)
+        pool.start()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            result = pool.get_result(0.2)
+            if result is not None and result[0] == "stats":
+                pool.update_stats(result[2])
+        processed = pool.throughput()
+        pool.stop()
+        results[n_workers] = round(processed / seconds, 1)
+        logger.info(f"📊 {n_workers} worker(s): {results[n_workers]} frames/s across {cameras} cameras")
+    return results
+
+
+def run_camera_pool():
+    """
+    Main function for the multi-camera service
+    CAMERAS (comma separated ids) or CAMERA_COUNT, CAMERA_SOURCE ("synthetic" or a
+    path template such as /videos/{camera}.y4m), POOL_WORKERS, POOL_DECODERS
+    """
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    client_id = os.getenv("CLIENT_ID", "camera_pool")
+    camera_ids = [c for c in os.getenv("CAMERAS", "").split(",") if c] or \
+        [f"camera_{i:02d}" for i in range(int(os.getenv("CAMERA_COUNT", "4")))]
+    source_template = os.getenv("CAMERA_SOURCE", "synthetic")
+    status_interval = float(os.getenv("CHECK_INTERVAL", "10"))
+    
+    logger.info(f"Starting Multi-Camera Service with {len(camera_ids)} camera(s)")
+    logger.info(f"Broker: {broker}:{port}")
+    
+    pool = CameraPool(
+        camera_ids,
+        [source_template.format(camera=camera_id) for camera_id in camera_ids],
+        workers=int(os.getenv("POOL_WORKERS", "0")) or None,
+        decoders=int(os.getenv("POOL_DECODERS", "0")) or None,
+        fps=float(os.getenv("MOTION_FPS", "30")),
+        width=int(os.getenv("FRAME_WIDTH", "1280")),
+        height=int(os.getenv("FRAME_HEIGHT", "720")),
+        scale=int(os.getenv("MOTION_SCALE", "4")),
+        roi=parse_roi(os.getenv("MOTION_ROI", "")),
+    )
+    pool.start()
+    
+    client = create_mqtt_client(client_id, broker, port)
+    publisher = CameraPoolPublisher(pool, client, status_interval=status_interval)
+    client.on_message = create_command_handler(pool, publisher)
+    
+    if not connect_with_retry(client, broker, port):
+        logger.error("Failed to connect. Exiting.")
+        pool.stop()
+        return
+    
+    add_subscription(client, "home/security/camera/command", qos=1)
+    add_subscription(client, "home/security/camera/+/command", qos=1)
+    client.loop_start()
+    
+    try:
+        asyncio.run(publisher.run())
+    except KeyboardInterrupt:
+        logger.info("Shutting down multi-camera service...")
+    finally:
+        pool.stop()
+        client.loop_stop()
+        client.disconnect()
+        logger.info("Multi-camera service stopped.")
+
+
+if __name__ == "__main__":
+    run_camera_pool()
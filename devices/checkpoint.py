@@ -0,0 +1,123 @@
+"""
+State Checkpoints
+Crash-safe snapshots of in-memory state so a restarted process resumes where it stopped
+
+File layout: MAGIC (5 bytes) | CRC32 of body (4 bytes) | zlib-compressed compact JSON
+A snapshot is written to a temporary file, fsynced and renamed over the previous one,
+so a crash at any point leaves either the old or the new snapshot, never a torn file.
+"""
+
+import os
+import json
+import zlib
+import struct
+import logging
+import tempfile
+import sim_clock as clock
+
+logger = logging.getLogger("Checkpoint")
+
+MAGIC = b"SHCP\x01"
+CRC = struct.Struct("<I")
+
+
+def encode_state(state):
+    """Serialize state to the compact checkpoint body"""
+    return zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+
+
+def save_checkpoint(path, state):
+    """
+    Atomically replace the checkpoint at path
+    
+    Args:
+        path: Checkpoint file
+        state: JSON-serializable state
+    """
+    body = encode_state(state)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    
+    fd, tmp_path = tempfile.mkstemp(prefix=".ckpt-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(CRC.pack(zlib.crc32(body)))
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    
+    # Persist the rename itself
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint written by save_checkpoint
+    
+    Returns:
+        The saved state, or None if there is no usable checkpoint
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    
+    header = len(MAGIC) + CRC.size
+    if len(data) < header or data[:len(MAGIC)] != MAGIC:
+        logger.warning(f"Ignoring {path}: not a checkpoint file")
+        return None
+    (crc,) = CRC.unpack_from(data, len(MAGIC))
+    body = data[header:]
+    if zlib.crc32(body) != crc:
+        logger.warning(f"Ignoring {path}: checksum mismatch")
+        return None
+    return json.loads(zlib.decompress(body).decode("utf-8"))
+
+
+class Checkpointer:
+    """
+    Periodically snapshots state returned by get_state
+    
+    Call tick() from the owner's main loop; a snapshot is written at most every
+    interval seconds and only when the state actually changed.
+    """
+    
+    def __init__(self, path, get_state, interval=5.0):
+        self.path = path
+        self.get_state = get_state
+        self.interval = interval
+        self._last_state = None
+        self._next_save = clock.monotonic() + interval
+        self.saves = 0
+    
+    def restore(self):
+        """Load the last snapshot, returns (state, age_seconds) or (None, None)"""
+        snapshot = load_checkpoint(self.path)
+        if snapshot is None:
+            return None, None
+        return snapshot["state"], clock.time() - snapshot["saved_at"]
+    
+    def tick(self):
+        if clock.monotonic() >= self._next_save:
+            self._next_save = clock.monotonic() + self.interval
+            self.save()
+    
+    def save(self):
+        """Write a snapshot now if the state changed since the last one"""
+        state = self.get_state()
+        if state == self._last_state:
+            return False
+        save_checkpoint(self.path, {"saved_at": clock.time(), "state": state})
+        self._last_state = state
+        self.saves += 1
+        return True
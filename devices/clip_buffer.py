@@ -0,0 +1,567 @@
+"""
+Motion Clip Recording
+Pre/post-motion clips for the security camera
+
+Encoded frames go into a fixed-size ring arena (anonymous or file-backed mmap),
+so memory stays bounded however long the camera runs. When motion starts the
+pre-roll is written to a disk segment straight from the arena (memoryview slices,
+no intermediate copies) and later frames are appended to segments on disk until
+the post-roll ends; long events simply produce more segments.
+
+Finished segments are published as binary chunks; every chunk carries its byte
+offset so a receiver can detect gaps and ask for a resend from any offset.
+
+Topics:
+    home/security/camera/<camera_id>/thumbnail           retained encoded frame of the latest event
+    home/security/camera/<camera_id>/clip                segment manifests (JSON)
+    home/security/camera/<camera_id>/clip/<clip_id>      chunks: CHUNK_HEADER + segment bytes
+"""
+
+import io
+import os
+import mmap
+import json
+import zlib
+import struct
+import threading
+import logging
+from collections import deque, OrderedDict
+import numpy as np
+from utils import publish
+import sim_clock as clock
+
+logger = logging.getLogger("ClipBuffer")
+
+SEGMENT_MAGIC = b"SHCS\x01"
+FRAME_HEADER = struct.Struct("<dI")       # timestamp, encoded length
+CHUNK_HEADER = struct.Struct("<IQQ")      # segment index, offset, segment size
+
+
+class FrameEncoder:
+    """
+    Frame -> bytes
+    JPEG when Pillow is installed, otherwise zlib-compressed PNM ("pnm.z")
+    Frames are subsampled by `scale` first, which also bounds encoding time.
+    """
+    
+    def __init__(self, scale=2, quality=70):
+        self.scale = scale
+        self.quality = quality
+        try:
+            from PIL import Image
+            self._image = Image
+            self.encoding = "jpeg"
+        except ImportError:
+            self._image = None
+            self.encoding = "pnm.z"
+    
+    def encode(self, frame, scale=None):
+        step = scale or self.scale
+        small = np.ascontiguousarray(frame[::step, ::step])
+        if self._image is not None:
+            out = io.BytesIO()
+            self._image.fromarray(small).save(out, "JPEG", quality=self.quality)
+            return out.getvalue()
+        magic = b"P6" if small.ndim == 3 else b"P5"
+        header = b"%s\n%d %d\n255\n" % (magic, small.shape[1], small.shape[0])
+        return zlib.compress(header + small.tobytes(), 1)
+
+
+class ClipRing:
+    """
+    Ring arena of encoded frames
+    
+    Frames are stored back to back; a frame that does not fit before the end of
+    the arena wraps to offset 0, evicting the oldest frames it overlaps.
+    frames_since() returns memoryview slices into the arena, valid until the
+    next append.
+    """
+    
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity
+        if path:
+            self._file = open(path, "w+b")
+            self._file.truncate(capacity)
+            self.buf = mmap.mmap(self._file.fileno(), capacity)
+        else:
+            self._file = None
+            self.buf = mmap.mmap(-1, capacity)
+        self.view = memoryview(self.buf)
+        self.index = deque()      # (timestamp, offset, length), oldest first
+        self.head = 0
+        self.dropped = 0
+    
+    def append(self, timestamp, data):
+        size = len(data)
+        if size > self.capacity // 2:
+            self.dropped += 1
+            return False
+        
+        index = self.index
+        if self.head + size > self.capacity:
+            # Everything at or after head is from the previous lap: the oldest frames
+            while index and index[0][1] >= self.head:
+                index.popleft()
+            self.head = 0
+        start, end = self.head, self.head + size
+        while index and index[0][1] < end and index[0][1] + index[0][2] > start:
+            index.popleft()
+        
+        self.view[start:end] = data
+        index.append((timestamp, start, size))
+        self.head = end
+        return True
+    
+    def frames_since(self, timestamp):
+        """(timestamp, memoryview) of buffered frames newer than timestamp, oldest first"""
+        return [(ts, self.view[offset:offset + size])
+                for ts, offset, size in self.index if ts >= timestamp]
+    
+    def used(self):
+        return sum(size for _, _, size in self.index)
+    
+    def close(self):
+        self.view.release()
+        self.buf.close()
+        if self._file is not None:
+            self._file.close()
+
+
+class ClipSegment:
+    """One segment file being written: SEGMENT_MAGIC then (FRAME_HEADER + frame) records"""
+    
+    def __init__(self, path, clip_id, number):
+        self.path = path
+        self.clip_id = clip_id
+        self.number = number
+        self.file = open(path, "wb")
+        self.file.write(SEGMENT_MAGIC)
+        self.size = len(SEGMENT_MAGIC)
+        self.crc = zlib.crc32(SEGMENT_MAGIC)
+        self.frames = 0
+        self.start = None
+        self.end = None
+    
+    def write(self, timestamp, data):
+        header = FRAME_HEADER.pack(timestamp, len(data))
+        self.file.write(header)
+        self.file.write(data)
+        self.crc = zlib.crc32(data, zlib.crc32(header, self.crc))
+        self.size += len(header) + len(data)
+        self.frames += 1
+        if self.start is None:
+            self.start = timestamp
+        self.end = timestamp
+    
+    def close(self):
+        self.file.close()
+
+
+def read_segment(path):
+    """Yield (timestamp, encoded frame) from a segment file"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(SEGMENT_MAGIC):
+        raise ValueError(f"{path} is not a clip segment")
+    offset = len(SEGMENT_MAGIC)
+    while offset + FRAME_HEADER.size <= len(data):
+        timestamp, size = FRAME_HEADER.unpack_from(data, offset)
+        offset += FRAME_HEADER.size
+        yield timestamp, data[offset:offset + size]
+        offset += size
+
+
+def enforce_retention(directory, max_clips, max_bytes, keep=None):
+    """
+    Delete the oldest clips in `directory` until at most max_clips clips and
+    max_bytes of segments remain (0 disables a limit). The clip `keep` (being
+    recorded) is never deleted.
+    
+    Returns:
+        Number of clips deleted
+    """
+    clips = {}
+    try:
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".seg"):
+                clip_id = entry.name.rsplit("_", 1)[0]
+                stat = entry.stat()
+                paths, size, mtime = clips.get(clip_id, ([], 0, 0.0))
+                paths.append(entry.path)
+                clips[clip_id] = (paths, size + stat.st_size, max(mtime, stat.st_mtime))
+    except OSError as e:
+        logger.warning(f"Cannot scan {directory} for retention: {e}")
+        return 0
+    
+    total = sum(size for _, size, _ in clips.values())
+    count = len(clips)
+    deleted = 0
+    for clip_id, (paths, size, _) in sorted(clips.items(), key=lambda item: item[1][2]):
+        if (not max_clips or count <= max_clips) and (not max_bytes or total <= max_bytes):
+            break
+        if clip_id == keep:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+        count -= 1
+        deleted += 1
+    if deleted:
+        logger.info(f"🧹 Deleted {deleted} old clip(s), {count} clip(s) / {total >> 20} MB kept")
+    return deleted
+
+
+class ClipRecorder:
+    """
+    Motion clip state machine, fed every frame with the detector's verdict
+    
+    idle -> (motion) -> recording -> (no motion for post_seconds) -> idle
+    Segments are rotated every segment_seconds and handed to on_segment as they
+    are closed; on_event is called at clip start (with a thumbnail) and end.
+    """
+    
+    def __init__(self, camera_id, directory="clips", buffer_bytes=32 << 20, pre_seconds=5.0,
+                 post_seconds=5.0, segment_seconds=10.0, fps=10.0, encoder=None, buffer_path=None,
+                 on_segment=None, on_event=None, max_clips=100, max_bytes=1 << 30):
+        self.camera_id = camera_id
+        self.directory = directory
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.segment_seconds = segment_seconds
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.encoder = encoder or FrameEncoder()
+        self.ring = ClipRing(buffer_bytes, buffer_path)
+        self.on_segment = on_segment
+        self.on_event = on_event
+        self.max_clips = max_clips
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        
+        self.clip_id = None
+        self.segment = None
+        self.last_motion = 0.0
+        self._next_frame = 0.0
+        self.clips = 0
+    
+    @property
+    def recording(self):
+        return self.clip_id is not None
+    
+    def add_frame(self, frame, motion):
+        """Called from the frame thread; encodes at most `fps` frames per second"""
+        now = clock.time()
+        if motion:
+            self.last_motion = now
+        if now < self._next_frame and not (motion and not self.recording):
+            return
+        self._next_frame = now + self.interval
+        
+        data = self.encoder.encode(frame)
+        if motion and not self.recording:
+            self._start_clip(now, frame)
+        if self.recording:
+            if now - self.segment.start >= self.segment_seconds:
+                self._rotate(now)
+            self.segment.write(now, data)
+            if now - self.last_motion > self.post_seconds:
+                self._finish_clip()
+        self.ring.append(now, data)
+    
+    def _segment_path(self, clip_id, number):
+        return os.path.join(self.directory, f"{clip_id}_{number:04d}.seg")
+    
+    def _start_clip(self, now, frame):
+        self.clip_id = f"{self.camera_id}-{int(now * 1000)}"
+        self.clips += 1
+        self.segment = ClipSegment(self._segment_path(self.clip_id, 0), self.clip_id, 0)
+        # Pre-roll goes to disk directly from the arena
+        for timestamp, view in self.ring.frames_since(now - self.pre_seconds):
+            self.segment.write(timestamp, view)
+        if self.segment.start is None:
+            self.segment.start = now
+        logger.info(f"🎥 Clip {self.clip_id} started with {self.segment.frames} pre-roll frame(s)")
+        if self.on_event:
+            self.on_event("CLIP_STARTED", self.clip_id, self.encoder.encode(frame, self.encoder.scale * 4))
+    
+    def _rotate(self, now):
+        segment = self.segment
+        segment.close()
+        self.segment = ClipSegment(self._segment_path(self.clip_id, segment.number + 1), self.clip_id,
+                                   segment.number + 1)
+        self.segment.start = now
+        if self.on_segment:
+            self.on_segment(segment, False)
+        enforce_retention(self.directory, self.max_clips, self.max_bytes, keep=self.clip_id)
+    
+    def _finish_clip(self):
+        segment = self.segment
+        segment.close()
+        logger.info(f"🎥 Clip {self.clip_id} finished ({segment.number + 1} segment(s))")
+        clip_id, self.clip_id, self.segment = self.clip_id, None, None
+        if self.on_segment:
+            self.on_segment(segment, True)
+        if self.on_event:
+            self.on_event("CLIP_FINISHED", clip_id, None)
+        enforce_retention(self.directory, self.max_clips, self.max_bytes)
+    
+    def close(self):
+        if self.recording:
+            self._finish_clip()
+        self.ring.close()
+    
+    def stats(self):
+        return {
+            "clips": self.clips,
+            "recording": self.clip_id,
+            "buffer_bytes": self.ring.used(),
+            "buffer_frames": len(self.ring.index),
+            "dropped_frames": self.ring.dropped,
+            "encoding": self.encoder.encoding,
+        }
+
+
+class ClipPublisher:
+    """
+    Publishes finished segments as chunks from a background thread
+    
+    Transfers pause while disconnected and resume from the last acknowledged
+    offset. Receivers ask for missing ranges with a CLIP_RESEND command
+    ({"clip_id", "segment", "offset"}), served from the segment file on disk.
+    """
+    
+    def __init__(self, client, camera_id, directory, encoding, chunk_size=65536, window=8,
+                 topic_prefix="home/security/camera"):
+        self.client = client
+        self.camera_id = camera_id
+        self.directory = directory
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.window = window
+        self.prefix = f"{topic_prefix}/{camera_id}"
+        self.jobs = deque(maxlen=1000)
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.running = False
+        self.bytes_sent = 0
+    
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="ClipPublisher", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self.running = False
+        self._wakeup.set()
+    
+    def publish_thumbnail(self, clip_id, data):
+        publish(self.client, f"{self.prefix}/thumbnail", data)
+    
+    def add_segment(self, segment, final):
+        """ClipRecorder.on_segment: announce the segment and queue its transfer"""
+        manifest = {
+            "camera_id": self.camera_id,
+            "clip_id": segment.clip_id,
+            "segment": segment.number,
+            "size": segment.size,
+            "crc32": segment.crc,
+            "frames": segment.frames,
+            "start": segment.start,
+            "end": segment.end,
+            "final": final,
+            "encoding": self.encoding,
+            "chunk_size": self.chunk_size,
+            "topic": f"{self.prefix}/clip/{segment.clip_id}",
+        }
+        publish(self.client, f"{self.prefix}/clip", json.dumps(manifest))
+        self.jobs.append((segment.path, segment.clip_id, segment.number, 0))
+        self._wakeup.set()
+    
+    def resend(self, clip_id, number, offset=0):
+        path = os.path.join(self.directory, f"{clip_id}_{int(number):04d}.seg")
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory) or not os.path.exists(path):
+            logger.warning(f"Cannot resend {clip_id}/{number}: no such segment")
+            return False
+        self.jobs.append((path, clip_id, int(number), int(offset)))
+        self._wakeup.set()
+        return True
+    
+    def _run(self):
+        while self.running:
+            self._wakeup.wait(1.0)
+            self._wakeup.clear()
+            while self.running and self.jobs:
+                job = self.jobs[0]
+                offset = self._send(*job)
+                if offset is None:
+                    self.jobs.popleft()
+                else:
+                    # Disconnected: retry this segment from the acknowledged offset
+                    self.jobs[0] = job[:3] + (offset,)
+                    clock.sleep(1.0)
+    
+    def _send(self, path, clip_id, number, offset):
+        """Send a segment from offset, returns None when done or the offset to resume from"""
+        topic = f"{self.prefix}/clip/{clip_id}"
+        try:
+            size = os.path.getsize(path)
+            f = open(path, "rb")
+        except OSError as e:
+            logger.error(f"Cannot read {path}: {e}")
+            return None
+        
+        with f:
+            f.seek(offset)
+            inflight = deque()    # (offset after the chunk, MQTTMessageInfo)
+            acked = offset
+            while offset < size and self.running:
+                if not self.client.is_connected():
+                    return acked
+                chunk = f.read(self.chunk_size)
+                info = publish(self.client, topic, CHUNK_HEADER.pack(number, offset, size) + chunk)
+                if getattr(info, "queued", False):
+                    return acked      # offline backlog still draining, retry after it
+                offset += len(chunk)
+                self.bytes_sent += len(chunk)
+                inflight.append((offset, info))
+                if len(inflight) >= self.window:
+                    end, info = inflight.popleft()
+                    info.wait_for_publish(5.0)
+                    if not info.is_published():
+                        return acked
+                    acked = end
+            for end, info in inflight:
+                info.wait_for_publish(5.0)
+                if not info.is_published():
+                    return acked
+                acked = end
+        return None if offset >= size else acked
+
+
+class ClipAssembler:
+    """
+    Receiver side: rebuilds segment files from manifests and chunks
+    missing() lists the offsets to request with CLIP_RESEND.
+    
+    A segment that gets no chunk for idle_timeout seconds (lost tail, restarted
+    publisher), or the least recently active one beyond max_pending incomplete
+    segments, is abandoned: its file is closed and the partial file deleted.
+    """
+    
+    def __init__(self, directory, completed_size=1000, idle_timeout=300.0, max_pending=64):
+        self.directory = directory
+        # (clip_id, segment) -> {"size", "file", "path", "ranges", "active"}, incomplete only,
+        # least recently active first
+        self.segments = OrderedDict()
+        self.idle_timeout = idle_timeout
+        self.max_pending = max_pending
+        self.abandoned = 0
+        self.completed = OrderedDict()  # recently completed keys: late duplicate chunks are ignored
+        self.completed_size = completed_size
+        os.makedirs(directory, exist_ok=True)
+    
+    def add_chunk(self, clip_id, payload):
+        number, offset, size = CHUNK_HEADER.unpack_from(payload)
+        key = (clip_id, number)
+        if key in self.completed:
+            return True
+        now = clock.monotonic()
+        entry = self.segments.get(key)
+        if entry is None:
+            path = self.path(clip_id, number)
+            f = open(path, "w+b")
+            f.truncate(size)
+            entry = self.segments[key] = {"size": size, "file": f, "path": path, "ranges": {}}
+        else:
+            self.segments.move_to_end(key)
+        entry["active"] = now
+        self._abandon_stale(now)
+        data = memoryview(payload)[CHUNK_HEADER.size:]
+        entry["file"].seek(offset)
+        entry["file"].write(data)
+        entry["ranges"][offset] = len(data)
+        return self.complete(clip_id, number)
+    
+    def missing(self, clip_id, number):
+        """First offset not yet received, None when the segment is complete"""
+        entry = self.segments.get((clip_id, number))
+        if entry is None:
+            return None if (clip_id, number) in self.completed else 0
+        offset = 0
+        for start in sorted(entry["ranges"]):
+            if start > offset:
+                return offset
+            offset = max(offset, start + entry["ranges"][start])
+        return offset if offset < entry["size"] else None
+    
+    def complete(self, clip_id, number):
+        """True once every byte arrived; the segment file is then closed and forgotten"""
+        key = (clip_id, number)
+        if key in self.completed:
+            return True
+        if self.missing(clip_id, number) is not None:
+            return False
+        self.segments.pop(key)["file"].close()
+        self.completed[key] = True
+        while len(self.completed) > self.completed_size:
+            self.completed.popitem(last=False)
+        return True
+    
+    def _abandon_stale(self, now):
+        """Drop idle incomplete segments and the oldest ones beyond max_pending"""
+        while self.segments:
+            key, entry = next(iter(self.segments.items()))
+            if len(self.segments) <= self.max_pending and now - entry["active"] < self.idle_timeout:
+                return
+            del self.segments[key]
+            entry["file"].close()
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+            self.abandoned += 1
+            logger.warning(f"Abandoned incomplete clip segment {key[0]}/{key[1]} "
+                           f"({sum(entry['ranges'].values())} of {entry['size']} bytes received)")
+    
+    def path(self, clip_id, number):
+        return os.path.join(self.directory, f"{clip_id}_{number:04d}.seg")
+
+
+def clip_recorder_from_env(client, camera_id):
+    """
+    ClipRecorder + ClipPublisher configured by CLIP_DIR / CLIP_BUFFER_MB / CLIP_BUFFER_FILE /
+    CLIP_PRE_SECONDS / CLIP_POST_SECONDS / CLIP_SEGMENT_SECONDS / CLIP_FPS / CLIP_SCALE / CLIP_CHUNK_KB /
+    CLIP_MAX_CLIPS (100) / CLIP_MAX_MB (1024): oldest clips are deleted beyond these (0 = unlimited)
+    Returns (None, None) when CLIP_DIR is empty
+    """
+    directory = os.getenv("CLIP_DIR", "clips")
+    if not directory:
+        return None, None
+    encoder = FrameEncoder(scale=int(os.getenv("CLIP_SCALE", "2")))
+    publisher = ClipPublisher(client, camera_id, directory, encoder.encoding,
+                              chunk_size=int(os.getenv("CLIP_CHUNK_KB", "64")) * 1024)
+    
+    def on_event(event, clip_id, thumbnail):
+        if thumbnail is not None:
+            publisher.publish_thumbnail(clip_id, thumbnail)
+    
+    recorder = ClipRecorder(
+        camera_id,
+        directory=directory,
+        buffer_bytes=int(float(os.getenv("CLIP_BUFFER_MB", "32")) * (1 << 20)),
+        buffer_path=os.getenv("CLIP_BUFFER_FILE") or None,
+        pre_seconds=float(os.getenv("CLIP_PRE_SECONDS", "5")),
+        post_seconds=float(os.getenv("CLIP_POST_SECONDS", "5")),
+        segment_seconds=float(os.getenv("CLIP_SEGMENT_SECONDS", "10")),
+        fps=float(os.getenv("CLIP_FPS", "10")),
+        max_clips=int(os.getenv("CLIP_MAX_CLIPS", "100")),
+        max_bytes=int(float(os.getenv("CLIP_MAX_MB", "1024")) * (1 << 20)),
+        encoder=encoder,
+        on_segment=publisher.add_segment,
+        on_event=on_event,
+    )
+    logger.info(f"Recording motion clips to {directory}/ ({encoder.encoding}, "
+                f"{recorder.ring.capacity >> 20} MB pre-roll buffer)")
+    return recorder, publisher
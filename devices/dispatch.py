@@ -0,0 +1,292 @@
+"""
+Keyed Message Dispatch
+Moves MQTT message handling off paho's network thread into a bounded pool of
+worker threads, so a slow handler no longer stalls socket I/O and keepalives.
+
+Messages are routed to a worker by hashing their key (a device, room or home),
+so messages with the same key are handled one at a time in arrival order while
+different keys run in parallel. Each worker has a bounded queue; when it is
+full the topic policy decides: KEEP_ALL topics (commands) make the network
+thread wait up to block_timeout, which backs pressure up to the broker over
+TCP, KEEP_LATEST topics (telemetry, status) evict the oldest queued reading of
+the same topic (or else the oldest queued reading at all), which is counted as
+dropped: the newest reading supersedes it, so it is the one worth keeping.
+"""
+
+import os
+import queue
+import threading
+import time
+import logging
+from collections import deque
+from topic_policy import policy_for, KEEP_ALL
+from profiling import get_profiler
+
+logger = logging.getLogger("Dispatch")
+
+
+def topic_key(topic):
+    """
+    Ordering key of a topic: one per room for home/rooms/<room>/..., one per
+    home for homes/<home>/..., otherwise the topic itself (one device stream)
+    """
+    parts = topic.split("/", 3)
+    if len(parts) > 2 and (parts[:2] == ["home", "rooms"]):
+        return f"room:{parts[2]}"
+    if parts[0] == "homes" and len(parts) > 1:
+        return f"home:{parts[1]}"
+    return topic
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _Shard:
+    """One worker thread, its queue and its counters"""
+    
+    def __init__(self, queue_size, samples):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.submitted = 0
+        self.handled = 0
+        self.errors = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+        self.waits = deque(maxlen=samples)      # seconds between submit and start
+        self.runs = deque(maxlen=samples)       # seconds in the handler
+
+
+class KeyedDispatcher:
+    """
+    Bounded worker pool with FIFO order per key
+    
+    Args:
+        name: Name for threads, logs and metrics
+        workers: Number of worker threads
+        queue_size: Queued messages per worker
+        block_timeout: How long submit may block for KEEP_ALL topics before dropping
+        samples: Wait/run times kept per worker for the percentiles
+    """
+    
+    def __init__(self, name="dispatch", workers=2, queue_size=1000, block_timeout=1.0, samples=1024):
+        self.name = name
+        self.block_timeout = block_timeout
+        self.observer = None    # observer(handler, args) runs the handler instead, set by profiling sessions
+        self.shards = [_Shard(queue_size, samples) for _ in range(max(1, workers))]
+        for index, shard in enumerate(self.shards):
+            shard.thread = threading.Thread(target=self._work, args=(shard,), name=f"{name}-worker-{index}",
+                                            daemon=True)
+            shard.thread.start()
+        get_profiler().add_dispatcher(self)
+    
+    def submit(self, key, handler, *args, block=False, latest=None):
+        """
+        Queue handler(*args) behind earlier work with the same key
+        
+        Args:
+            key: Ordering key (hashable)
+            handler: Callable run on a worker thread
+            block: Wait up to block_timeout for room if the worker's queue is full;
+                otherwise an older non-blocking item is evicted to make room
+            latest: Id (the topic) whose older queued item this one supersedes,
+                evicted first when the queue is full
+        
+        Returns:
+            True if queued, False if dropped
+        """
+        shard = self.shards[hash(key) % len(self.shards)]
+        item = (time.perf_counter(), handler, args, not block, latest)
+        try:
+            shard.queue.put_nowait(item)
+        except queue.Full:
+            if not block:
+                shard.dropped += 1      # this item, or the older one it replaces
+                if not self._replace_oldest(shard, item):
+                    return False
+            else:
+                shard.blocked += 1
+                started = time.perf_counter()
+                try:
+                    shard.queue.put(item, timeout=self.block_timeout)
+                except queue.Full:
+                    shard.dropped += 1
+                    logger.warning("%s: worker queue full for %.1fs, dropped message for %s",
+                                   self.name, self.block_timeout, key)
+                    return False
+                finally:
+                    shard.blocked_seconds += time.perf_counter() - started
+        shard.submitted += 1
+        depth = shard.queue.qsize()
+        if depth > shard.max_depth:
+            shard.max_depth = depth
+        return True
+    
+    @staticmethod
+    def _replace_oldest(shard, item):
+        """
+        Swap the oldest evictable queued item (one with the same `latest` id if
+        any) for item. Removing from the middle keeps every key's order intact.
+        
+        Returns:
+            False if only blocking items (commands) are queued
+        """
+        latest = item[4]
+        q = shard.queue
+        with q.mutex:
+            victim = None
+            for index, queued in enumerate(q.queue):
+                if queued is None or not queued[3]:
+                    continue
+                if latest is not None and queued[4] == latest:
+                    victim = index
+                    break
+                if victim is None:
+                    victim = index
+            if victim is None:
+                return False
+            del q.queue[victim]
+            q.queue.append(item)
+            q.unfinished_tasks += 1
+            q.not_empty.notify()
+        return True
+    
+    def _work(self, shard):
+        while True:
+            item = shard.queue.get()
+            if item is None:
+                return
+            submitted, handler, args = item[:3]
+            started = time.perf_counter()
+            shard.waits.append(started - submitted)
+            try:
+                if self.observer is None:
+                    handler(*args)
+                else:
+                    self.observer(handler, args)
+            except Exception:
+                shard.errors += 1
+                logger.exception("%s: handler %s failed", self.name, getattr(handler, "__name__", handler))
+            shard.runs.append(time.perf_counter() - started)
+            shard.handled += 1
+    
+    def depth(self):
+        """Messages waiting over all workers"""
+        return sum(shard.queue.qsize() for shard in self.shards)
+    
+    def stats(self):
+        """Queue depths, counters and wait / handler time percentiles in milliseconds"""
+        waits = [wait for shard in self.shards for wait in list(shard.waits)]
+        runs = [run for shard in self.shards for run in list(shard.runs)]
+        return {
+            "name": self.name,
+            "workers": len(self.shards),
+            "depth": [shard.queue.qsize() for shard in self.shards],
+            "max_depth": max(shard.max_depth for shard in self.shards),
+            "submitted": sum(shard.submitted for shard in self.shards),
+            "handled": sum(shard.handled for shard in self.shards),
+            "errors": sum(shard.errors for shard in self.shards),
+            "dropped": sum(shard.dropped for shard in self.shards),
+            "blocked": sum(shard.blocked for shard in self.shards),
+            "blocked_ms": round(sum(shard.blocked_seconds for shard in self.shards) * 1000, 1),
+            "wait_ms": {"p50": round(_percentile(waits, 0.5) * 1000, 3),
+                        "p95": round(_percentile(waits, 0.95) * 1000, 3),
+                        "max": round(max(waits, default=0.0) * 1000, 3)},
+            "handler_ms": {"p50": round(_percentile(runs, 0.5) * 1000, 3),
+                           "p95": round(_percentile(runs, 0.95) * 1000, 3),
+                           "max": round(max(runs, default=0.0) * 1000, 3)},
+        }
+    
+    def stop(self, timeout=5.0):
+        """Let the workers finish what is queued, then end them"""
+        for shard in self.shards:
+            shard.queue.put(None)
+        deadline = time.monotonic() + timeout
+        for shard in self.shards:
+            shard.thread.join(max(0.0, deadline - time.monotonic()))
+
+
+def dispatch_messages(handler, dispatcher, key=None):
+    """
+    Wrap a paho on_message callback so it runs on the dispatcher's workers
+    
+    Args:
+        handler: Callback with the paho on_message signature
+        dispatcher: KeyedDispatcher, or None to run the handler inline
+        key: Function msg -> ordering key (default: topic_key of the topic)
+    
+    Returns:
+        Callback with the paho on_message signature
+    """
+    if dispatcher is None:
+        return handler
+    key = key or (lambda msg: topic_key(msg.topic))
+    
+    def on_message(client, userdata, msg):
+        dispatcher.submit(key(msg), handler, client, userdata, msg,
+                          block=policy_for(msg.topic).queue_class == KEEP_ALL, latest=msg.topic)
+    
+    return on_message
+
+
+def dispatcher_from_env(name):
+    """
+    KeyedDispatcher configured by DISPATCH_WORKERS (2; 0 handles messages on
+    the network thread as before), DISPATCH_QUEUE_SIZE (1000) and
+    DISPATCH_BLOCK_TIMEOUT (1.0 s). Returns None when disabled.
+    """
+    workers = int(os.getenv("DISPATCH_WORKERS", "2"))
+    if workers <= 0:
+        return None
+    return KeyedDispatcher(name, workers=workers,
+                           queue_size=int(os.getenv("DISPATCH_QUEUE_SIZE", "1000")),
+                           block_timeout=float(os.getenv("DISPATCH_BLOCK_TIMEOUT", "1.0")))
+
+
+def benchmark_dispatch(messages=2000, keys=20, slow_every=50, slow_ms=20.0, workers=4):
+    """
+    Network-thread time per message and per-key ordering with a slow handler
+    
+    Every `slow_every`-th message sleeps `slow_ms` (a disk write). Inline, the
+    submitting thread (paho's network thread) absorbs every sleep; with the
+    dispatcher it only enqueues.
+    
+    Returns:
+        Dictionary with inline and dispatched submit times, total time and whether order held
+    """
+    seen = {}
+    lock = threading.Lock()
+    
+    def handler(key, seq):
+        if seq % slow_every == 0:
+            time.sleep(slow_ms / 1000)
+        with lock:
+            seen.setdefault(key, []).append(seq)
+    
+    started = time.perf_counter()
+    for seq in range(messages):
+        handler(seq % keys, seq)
+    inline = time.perf_counter() - started
+    
+    seen.clear()
+    dispatcher = KeyedDispatcher("benchmark", workers=workers, queue_size=messages)
+    started = time.perf_counter()
+    for seq in range(messages):
+        dispatcher.submit(seq % keys, handler, seq % keys, seq)
+    submit = time.perf_counter() - started
+    dispatcher.stop(timeout=60)
+    total = time.perf_counter() - started
+    ordered = all(values == sorted(values) for values in seen.values()) and sum(map(len, seen.values())) == messages
+    return {
+        "inline_us_per_msg": round(inline / messages * 1e6, 1),
+        "dispatch_submit_us_per_msg": round(submit / messages * 1e6, 1),
+        "dispatch_total_ms": round(total * 1000, 1),
+        "inline_total_ms": round(inline * 1000, 1),
+        "per_key_order_kept": ordered,
+        "stats": dispatcher.stats(),
+    }
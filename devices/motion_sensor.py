@@ -3,12 +3,12 @@ Motion Sensor Device
 Publishes motion detection events to MQTT broker
 """
 
-import time
 import random
 import json
 import os
 import logging
-from utils import create_mqtt_client, connect_with_retry
+from utils import create_mqtt_client, connect_with_retry, publish
+import sim_clock as clock
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("MotionSensor")
@@ -53,25 +53,25 @@ def run_motion_sensor():
                 "sensor": "motion",
                 "value": motion_detected,
                 "status": motion_status,
-                "timestamp": time.time()
+                "timestamp": clock.time()
             }
             
             # Publish to MQTT topic
-            result = client.publish(topic, json.dumps(payload), qos=1)
+            result = publish(client, topic, json.dumps(payload))
             
             if result.rc == 0:
                 icon = "🚶" if motion_detected == 1 else "🚫"
-                logger.info(f"📤 Published: {icon} {motion_status} to {topic}")
+                logger.info("📤 Published: %s %s to %s", icon, motion_status, topic)
             else:
-                logger.error(f"Failed to publish. RC: {result.rc}")
+                logger.error("Failed to publish. RC: %s", result.rc)
             
             # Wait before next reading
-            time.sleep(interval)
+            clock.sleep(interval)
             
     except KeyboardInterrupt:
         logger.info("Shutting down motion sensor...")
     except Exception as e:
-        logger.error(f"Error: {e}")
+        logger.error("Error: %s", e)
     finally:
         client.loop_stop()
         client.disconnect()
@@ -0,0 +1,193 @@
+"""
+MQTT 5 Support
+Topic aliases for hot topics, user properties for trace/format metadata and
+receive-maximum flow control for clients created with MQTT_VERSION=5
+"""
+
+import os
+import uuid
+import logging
+import threading
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+
+logger = logging.getLogger("MQTT5")
+
+
+def connect_properties(receive_maximum=20, session_expiry=3600):
+    """CONNECT properties: flow control window and how long the broker keeps our session"""
+    props = Properties(PacketTypes.CONNECT)
+    props.ReceiveMaximum = receive_maximum
+    if session_expiry:
+        props.SessionExpiryInterval = session_expiry
+    return props
+
+
+class Mqtt5Publisher:
+    """
+    Per-connection MQTT 5 publish state
+    
+    Topic aliases are negotiated per connection: the broker announces how many it
+    accepts in CONNACK (TopicAliasMaximum). The first publish on a topic carries the
+    full topic plus an alias number; later publishes send an empty topic and only
+    the 2 byte alias. Aliases are only used for QoS 0 messages, because paho
+    re-sends stored QoS 1/2 packets verbatim after a reconnect, when the aliases
+    of the old connection no longer exist.
+    """
+    
+    def __init__(self, content_type="application/json", trace=False, static_user_properties=None):
+        self.content_type = content_type
+        self.trace = trace
+        self.static_user_properties = list(static_user_properties or [])
+        self.alias_maximum = 0
+        self.aliases = {}
+        # Held across prepare() + client.publish() so an alias is never used on
+        # the wire before the packet that establishes it
+        self.lock = threading.Lock()
+        self._cache = {}   # (alias, expiry) -> Properties, unless every message gets its own trace id
+    
+    def on_connack(self, properties):
+        """Reset aliases for the new connection and read the broker's limit"""
+        self.aliases = {}
+        self._cache = {}
+        self.alias_maximum = getattr(properties, "TopicAliasMaximum", 0) if properties else 0
+        if self.alias_maximum:
+            logger.info(f"Broker accepts {self.alias_maximum} topic aliases")
+    
+    def prepare(self, topic, qos, expiry=None):
+        """
+        Build the topic and PUBLISH properties to send
+        
+        Args:
+            topic: Full topic name
+            qos: QoS the message is published with
+            expiry: Message expiry interval in seconds, or None
+        
+        Returns:
+            (topic_to_send, properties) -- topic_to_send is "" once an alias is established
+        """
+        alias = None
+        send_topic = topic
+        
+        if qos == 0 and self.alias_maximum:
+            alias = self.aliases.get(topic)
+            if alias is not None:
+                send_topic = ""
+            elif len(self.aliases) < self.alias_maximum:
+                alias = len(self.aliases) + 1
+                self.aliases[topic] = alias
+        
+        if not self.trace:
+            key = (alias, expiry)
+            props = self._cache.get(key)
+            if props is None:
+                props = self._cache[key] = self._build(alias, expiry, None)
+            return send_topic, props
+        
+        return send_topic, self._build(alias, expiry, uuid.uuid4().hex[:16])
+    
+    def _build(self, alias, expiry, trace_id):
+        props = Properties(PacketTypes.PUBLISH)
+        if self.content_type:
+            props.PayloadFormatIndicator = 1
+            props.ContentType = self.content_type
+        if alias:
+            props.TopicAlias = alias
+        if expiry is not None:
+            props.MessageExpiryInterval = int(expiry)
+        user_properties = list(self.static_user_properties)
+        if trace_id:
+            user_properties.append(("trace_id", trace_id))
+        if user_properties:
+            props.UserProperty = user_properties
+        return props
+
+
+def publisher_from_env(client_id):
+    """Create the Mqtt5Publisher configured by MQTT_TRACE / MQTT_USER_PROPERTIES"""
+    static = [("source", client_id)]
+    extra = os.getenv("MQTT_USER_PROPERTIES", "")
+    for item in filter(None, extra.split(",")):
+        key, _, value = item.partition("=")
+        static.append((key.strip(), value.strip()))
+    return Mqtt5Publisher(trace=os.getenv("MQTT_TRACE", "0") == "1", static_user_properties=static)
+
+
+def _varint_len(value):
+    length = 1
+    while value >= 128:
+        value //= 128
+        length += 1
+    return length
+
+
+def publish_packet_size(topic, payload, qos=0, properties=None, mqtt5=True):
+    """Size in bytes of a PUBLISH packet on the wire"""
+    topic_bytes = len(topic.encode("utf-8"))
+    remaining = 2 + topic_bytes + len(payload)
+    if qos > 0:
+        remaining += 2
+    if mqtt5:
+        props = properties.pack() if properties is not None else b"\x00"
+        remaining += len(props)
+    return 1 + _varint_len(remaining) + remaining
+
+
+def measure_alias_savings(topics, payload, messages_per_topic=100, alias_maximum=10, qos=0):
+    """
+    Compare bytes on the wire for MQTT 3.1.1, MQTT 5 without aliases and MQTT 5 with aliases
+    
+    Args:
+        topics: Topics that are published repeatedly
+        payload: Example payload (bytes or str)
+        messages_per_topic: Publishes per topic
+        alias_maximum: TopicAliasMaximum announced by the broker
+    
+    Returns:
+        Dictionary with total bytes per mode and per-message savings
+    """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    
+    plain = Mqtt5Publisher(content_type=None)
+    aliased = Mqtt5Publisher(content_type=None)
+    aliased.alias_maximum = alias_maximum
+    
+    totals = {"mqtt311": 0, "mqtt5": 0, "mqtt5_alias": 0}
+    count = 0
+    for _ in range(messages_per_topic):
+        for topic in topics:
+            totals["mqtt311"] += publish_packet_size(topic, payload, qos, mqtt5=False)
+            _, props = plain.prepare(topic, qos)
+            totals["mqtt5"] += publish_packet_size(topic, payload, qos, _strip(props))
+            send_topic, props = aliased.prepare(topic, qos)
+            totals["mqtt5_alias"] += publish_packet_size(send_topic, payload, qos, _strip(props))
+            count += 1
+    
+    return {
+        "messages": count,
+        "bytes": totals,
+        "bytes_per_message": {mode: round(total / count, 1) for mode, total in totals.items()},
+        "saved_per_message_vs_311": round((totals["mqtt311"] - totals["mqtt5_alias"]) / count, 1),
+        "saved_percent_vs_311": round(100 * (1 - totals["mqtt5_alias"] / totals["mqtt311"]), 1),
+    }
+
+
+def _strip(props):
+    """Drop format metadata so the measurement isolates the alias effect"""
+    clean = Properties(PacketTypes.PUBLISH)
+    if hasattr(props, "TopicAlias"):
+        clean.TopicAlias = props.TopicAlias
+    return clean
+
+
+if __name__ == "__main__":
+    hot_topics = [
+        "home/sensor/temperature",
+        "home/security/camera/status",
+        "home/thermostat/status",
+        "home/security/motion",
+    ]
+    example = '{"sensor": "temperature", "value": 24.5, "unit": "C", "timestamp": 1700000000.0}'
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"📊 {measure_alias_savings(hot_topics, example)}")
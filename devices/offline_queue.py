@@ -0,0 +1,255 @@
+"""
+Offline Publish Queue
+Bounded per-client buffer for messages published while the broker is unreachable
+Drop policy comes from the topic policy table: telemetry/status keep only the latest
+value per topic, commands keep every message
+"""
+
+import os
+import time
+import random
+import threading
+import logging
+from collections import deque, OrderedDict
+from topic_policy import policy_for, KEEP_LATEST
+
+logger = logging.getLogger("OfflineQueue")
+
+
+def _count_readable(path):
+    """Messages that can be read from a spill file, up to a partial or corrupt tail"""
+    from traffic_log import read_log
+    count = 0
+    try:
+        for _ in read_log(path):
+            count += 1
+    except (OSError, ValueError) as e:
+        logger.warning(f"Spill file {path} is damaged after {count} message(s): {e}")
+    return count
+
+
+class OfflineQueue:
+    """
+    Bounded offline queue with per-topic-class drop policy
+    
+    - KEEP_LATEST topics hold one message per topic (at most max_topics topics),
+      drained highest policy priority first
+    - KEEP_ALL topics hold up to max_messages in memory; beyond that they spill to
+      spill_path if configured, otherwise the oldest message is dropped
+    On reconnect the backlog drains at drain_rate messages per second after a random
+    start delay, so a fleet reconnecting together does not flush all at once.
+    """
+    
+    def __init__(self, max_messages=1000, max_topics=1000, spill_path=None,
+                 drain_rate=50.0, drain_jitter=0.5, topic_policy=policy_for):
+        self.max_messages = max_messages
+        self.max_topics = max_topics
+        self.spill_path = spill_path
+        self.drain_rate = drain_rate
+        self.drain_jitter = drain_jitter
+        self.topic_policy = topic_policy
+        
+        self._latest = {}              # priority -> OrderedDict(topic -> (payload, qos, retain))
+        self._latest_count = 0
+        self._messages = deque()       # (topic, payload, qos, retain)
+        self._lock = threading.Lock()
+        self._spill_writer = None
+        self._spill_reader = None
+        self._spilled = 0
+        self._writer_count = 0         # messages in the spill file being written
+        self._draining_left = 0        # messages not yet read from the spill file being drained
+        self._drain_thread = None
+        
+        self.dropped = 0
+        self.queued = 0
+        self.sent = 0
+        
+        if spill_path:
+            self._recover_spill()
+    
+    def _recover_spill(self):
+        """Pick up spill files left by a previous run: the one being drained first, then the one being written"""
+        from traffic_log import TrafficRecorder, read_log
+        draining = self.spill_path + ".draining"
+        if os.path.exists(draining):
+            count = _count_readable(draining)
+            if count:
+                self._spilled += count
+                self._draining_left = count
+                self._spill_reader = read_log(draining)
+        if os.path.exists(self.spill_path):
+            count = _count_readable(self.spill_path)
+            try:
+                # Keep appending behind the backlog so order is preserved; a partial
+                # last record from the crash is cut off first
+                writer = TrafficRecorder(self.spill_path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Spill file {self.spill_path} is corrupt, moving it aside: {e}")
+                os.replace(self.spill_path, self.spill_path + ".corrupt")
+            else:
+                if count:
+                    self._spilled += count
+                    self._writer_count = count
+                    self._spill_writer = writer
+                else:
+                    writer.close()
+        if self._spilled:
+            logger.info(f"♻️ Recovered {self._spilled} spilled message(s) from a previous run")
+    
+    def __len__(self):
+        with self._lock:
+            return self._latest_count + len(self._messages) + self._spilled
+    
+    def pending(self):
+        """True while there is a backlog that must be sent before new messages"""
+        return len(self) > 0
+    
+    def put(self, topic, payload, qos=0, retain=False):
+        """Queue a message according to its topic's drop policy"""
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        
+        with self._lock:
+            self.queued += 1
+            
+            policy = self.topic_policy(topic)
+            if policy.queue_class == KEEP_LATEST:
+                latest = self._latest.setdefault(policy.priority, OrderedDict())
+                if topic in latest:
+                    self.dropped += 1  # superseded by this newer value
+                    latest.move_to_end(topic)
+                else:
+                    if self._latest_count >= self.max_topics:
+                        # Evict the oldest entry of the least important class
+                        lowest = min(p for p, entries in self._latest.items() if entries)
+                        self._latest[lowest].popitem(last=False)
+                        self._latest_count -= 1
+                        self.dropped += 1
+                    self._latest_count += 1
+                latest[topic] = (payload, qos, retain)
+                return
+            
+            # Once spilling, keep spilling so order is preserved
+            if self._spill_writer is not None or len(self._messages) >= self.max_messages:
+                if self.spill_path:
+                    self._spill(topic, payload, qos, retain)
+                    return
+                self._messages.popleft()
+                self.dropped += 1
+            self._messages.append((topic, payload, qos, retain))
+    
+    def _spill(self, topic, payload, qos, retain):
+        if self._spill_writer is None:
+            from traffic_log import TrafficRecorder
+            self._spill_writer = TrafficRecorder(self.spill_path)
+        self._spill_writer.record(topic, payload, qos, retain)
+        self._spilled += 1
+        self._writer_count += 1
+    
+    def _pop(self):
+        """Next message to send: spilled backlog and commands first, then latest telemetry"""
+        with self._lock:
+            if self._spill_reader is None and not self._messages and self._spill_writer is not None:
+                # Memory is empty: replay what was spilled while new commands go to memory again
+                from traffic_log import read_log
+                self._spill_writer.close()
+                self._spill_writer = None
+                draining = self.spill_path + ".draining"
+                os.replace(self.spill_path, draining)
+                self._spill_reader = read_log(draining)
+                self._draining_left = self._writer_count
+                self._writer_count = 0
+            
+            if self._spill_reader is not None:
+                try:
+                    msg = next(self._spill_reader, None)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Spilled messages are unreadable, dropping the rest of the file: {e}")
+                    msg = None
+                if msg is not None:
+                    self._spilled -= 1
+                    self._draining_left -= 1
+                    return msg.topic, msg.payload, msg.qos, msg.retain
+                if self._draining_left:
+                    # Counted but unreadable (corrupt file): lost
+                    self._spilled -= self._draining_left
+                    self.dropped += self._draining_left
+                    self._draining_left = 0
+                # Messages spilled to a new file meanwhile are still counted in _spilled
+                self._spill_reader = None
+                os.remove(self.spill_path + ".draining")
+            
+            if self._messages:
+                return self._messages.popleft()
+            
+            for priority in sorted(self._latest, reverse=True):
+                latest = self._latest[priority]
+                if latest:
+                    topic, (payload, qos, retain) = latest.popitem(last=False)
+                    self._latest_count -= 1
+                    return topic, payload, qos, retain
+            
+            # Empty: the drainer exits, the next put() starts a new one
+            self._drain_thread = None
+            return None
+    
+    def start_drain(self, client):
+        """Start draining the backlog to a (re)connected client in the background"""
+        if not self.pending():
+            return
+        with self._lock:
+            if self._drain_thread is not None and self._drain_thread.is_alive():
+                return
+            self._drain_thread = threading.Thread(target=self._drain, args=(client,),
+                                                  name="OfflineQueueDrain", daemon=True)
+            self._drain_thread.start()
+    
+    def _drain(self, client):
+        time.sleep(random.uniform(0, self.drain_jitter))
+        interval = 1.0 / self.drain_rate if self.drain_rate > 0 else 0.0
+        next_send = time.monotonic()
+        count = 0
+        
+        while True:
+            if not client.is_connected():
+                # Connection dropped again, the next on_connect restarts draining
+                with self._lock:
+                    self._drain_thread = None
+                break
+            try:
+                item = self._pop()
+            except OSError as e:
+                # Spill file trouble (disk full, removed): retry on the next connect
+                logger.error(f"Offline queue drain failed: {e}")
+                with self._lock:
+                    self._drain_thread = None
+                break
+            if item is None:
+                break
+            
+            topic, payload, qos, retain = item
+            mqtt5 = getattr(client, "mqtt5", None)
+            if mqtt5 is not None:
+                with mqtt5.lock:
+                    send_topic, properties = mqtt5.prepare(topic, qos, self.topic_policy(topic).expiry)
+                    client.publish(send_topic, payload, qos=qos, retain=retain, properties=properties)
+            else:
+                client.publish(topic, payload, qos=qos, retain=retain)
+            self.sent += 1
+            count += 1
+            
+            next_send += interval
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        
+        if count:
+            logger.info(f"📤 Drained {count} queued message(s), {len(self)} still queued, {self.dropped} dropped")
+    
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "pending": len(self),
+        }
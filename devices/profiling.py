@@ -0,0 +1,464 @@
+"""
+On-demand profiling for long-running processes
+Profiles a running device, controller or proxy for N seconds without a
+restart, triggered by a signal, an admin MQTT topic or an HTTP endpoint:
+
+    cpu       sampling profiler over all threads (sys._current_frames)
+    cprofile  deterministic cProfile of the MQTT message callbacks
+    timing    per-topic handler timing table
+    memory    tracemalloc snapshot at start and end, top allocation diffs
+
+cpu and cprofile sessions include the handler timing table. Nothing is
+installed while no session runs: the timing wrapper replaces the client's
+message dispatch only for the session's duration, and tracemalloc is started
+and stopped with the memory session.
+
+Triggers:
+    SIGUSR1                                  PROFILE_SIGNAL_ACTION (cpu) for PROFILE_SECONDS (30)
+    SIGUSR2                                  memory for PROFILE_SECONDS
+    <PROFILE_ADMIN_TOPIC>[/<name>]           {"action": "cpu", "seconds": 10}; the result is
+                                             published on <PROFILE_ADMIN_TOPIC>/<name>/result
+    POST /api/admin/profile (proxy)          same body, "wait": true returns the result inline
+
+The remote triggers are off by default, as anyone who can publish to the
+broker or reach the proxy could otherwise start sessions: set
+PROFILE_ADMIN_TOPIC (e.g. home/admin/profile) for the MQTT one, PROFILE_HTTP
+(plus optionally PROFILE_TOKEN) for the proxy's. Results (report text plus the
+path of the full output) are also written to PROFILE_DIR (default "profiles").
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter, deque
+
+logger = logging.getLogger("Profiling")
+
+ACTIONS = ("cpu", "cprofile", "timing", "memory")
+ADMIN_TOPIC = os.getenv("PROFILE_ADMIN_TOPIC", "")
+
+
+class HandlerTiming:
+    """Call count, total and maximum time per topic and handler"""
+    
+    def __init__(self):
+        self.rows = {}      # (topic, handler name) -> [count, total ns, max ns]
+        self._lock = threading.Lock()
+    
+    def record(self, topic, elapsed, handler):
+        with self._lock:
+            row = self.rows.get((topic, handler))
+            if row is None:
+                row = self.rows[(topic, handler)] = [0, 0, 0]
+            row[0] += 1
+            row[1] += elapsed
+            if elapsed > row[2]:
+                row[2] = elapsed
+    
+    def table(self):
+        """Rows sorted by total time, as dictionaries"""
+        with self._lock:
+            rows = sorted(self.rows.items(), key=lambda item: item[1][1], reverse=True)
+        grand = sum(row[1] for _, row in rows) or 1
+        return [{
+            "topic": topic,
+            "handler": handler,
+            "calls": count,
+            "total_ms": round(total / 1e6, 3),
+            "mean_us": round(total / count / 1e3, 1),
+            "max_us": round(peak / 1e3, 1),
+            "share": round(total / grand, 3),
+        } for (topic, handler), (count, total, peak) in rows]
+    
+    def render(self):
+        lines = [f"{'topic':44s} {'handler':48s} {'calls':>7s} {'total ms':>10s} {'mean us':>9s} {'max us':>9s}"]
+        for row in self.table():
+            lines.append(f"{row['topic'][:44]:44s} {row['handler'][:48]:48s} {row['calls']:7d} "
+                         f"{row['total_ms']:10.2f} {row['mean_us']:9.1f} {row['max_us']:9.1f}")
+        return "\n".join(lines)
+
+
+class Profiler:
+    """
+    One per process: the registered MQTT clients and dispatch pools, and at
+    most one session
+    
+    Sessions run in their own thread for `seconds` (or until stop()) and
+    leave a result dictionary in `results`. Handlers moved off the network
+    thread by a KeyedDispatcher are timed on its workers (rows named
+    "<pool>:<handler>"); the network thread row then only shows the enqueue.
+    """
+    
+    def __init__(self, name=None, output_dir=None):
+        self.name = name
+        self.output_dir = output_dir or os.getenv("PROFILE_DIR", "profiles")
+        self.clients = []
+        self.dispatchers = weakref.WeakSet()
+        self.results = deque(maxlen=10)
+        self.session = None         # (action, stop event, thread)
+        self.on_result = []         # callbacks(result), e.g. publish to the admin topic
+        self._lock = threading.Lock()
+    
+    # Client instrumentation
+    
+    def add_client(self, client):
+        self.clients.append(client)
+    
+    def add_dispatcher(self, dispatcher):
+        self.dispatchers.add(dispatcher)
+    
+    def _instrument(self, timing, cprofiles):
+        """Wrap each client's message dispatch (all on_message and per-topic callbacks) and dispatch workers"""
+        for client in self.clients:
+            # paho calls _handle_on_message for every received message; shadowing it with an
+            # instance attribute and deleting that afterwards leaves the client untouched
+            dispatch = client._handle_on_message
+            client._handle_on_message = self._timed_dispatch(client, dispatch, timing, cprofiles)
+        for dispatcher in list(self.dispatchers):
+            dispatcher.observer = self._timed_worker(dispatcher.name, timing, cprofiles)
+    
+    def _uninstrument(self):
+        for client in self.clients:
+            client.__dict__.pop("_handle_on_message", None)
+        for dispatcher in list(self.dispatchers):
+            dispatcher.observer = None
+    
+    @staticmethod
+    def _run_timed(timing, cprofiles, topic, name, call, *args):
+        """call(*args), timed under (topic, name) and profiled when cprofiles is a dict"""
+        profile = None
+        if cprofiles is not None:
+            ident = threading.get_ident()
+            profile = cprofiles.get(ident)
+            if profile is None:
+                profile = cprofiles[ident] = cProfile.Profile()
+            profile.enable()
+        started = time.perf_counter_ns()
+        try:
+            return call(*args)
+        finally:
+            elapsed = time.perf_counter_ns() - started
+            if profile is not None:
+                profile.disable()
+            timing.record(topic, elapsed, name)
+    
+    @staticmethod
+    def _handler_name(client, topic):
+        callbacks = list(client._on_message_filtered.iter_match(topic)) or [client.on_message]
+        return ",".join(getattr(callback, "__qualname__", repr(callback)) for callback in callbacks if callback)
+    
+    def _timed_dispatch(self, client, dispatch, timing, cprofiles):
+        names = {}
+        
+        def timed(message):
+            topic = message.topic
+            name = names.get(topic)
+            if name is None:
+                name = names[topic] = self._handler_name(client, topic)
+            self._run_timed(timing, cprofiles, topic, name, dispatch, message)
+        
+        return timed
+    
+    def _timed_worker(self, pool, timing, cprofiles):
+        def observe(handler, args):
+            # dispatch_messages passes (client, userdata, msg); other users pass the topic first
+            message = args[2] if len(args) > 2 else None
+            topic = getattr(message, "topic", None) or (args[0] if args and isinstance(args[0], str) else "?")
+            name = f"{pool}:{getattr(handler, '__qualname__', handler)}"
+            self._run_timed(timing, cprofiles, topic, name, handler, *args)
+        
+        return observe
+    
+    # Sessions
+    
+    def start(self, action, seconds=30.0, interval=0.005, top=25, on_done=None):
+        """
+        Start a session in the background
+        
+        Args:
+            action: One of ACTIONS
+            seconds: Session length
+            interval: Sampling interval of the cpu profiler
+            top: Entries in the report
+            on_done: Called with the result dictionary
+        
+        Returns:
+            {"status": "started", ...} or {"status": "busy"/"error", ...}
+        """
+        if action not in ACTIONS:
+            return {"status": "error", "message": f"Unknown action {action}, expected one of {', '.join(ACTIONS)}"}
+        seconds = max(0.1, min(float(seconds), 3600.0))
+        with self._lock:
+            if self.session is not None:
+                return {"status": "busy", "action": self.session[0]}
+            stop = threading.Event()
+            thread = threading.Thread(target=self._run, args=(action, seconds, float(interval), int(top), stop, on_done),
+                                      name=f"Profiler-{action}", daemon=True)
+            self.session = (action, stop, thread)
+        thread.start()
+        return {"status": "started", "action": action, "seconds": seconds}
+    
+    def stop(self):
+        """End the running session early (its result is still produced)"""
+        session = self.session
+        if session is None:
+            return {"status": "idle"}
+        session[1].set()
+        return {"status": "stopping", "action": session[0]}
+    
+    def wait(self, timeout=None):
+        """Block until the running session finished, returns its result"""
+        session = self.session
+        if session is not None:
+            session[2].join(timeout)
+        return self.results[-1] if self.results else None
+    
+    def status(self):
+        session = self.session
+        return {
+            "name": self.name,
+            "running": session[0] if session else None,
+            "clients": len(self.clients),
+            "results": [{key: result[key] for key in ("action", "started", "seconds", "file")} for result in self.results],
+        }
+    
+    def _run(self, action, seconds, interval, top, stop, on_done):
+        started = time.time()
+        try:
+            if action == "cpu":
+                report, data, ext = self._run_cpu(seconds, interval, top, stop)
+            elif action == "cprofile":
+                report, data, ext = self._run_cprofile(seconds, top, stop)
+            elif action == "timing":
+                report, data, ext = self._run_timing(seconds, stop)
+            else:
+                report, data, ext = self._run_memory(seconds, top, stop)
+            result = {"action": action, "started": started, "seconds": round(time.time() - started, 2),
+                      "report": report, "file": self._write(action, started, data, ext)}
+        except Exception as e:
+            logger.error("Profiling session %s failed: %s", action, e)
+            result = {"action": action, "started": started, "seconds": round(time.time() - started, 2),
+                      "report": f"failed: {e}", "file": None}
+        finally:
+            self._uninstrument()
+            with self._lock:
+                self.session = None
+        self.results.append(result)
+        logger.info("📊 Profiling %s finished (%.1fs): %s", action, result["seconds"], result["file"])
+        for callback in [on_done] + self.on_result:
+            if callback is not None:
+                try:
+                    callback(result)
+                except Exception as e:
+                    logger.error("Profiling result callback failed: %s", e)
+    
+    def _timed_session(self, seconds, stop, cprofiles=None):
+        timing = HandlerTiming()
+        self._instrument(timing, cprofiles)
+        stop.wait(seconds)
+        self._uninstrument()
+        return timing
+    
+    def _run_timing(self, seconds, stop):
+        timing = self._timed_session(seconds, stop)
+        report = timing.render()
+        return report, report, "txt"
+    
+    def _run_cprofile(self, seconds, top, stop):
+        cprofiles = {}
+        timing = self._timed_session(seconds, stop, cprofiles)
+        stats = None
+        for profile in cprofiles.values():
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats is None:
+            return "no messages handled\n\n" + timing.render(), None, None
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(top)
+        path = self._path("cprofile", time.time(), "pstats")
+        stats.dump_stats(path)
+        return out.getvalue() + "\n" + timing.render(), path, None
+    
+    def _run_cpu(self, seconds, interval, top, stop):
+        timing = HandlerTiming()
+        self._instrument(timing, None)
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while not stop.wait(interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < 64:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+        self._uninstrument()
+        
+        leaves = Counter()
+        functions = Counter()
+        for stack, count in stacks.items():
+            leaves[stack[-1]] += count
+            for function in set(frame.rsplit(":", 1)[0] for frame in stack[1:]):
+                functions[function] += count
+        total = sum(stacks.values()) or 1
+        lines = [f"{samples} samples every {interval * 1000:.1f} ms over all threads", "", "Self (leaf lines):"]
+        lines += [f"  {count / total:6.1%}  {leaf}" for leaf, count in leaves.most_common(top)]
+        lines += ["", "Cumulative (functions on the stack):"]
+        lines += [f"  {count / total:6.1%}  {function}" for function, count in functions.most_common(top)]
+        lines += ["", timing.render()]
+        # Collapsed stacks, one per line: input for flamegraph.pl / speedscope
+        folded = "\n".join(f"{';'.join(stack)} {count}" for stack, count in stacks.most_common())
+        return "\n".join(lines), folded, "folded"
+    
+    def _run_memory(self, seconds, top, stop):
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1")))
+        # Leave out what taking the snapshots allocates
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        try:
+            before = tracemalloc.take_snapshot().filter_traces(ignore)
+            stop.wait(seconds)
+            after = tracemalloc.take_snapshot().filter_traces(ignore)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+        lines = [f"traced now {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB", "", "Top allocation changes:"]
+        lines += [f"  {stat}" for stat in after.compare_to(before, "lineno")[:top]]
+        lines += ["", "Top allocations:"]
+        lines += [f"  {stat}" for stat in after.statistics("lineno")[:top]]
+        path = self._path("memory", time.time(), "tracemalloc")
+        after.dump(path)
+        return "\n".join(lines), path, None
+    
+    def _path(self, action, started, ext):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+        return os.path.join(self.output_dir, f"{self.name or os.getpid()}-{action}-{stamp}.{ext}")
+    
+    def _write(self, action, started, data, ext):
+        """Write data (unless it is already a written file's path), returns the path"""
+        if ext is None:
+            return data
+        path = self._path(action, started, ext)
+        with open(path, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+        return path
+    
+    # Commands (MQTT and HTTP triggers)
+    
+    def handle_command(self, command, on_done=None):
+        """
+        Run an admin command
+        
+        Args:
+            command: {"action": "cpu"|"cprofile"|"timing"|"memory"|"stop"|"status", "seconds": 30,
+                      "interval": 0.005, "top": 25}
+            on_done: Called with the session result
+        
+        Returns:
+            Immediate reply dictionary
+        """
+        action = str(command.get("action", "status")).lower()
+        if action == "status":
+            return self.status()
+        if action == "stop":
+            return self.stop()
+        return self.start(action, seconds=command.get("seconds", os.getenv("PROFILE_SECONDS", "30")),
+                          interval=command.get("interval", 0.005), top=command.get("top", 25), on_done=on_done)
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """The process-wide Profiler"""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = Profiler(name=os.getenv("PROFILE_NAME") or None)
+    return _profiler
+
+
+def attach_client(client, client_id):
+    """
+    Register an MQTT client for handler timing
+    
+    When PROFILE_ADMIN_TOPIC is set, the first client of the process also
+    serves it; the process answers to <topic> and <topic>/<name>, where name
+    is PROFILE_NAME or that client's id.
+    
+    Returns:
+        Topics the client should subscribe to
+    """
+    profiler = get_profiler()
+    profiler.add_client(client)
+    if not ADMIN_TOPIC or len(profiler.clients) > 1:
+        return []
+    if profiler.name is None:
+        profiler.name = client_id
+    result_topic = f"{ADMIN_TOPIC}/{profiler.name}/result"
+    
+    def reply(message):
+        from utils import publish
+        publish(client, result_topic, json.dumps(message, default=str), qos=1, retain=False)
+    
+    def on_admin(client, userdata, msg):
+        try:
+            command = json.loads(msg.payload.decode() or "{}")
+        except ValueError:
+            command = {"action": msg.payload.decode(errors="replace").strip()}
+        logger.info("📊 Profiling command on %s: %s", msg.topic, command)
+        reply(profiler.handle_command(command, on_done=reply))
+    
+    topics = [ADMIN_TOPIC, f"{ADMIN_TOPIC}/{profiler.name}"]
+    for topic in topics:
+        client.message_callback_add(topic, on_admin)
+    return topics
+
+
+def install_signal_handlers():
+    """
+    SIGUSR1 starts PROFILE_SIGNAL_ACTION (cpu), SIGUSR2 a memory session, each
+    for PROFILE_SECONDS; sending the signal again during a session ends it.
+    Only possible from the main thread, a no-op elsewhere.
+    """
+    if threading.current_thread() is not threading.main_thread() or not hasattr(signal, "SIGUSR1"):
+        return False
+    profiler = get_profiler()
+    seconds = float(os.getenv("PROFILE_SECONDS", "30"))
+    
+    def handler(action):
+        def on_signal(signum, frame):
+            # Signal handlers must not block: starting a session only spawns its thread
+            if profiler.session is not None:
+                profiler.stop()
+            else:
+                profiler.start(action, seconds)
+        return on_signal
+    
+    signal.signal(signal.SIGUSR1, handler(os.getenv("PROFILE_SIGNAL_ACTION", "cpu")))
+    signal.signal(signal.SIGUSR2, handler("memory"))
+    return True
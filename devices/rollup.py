@@ -0,0 +1,396 @@
+"""
+Streaming Rollup Service
+Rolling per-room statistics over sliding windows (1 min / 15 min / 1 h by default):
+min, max, mean and percentiles of temperature, and motion event counts
+
+Every window is split into `slices` time slices. A reading only updates the
+current slice and the window's running count, sum and histogram; when a slice
+leaves the window its totals are subtracted again. Min and max come from
+monotonic deques over the closed slices. Percentiles come from a histogram
+with fixed bins of `resolution` (0.1 °C), which can be merged across slices,
+windows or rooms by adding counts. The cost of a reading does not depend on the
+window length, and memory per window is bounded by the slice count.
+
+Results are published retained on home/stats/rooms/<room>.
+"""
+
+import os
+import json
+import math
+import time
+import threading
+import logging
+from collections import deque
+from utils import create_mqtt_client, connect_with_retry, add_subscriptions, publish
+import sim_clock as clock
+
+logger = logging.getLogger("Rollup")
+
+STATS_PREFIX = "home/stats/"
+
+# Single-home devices (home/sensor/...) are reported as this room
+DEFAULT_ROOM = "home"
+
+DEFAULT_WINDOWS = (("1m", 60.0), ("15m", 900.0), ("1h", 3600.0))
+
+PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+# Topic -> (room, metric)
+ROLLUP_TOPICS = [
+    "home/sensor/temperature",
+    "home/sensor/motion",
+    "home/rooms/+/temperature",
+    "home/rooms/+/motion",
+]
+
+
+def room_metric(topic):
+    """home/rooms/kitchen/temperature -> ("kitchen", "temperature"), home/sensor/motion -> ("home", "motion")"""
+    parts = topic.split("/")
+    if len(parts) == 4 and parts[1] == "rooms":
+        return parts[2], parts[3]
+    if len(parts) == 3 and parts[1] == "sensor":
+        return DEFAULT_ROOM, parts[2]
+    return None
+
+
+def parse_windows(spec):
+    """'1m=60,15m=900' -> (("1m", 60.0), ("15m", 900.0))"""
+    windows = []
+    for entry in spec.split(","):
+        if entry.strip():
+            name, seconds = entry.split("=", 1)
+            windows.append((name.strip(), float(seconds)))
+    return tuple(windows)
+
+
+def hist_percentiles(hist, count, resolution, fractions=PERCENTILES):
+    """
+    Percentiles of a {bin: count} histogram holding `count` values
+    Values are reported as bin centres, so the error is at most resolution / 2
+    """
+    result = {}
+    if not count:
+        return dict.fromkeys((name for name, _ in fractions))
+    targets = [(name, max(1, math.ceil(fraction * count))) for name, fraction in fractions]
+    seen = 0
+    pending = iter(targets)
+    name, target = next(pending)
+    for bin_ in sorted(hist):
+        seen += hist[bin_]
+        while seen >= target:
+            result[name] = round(bin_ * resolution, 6)
+            try:
+                name, target = next(pending)
+            except StopIteration:
+                return result
+    return result
+
+
+class _Slice:
+    """Totals of one closed time slice"""
+    
+    __slots__ = ("index", "count", "total", "hist")
+    
+    def __init__(self, index, count, total, hist):
+        self.index = index
+        self.count = count
+        self.total = total
+        self.hist = hist
+
+
+class SlidingWindow:
+    """
+    Count, mean, min, max and percentiles of the values of the last `seconds`
+    
+    Args:
+        seconds: Window length
+        slices: Time slices per window; the window edge moves in steps of seconds / slices
+        resolution: Histogram bin width, None to keep no histogram (counts only)
+    """
+    
+    __slots__ = ("width", "slices", "resolution", "count", "total", "hist", "closed", "mins", "maxs",
+                 "current", "cur_count", "cur_total", "cur_min", "cur_max", "cur_hist")
+    
+    def __init__(self, seconds, slices=30, resolution=0.1):
+        self.width = seconds / slices
+        self.slices = slices
+        self.resolution = resolution
+        # Whole window, current slice included
+        self.count = 0
+        self.total = 0.0
+        self.hist = {}
+        # Closed slices still inside the window, and monotonic deques of (slice index, value)
+        self.closed = deque()
+        self.mins = deque()     # increasing values: front is the window minimum
+        self.maxs = deque()     # decreasing values: front is the window maximum
+        # Current slice
+        self.current = None
+        self.cur_count = 0
+        self.cur_total = 0.0
+        self.cur_min = None
+        self.cur_max = None
+        self.cur_hist = {}
+    
+    def add(self, timestamp, value=1.0):
+        index = int(timestamp // self.width)
+        if self.current is None or index > self.current:
+            self._roll(index)
+        # A late reading (index < current) is counted in the current slice
+        self.count += 1
+        self.total += value
+        self.cur_count += 1
+        self.cur_total += value
+        if self.cur_min is None or value < self.cur_min:
+            self.cur_min = value
+        if self.cur_max is None or value > self.cur_max:
+            self.cur_max = value
+        if self.resolution:
+            bin_ = round(value / self.resolution)
+            self.hist[bin_] = self.hist.get(bin_, 0) + 1
+            self.cur_hist[bin_] = self.cur_hist.get(bin_, 0) + 1
+    
+    def advance(self, timestamp):
+        """Move the window edge to `timestamp` without adding a value"""
+        index = int(timestamp // self.width)
+        if self.current is None or index > self.current:
+            self._roll(index)
+    
+    def _roll(self, index):
+        if self.cur_count:
+            self.closed.append(_Slice(self.current, self.cur_count, self.cur_total, self.cur_hist))
+            while self.mins and self.mins[-1][1] >= self.cur_min:
+                self.mins.pop()
+            self.mins.append((self.current, self.cur_min))
+            while self.maxs and self.maxs[-1][1] <= self.cur_max:
+                self.maxs.pop()
+            self.maxs.append((self.current, self.cur_max))
+        self.current = index
+        self.cur_count = 0
+        self.cur_total = 0.0
+        self.cur_min = None
+        self.cur_max = None
+        self.cur_hist = {}
+        
+        oldest = index - self.slices + 1
+        closed = self.closed
+        while closed and closed[0].index < oldest:
+            expired = closed.popleft()
+            self.count -= expired.count
+            self.total -= expired.total
+            hist = self.hist
+            for bin_, n in expired.hist.items():
+                left = hist[bin_] - n
+                if left:
+                    hist[bin_] = left
+                else:
+                    del hist[bin_]
+        if not self.count:
+            self.total = 0.0    # no float drift carried into an empty window
+        while self.mins and self.mins[0][0] < oldest:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] < oldest:
+            self.maxs.popleft()
+    
+    def minimum(self):
+        values = [v for v in (self.mins[0][1] if self.mins else None, self.cur_min) if v is not None]
+        return min(values) if values else None
+    
+    def maximum(self):
+        values = [v for v in (self.maxs[0][1] if self.maxs else None, self.cur_max) if v is not None]
+        return max(values) if values else None
+    
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        result = {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3),
+            "min": self.minimum(),
+            "max": self.maximum(),
+        }
+        if self.resolution:
+            result.update(hist_percentiles(self.hist, self.count, self.resolution))
+        return result
+
+
+class RoomRollup:
+    """Sliding windows of one room: a value window set per measured metric, a count window set for motion"""
+    
+    __slots__ = ("windows", "updated")
+    
+    def __init__(self):
+        self.windows = {}       # metric -> [SlidingWindow per configured window]
+        self.updated = None
+
+
+class RollupStore:
+    """
+    room -> RoomRollup
+    
+    Temperature readings feed value windows; motion readings count an event
+    when motion is detected (value 1) and keep no histogram.
+    """
+    
+    COUNTED = ("motion",)
+    
+    def __init__(self, windows=DEFAULT_WINDOWS, slices=30, resolution=0.1):
+        self.windows = windows
+        self.slices = slices
+        self.resolution = resolution
+        self.rooms = {}
+        self.dirty = set()
+        self._lock = threading.Lock()
+    
+    def _metric_windows(self, room, metric):
+        state = self.rooms.get(room)
+        if state is None:
+            state = self.rooms[room] = RoomRollup()
+        windows = state.windows.get(metric)
+        if windows is None:
+            resolution = None if metric in self.COUNTED else self.resolution
+            windows = state.windows[metric] = [SlidingWindow(seconds, self.slices, resolution)
+                                               for _, seconds in self.windows]
+        return state, windows
+    
+    def add(self, room, metric, timestamp, value):
+        """Account one reading; motion only counts detections"""
+        if metric in self.COUNTED:
+            if not value:
+                return
+            value = 1.0
+        with self._lock:
+            state, windows = self._metric_windows(room, metric)
+            for window in windows:
+                window.add(timestamp, value)
+            state.updated = timestamp
+            self.dirty.add(room)
+    
+    def summary(self, room, timestamp):
+        """Statistics of a room at `timestamp`, None for an unknown room"""
+        with self._lock:
+            state = self.rooms.get(room)
+            if state is None:
+                return None
+            result = {"room": room, "ts": timestamp, "updated": state.updated}
+            for metric, windows in state.windows.items():
+                per_window = {}
+                for (name, _), window in zip(self.windows, windows):
+                    window.advance(timestamp)
+                    summary = window.summary()
+                    per_window[name] = summary["count"] if metric in self.COUNTED else summary
+                result[metric] = per_window
+            return result
+    
+    def take_dirty(self):
+        """Rooms updated since the last call"""
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+            return dirty
+
+
+class RollupService:
+    """Feeds a RollupStore from MQTT and publishes room statistics"""
+    
+    def __init__(self, client, store=None):
+        self.client = client
+        self.store = store or RollupStore()
+    
+    def on_message(self, client, userdata, msg):
+        topic = msg.topic
+        try:
+            parsed = room_metric(topic)
+            if parsed is None or not msg.payload:
+                return
+            data = json.loads(msg.payload)
+            value = data.get("value") if isinstance(data, dict) else data
+            if isinstance(value, (int, float)):
+                self.store.add(parsed[0], parsed[1], clock.time(), value)
+        except Exception as e:
+            logger.error("Error processing message from %s: %s", topic, e)
+    
+    def publish_rooms(self, rooms):
+        now = clock.time()
+        for room in rooms:
+            summary = self.store.summary(room, now)
+            if summary is not None:
+                publish(self.client, f"{STATS_PREFIX}rooms/{room}", json.dumps(summary, separators=(",", ":")))
+        return len(rooms)
+
+
+def benchmark_rollup(messages=100000, rooms=100, window_lengths=(60.0, 3600.0, 86400.0)):
+    """
+    Cost per reading for growing window lengths
+    
+    Feeds `messages` readings spread over `rooms` rooms, ten readings per
+    simulated second, into one window of each length. The cost per reading
+    should stay flat as the window grows.
+    
+    Returns:
+        Dictionary window seconds -> microseconds per reading
+    """
+    result = {}
+    for seconds in window_lengths:
+        store = RollupStore(windows=(("w", seconds),))
+        started = time.perf_counter()
+        for i in range(messages):
+            store.add(f"room_{i % rooms}", "temperature", i * 0.1, 20.0 + (i % 97) * 0.1)
+        result[seconds] = round((time.perf_counter() - started) / messages * 1e6, 2)
+    logger.info("📊 Rollup benchmark (µs per reading by window length): %s", result)
+    return result
+
+
+def run_rollup_service():
+    """
+    Main function for the rollup service
+    Subscribes to room temperature and motion topics and publishes rolling statistics
+    """
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    client_id = os.getenv("CLIENT_ID", "rollup_service")
+    interval = float(os.getenv("ROLLUP_INTERVAL", "10"))
+    full_interval = float(os.getenv("ROLLUP_FULL_INTERVAL", "60"))
+    windows = parse_windows(os.getenv("ROLLUP_WINDOWS", ",".join(f"{n}={int(s)}" for n, s in DEFAULT_WINDOWS)))
+    store = RollupStore(windows=windows, slices=int(os.getenv("ROLLUP_SLICES", "30")),
+                        resolution=float(os.getenv("ROLLUP_RESOLUTION", "0.1")))
+    
+    logger.info("=" * 60)
+    logger.info("Starting Rollup Service")
+    logger.info("=" * 60)
+    logger.info(f"Broker: {broker}:{port}")
+    logger.info(f"Windows: {', '.join(name for name, _ in windows)}, published on {STATS_PREFIX}rooms/<room>")
+    
+    client = create_mqtt_client(client_id, broker, port)
+    service = RollupService(client, store)
+    client.on_message = service.on_message
+    
+    if not connect_with_retry(client, broker, port):
+        logger.error("Failed to connect. Exiting.")
+        return
+    
+    add_subscriptions(client, ROLLUP_TOPICS)
+    client.loop_start()
+    
+    # Updated rooms every interval; every room every full_interval so idle rooms age out of their windows
+    next_full = clock.monotonic() + full_interval
+    try:
+        while True:
+            clock.sleep(interval)
+            if clock.monotonic() >= next_full:
+                next_full += full_interval
+                store.take_dirty()
+                count = service.publish_rooms(list(store.rooms))
+                logger.info(f"📊 Published statistics of {count} room(s)")
+            else:
+                service.publish_rooms(store.take_dirty())
+    
+    except KeyboardInterrupt:
+        logger.info("Shutting down rollup service...")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        logger.info("Rollup service stopped.")
+
+
+if __name__ == "__main__":
+    run_rollup_service()
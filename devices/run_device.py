@@ -5,42 +5,105 @@ Runs the appropriate device based on DEVICE_TYPE environment variable
 
 import os
 import sys
+import time
+import importlib
+import threading
 import logging
+from profiling import install_signal_handlers
+from utils import get_clients
+
+# controller.py, controller_cluster.py and flow_runner.py live in the repo root (absent in the devices image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("DeviceLauncher")
 
+# Device type -> (module, entry function). Modules are only imported when launched,
+# so starting one device never pays for importing the others (or NumPy).
+DEVICE_REGISTRY = {
+    "temp_sensor": ("temp_sensor", "run_temp_sensor"),
+    "motion_sensor": ("motion_sensor", "run_motion_sensor"),
+    "smart_lamp": ("smart_lamp", "run_smart_lamp"),
+    "smart_light": ("smart_light", "run_smart_light"),
+    "thermostat": ("thermostat", "run_thermostat"),
+    "security_camera": ("security_camera", "run_security_camera"),
+    "flow_runner": ("flow_runner", "run_flow_runner"),
+    "camera_pool": ("camera_pool", "run_camera_pool"),
+    "automation_controller": ("controller", "run_automation_controller"),
+    "controller_cluster": ("controller_cluster", "run_controller_cluster"),
+    "zone_thermostat": ("zone_thermostat", "run_zone_thermostat"),
+    "thermal_fleet": ("thermal_model", "run_thermal_fleet"),
+    "shadow_service": ("shadow", "run_shadow_service"),
+    "rollup_service": ("rollup", "run_rollup_service"),
+    "traffic_recorder": ("traffic_log", "run_traffic_recorder"),
+    "traffic_replayer": ("traffic_log", "run_traffic_replayer"),
+}
+
+
+def load_device(device_type):
+    """
+    Import a device module on demand
+    
+    Args:
+        device_type: Key of DEVICE_REGISTRY
+    
+    Returns:
+        The device's entry function
+    """
+    module_name, function_name = DEVICE_REGISTRY[device_type]
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+
+def start_heartbeat(path, interval=2.0):
+    """
+    Every `interval` seconds, set the mtime of `path` to the time the least
+    recently active MQTT network loop of this process last made progress
+    (client.last_progress, see utils). supervisor.py restarts the process when
+    it goes stale: a hung interpreter or a stuck or dead network loop. paho keeps
+    looping and retrying through a broker outage, so that keeps it fresh and the
+    process rides the outage out with its offline queue.
+    """
+    def beat():
+        while True:
+            stamp = min((client.last_progress for client in get_clients()), default=time.time())
+            try:
+                os.utime(path, (stamp, stamp))
+            except FileNotFoundError:
+                open(path, "a").close()
+            except OSError as e:
+                logger.warning("Heartbeat %s failed: %s", path, e)
+            time.sleep(interval)
+    
+    threading.Thread(target=beat, name="SupervisorHeartbeat", daemon=True).start()
+
 
 def main():
     """
     Launch the appropriate device based on DEVICE_TYPE
     """
     device_type = os.getenv("DEVICE_TYPE", "")
+    valid = ", ".join(DEVICE_REGISTRY)
     
     if not device_type:
         logger.error("DEVICE_TYPE environment variable not set!")
-        logger.error("Valid values: temp_sensor, motion_sensor, smart_lamp, thermostat")
+        logger.error(f"Valid values: {valid}")
+        sys.exit(1)
+    
+    if device_type not in DEVICE_REGISTRY:
+        logger.error(f"Unknown device type: {device_type}")
+        logger.error(f"Valid values: {valid}")
         sys.exit(1)
     
     logger.info(f"Launching device: {device_type}")
+    install_signal_handlers()
+    if os.getenv("SUPERVISOR_HEARTBEAT_FILE"):
+        start_heartbeat(os.environ["SUPERVISOR_HEARTBEAT_FILE"],
+                        float(os.getenv("SUPERVISOR_HEARTBEAT_INTERVAL", "2")))
     
     try:
-        if device_type == "temp_sensor":
-            from temp_sensor import run_temp_sensor
-            run_temp_sensor()
-        elif device_type == "motion_sensor":
-            from motion_sensor import run_motion_sensor
-            run_motion_sensor()
-        elif device_type == "smart_lamp":
-            from smart_lamp import run_smart_lamp
-            run_smart_lamp()
-        elif device_type == "thermostat":
-            from thermostat import run_thermostat
-            run_thermostat()
-        else:
-            logger.error(f"Unknown device type: {device_type}")
-            logger.error("Valid values: temp_sensor, motion_sensor, smart_lamp, thermostat")
-            sys.exit(1)
+        run = load_device(device_type)
+        run()
     except Exception as e:
         logger.error(f"Failed to launch device: {e}")
         sys.exit(1)
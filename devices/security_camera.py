@@ -1,14 +1,16 @@
 """
 Security Camera with Motion Detection
 Simulates a security camera that detects motion and publishes alerts
+With MOTION_SOURCE set, motion is detected on real frames (see frame_motion.py)
+and motion clips are recorded and published (see clip_buffer.py)
 """
 
-import time
 import random
 import json
 import os
 import logging
-from utils import create_mqtt_client, connect_with_retry
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+import sim_clock as clock
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("SecurityCamera")
@@ -17,36 +19,44 @@ logger = logging.getLogger("SecurityCamera")
 class SecurityCamera:
     """Security Camera with motion detection"""
     
-    def __init__(self, camera_id="front_door"):
+    def __init__(self, camera_id="front_door", motion_monitor=None, clip_recorder=None):
         self.camera_id = camera_id
+        self.motion_monitor = motion_monitor  # frame-based detection, random simulation if None
+        self.clip_recorder = clip_recorder    # needs real frames, so only with a motion monitor
         self.is_active = True
         self.motion_detected = False
         self.last_motion_time = 0
         self.sensitivity = 0.1  # 10% probability - more OFF time for automation demo
         self.recording = False
-        
+        self.recording_window = 10  # Keep recording 10 seconds after last motion
+    
     def check_motion(self):
         """
-        Simulate motion detection
+        Detect motion since the previous check
         Returns True if motion is detected
         """
         if not self.is_active:
+            if self.motion_monitor is not None:
+                self.motion_monitor.consume_motion()
             return False
         
-        # Use sensitivity setting for motion detection probability
-        motion = random.random() < self.sensitivity
+        if self.motion_monitor is not None:
+            motion = self.motion_monitor.consume_motion()
+        else:
+            # Use sensitivity setting for motion detection probability
+            motion = random.random() < self.sensitivity
         
         if motion:
             self.motion_detected = True
-            self.last_motion_time = time.time()
+            self.last_motion_time = clock.time()
             self.recording = True
-            logger.warning(f"🚨 MOTION DETECTED by camera {self.camera_id}!")
+            logger.warning("🚨 MOTION DETECTED by camera %s!", self.camera_id)
             return True
         else:
-            # Reset recording after 10 seconds of no motion
-            if self.recording and (time.time() - self.last_motion_time > 10):
+            # Reset recording after the recording window passes with no motion
+            if self.recording and (clock.time() - self.last_motion_time > self.recording_window):
                 self.recording = False
-                logger.info(f"✓ No motion - stopping recording")
+                logger.info("✓ No motion - stopping recording")
             self.motion_detected = False
             return False
     
@@ -54,38 +64,48 @@ class SecurityCamera:
         """Enable/disable the camera"""
         self.is_active = active
         status = "ACTIVE" if active else "INACTIVE"
-        logger.info(f"📷 Camera {self.camera_id} is now {status}")
+        logger.info("📷 Camera %s is now %s", self.camera_id, status)
     
     def set_sensitivity(self, sensitivity):
         """Set motion detection sensitivity (0-1)"""
         if 0 <= sensitivity <= 1:
             self.sensitivity = sensitivity
-            logger.info(f"🎚️ Sensitivity set to {sensitivity}")
+            if self.motion_monitor is not None:
+                self.motion_monitor.detector.set_sensitivity(sensitivity)
+            logger.info("🎚️ Sensitivity set to %s", sensitivity)
         else:
-            logger.warning(f"Invalid sensitivity: {sensitivity}")
+            logger.warning("Invalid sensitivity: %s", sensitivity)
     
     def get_status(self):
         """Get current camera status"""
-        return {
+        status = {
             "camera_id": self.camera_id,
             "active": self.is_active,
             "motion_detected": self.motion_detected,
             "recording": self.recording,
             "sensitivity": self.sensitivity,
             "last_motion": self.last_motion_time if self.last_motion_time > 0 else None,
-            "timestamp": time.time()
+            "timestamp": clock.time()
         }
+        if self.motion_monitor is not None:
+            status["detector"] = self.motion_monitor.stats()
+        if self.clip_recorder is not None:
+            status["clips"] = self.clip_recorder.stats()
+        return status
     
     def get_motion_event(self):
         """Get motion detection event data with actual motion state"""
-        return {
+        event = {
             "camera_id": self.camera_id,
             "motion_detected": self.motion_detected,
             "event": "MOTION_DETECTED" if self.motion_detected else "NO_MOTION",
             "location": self.camera_id,
-            "timestamp": time.time(),
+            "timestamp": clock.time(),
             "recording": self.recording
         }
+        if self.clip_recorder is not None and self.clip_recorder.recording:
+            event["clip_id"] = self.clip_recorder.clip_id
+        return event
 
 
 def run_security_camera():
@@ -112,14 +132,28 @@ def run_security_camera():
     # Create camera instance
     camera = SecurityCamera(camera_id)
     
+    # Frame-based motion detection and clips (imports NumPy, only with MOTION_SOURCE set)
+    if os.getenv("MOTION_SOURCE"):
+        from frame_motion import motion_monitor_from_env
+        camera.motion_monitor = motion_monitor_from_env(camera.sensitivity)
+    
     # Create MQTT client
     client = create_mqtt_client(client_id, broker, port)
     
+    clip_publisher = None
+    if camera.motion_monitor is not None:
+        from clip_buffer import clip_recorder_from_env
+        camera.clip_recorder, clip_publisher = clip_recorder_from_env(client, camera_id)
+        if camera.clip_recorder is not None:
+            camera.motion_monitor.frame_sink = camera.clip_recorder.add_frame
+            clip_publisher.start()
+        camera.motion_monitor.start()
+    
     def on_message(client, userdata, msg):
         """Handle incoming MQTT commands"""
         try:
             payload = msg.payload.decode()
-            logger.info(f"📩 Received command: {payload}")
+            logger.info("📩 Received command: %s", payload)
             
             # Handle JSON commands
             try:
@@ -133,11 +167,13 @@ def run_security_camera():
                 elif command == "SET_SENSITIVITY":
                     sensitivity = float(data.get("sensitivity", 0.3))
                     camera.set_sensitivity(sensitivity)
+                elif command == "CLIP_RESEND" and clip_publisher is not None:
+                    clip_publisher.resend(data["clip_id"], data.get("segment", 0), data.get("offset", 0))
                 elif command == "STATUS":
                     pass  # Just publish status
                 else:
-                    logger.warning(f"Unknown command: {command}")
-                    
+                    logger.warning("Unknown command: %s", command)
+            
             except json.JSONDecodeError:
                 # Handle simple text commands
                 command = payload.upper()
@@ -148,11 +184,11 @@ def run_security_camera():
             
             # Publish status after command
             status = camera.get_status()
-            client.publish(status_topic, json.dumps(status), qos=1)
-            logger.info(f"📤 Published status: Active={status['active']}")
-            
+            publish(client, status_topic, json.dumps(status))
+            logger.info("📤 Published status: Active=%s", status['active'])
+        
         except Exception as e:
-            logger.error(f"Error processing command: {e}")
+            logger.error("Error processing command: %s", e)
     
     # Set message callback
     client.on_message = on_message
@@ -163,12 +199,12 @@ def run_security_camera():
         return
     
     # Subscribe to command topic
-    client.subscribe(command_topic)
+    add_subscription(client, command_topic, qos=1)
     logger.info(f"✓ Subscribed to {command_topic}")
     
     # Publish initial status
     status = camera.get_status()
-    client.publish(status_topic, json.dumps(status), qos=1)
+    publish(client, status_topic, json.dumps(status))
     logger.info(f"📤 Published initial status: Active={status['active']}")
     
     # Start MQTT loop in background
@@ -184,25 +220,30 @@ def run_security_camera():
             
             # Always publish motion status (both detected and not detected)
             event = camera.get_motion_event()
-            client.publish(motion_topic, json.dumps(event), qos=1)
+            publish(client, motion_topic, json.dumps(event))
             
             if motion_detected:
-                logger.warning(f"🚨 Published MOTION DETECTED to {motion_topic}")
+                logger.warning("🚨 Published MOTION DETECTED to %s", motion_topic)
             else:
-                logger.info(f"✓ Published NO MOTION to {motion_topic}")
-                
+                logger.info("✓ Published NO MOTION to %s", motion_topic)
+            
             # Publish updated camera status
             status = camera.get_status()
-            client.publish(status_topic, json.dumps(status), qos=1)
+            publish(client, status_topic, json.dumps(status))
             
             # Wait before next check
-            time.sleep(check_interval)
-            
+            clock.sleep(check_interval)
+    
     except KeyboardInterrupt:
         logger.info("Shutting down security camera...")
     except Exception as e:
-        logger.error(f"Error: {e}")
+        logger.error("Error: %s", e)
     finally:
+        if camera.motion_monitor is not None:
+            camera.motion_monitor.stop()
+        if camera.clip_recorder is not None:
+            camera.clip_recorder.close()
+            clip_publisher.stop()
         client.loop_stop()
         client.disconnect()
         logger.info("Security camera stopped.")
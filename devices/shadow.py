@@ -0,0 +1,366 @@
+"""
+Device Shadow Service
+Last-value cache holding reported and desired state for every device
+
+- Reported state comes from status and telemetry topics, desired state from commands
+- Changes are coalesced and published as compact diffs on one aggregated topic
+- A retained snapshot lets new consumers bootstrap without sending STATUS to devices
+- Point and bulk queries are answered from memory over a request/reply topic
+"""
+
+import os
+import json
+import uuid
+import threading
+import logging
+import paho.mqtt.client as mqtt
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+from topic_policy import policy_for, MEDIA
+from rollup import STATS_PREFIX
+import sim_clock as clock
+
+logger = logging.getLogger("Shadow")
+
+SHADOW_PREFIX = "home/shadow/"
+DIFF_TOPIC = "home/shadow/diff"
+SNAPSHOT_TOPIC = "home/shadow/snapshot"
+GET_TOPIC = "home/shadow/get"
+
+# Binary camera media (clip_buffer.py) under home/#: not JSON, not device state
+MEDIA_TOPICS = ("home/security/camera/+/clip/+", "home/security/camera/+/thumbnail")
+
+# Command -> desired fields, in the field names the device reports in its status
+COMMAND_FIELDS = {
+    "ON": lambda data: {"state": "ON"},
+    "OFF": lambda data: {"state": "OFF"},
+    "BRIGHTNESS": lambda data: {"brightness": data["level"]},
+    "ACTIVATE": lambda data: {"active": True},
+    "DEACTIVATE": lambda data: {"active": False},
+    "SET_SENSITIVITY": lambda data: {"sensitivity": data["sensitivity"]},
+    "SET_MODE": lambda data: {"mode": data["mode"]},
+    "SET_TARGET": lambda data: {"target_temp": data["target"]},
+}
+
+
+def device_for(topic):
+    """Device id of a topic: home/rooms/r1/thermostat/status -> rooms/r1/thermostat"""
+    device = topic[5:] if topic.startswith("home/") else topic
+    for suffix in ("/status", "/command"):
+        if device.endswith(suffix):
+            return device[:-len(suffix)]
+    return device
+
+
+def is_media(topic):
+    """True for binary media payloads (MEDIA topic policy, camera clip chunks and thumbnails)"""
+    return policy_for(topic) is MEDIA or any(mqtt.topic_matches_sub(pattern, topic) for pattern in MEDIA_TOPICS)
+
+
+def desired_fields(payload):
+    """Desired state implied by a command payload, None for queries such as STATUS"""
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        data = {"command": payload.decode("utf-8", "replace").strip()}
+    if not isinstance(data, dict):
+        return None
+    mapping = COMMAND_FIELDS.get(str(data.get("command", "")).upper())
+    if mapping is None:
+        return None
+    try:
+        return mapping(data)
+    except KeyError:
+        return None
+
+
+class Shadow:
+    """Reported and desired state of one device"""
+    
+    __slots__ = ("reported", "desired", "version", "updated")
+    
+    def __init__(self):
+        self.reported = {}
+        self.desired = {}
+        self.version = 0
+        self.updated = 0.0
+    
+    def to_dict(self):
+        delta = {key: value for key, value in self.desired.items() if self.reported.get(key) != value}
+        return {
+            "reported": dict(self.reported),
+            "desired": dict(self.desired),
+            "delta": delta,
+            "version": self.version,
+            "updated": self.updated,
+        }
+
+
+class ShadowStore:
+    """
+    Indexed in-memory shadow store
+    
+    Devices are indexed by kind (last path segment: thermostat, temperature, ...)
+    for bulk queries. Every change is recorded in a pending diff that
+    take_diff() hands out once, stamped with a sequence number.
+    """
+    
+    def __init__(self):
+        self.shadows = {}
+        self.by_kind = {}
+        self.seq = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+    
+    def _shadow(self, device):
+        shadow = self.shadows.get(device)
+        if shadow is None:
+            shadow = self.shadows[device] = Shadow()
+            self.by_kind.setdefault(device.rsplit("/", 1)[-1], set()).add(device)
+        return shadow
+    
+    def _update(self, device, section, fields, timestamp):
+        with self._lock:
+            shadow = self._shadow(device)
+            state = shadow.reported if section == "r" else shadow.desired
+            changed = {key: value for key, value in fields.items() if state.get(key, KeyError) != value}
+            if not changed:
+                return changed
+            state.update(changed)
+            shadow.version += 1
+            shadow.updated = timestamp
+            self._pending.setdefault(device, {}).setdefault(section, {}).update(changed)
+            return changed
+    
+    def update_reported(self, device, fields, timestamp):
+        """Merge reported fields, returns the fields that changed"""
+        return self._update(device, "r", fields, timestamp)
+    
+    def update_desired(self, device, fields, timestamp):
+        """Merge desired fields, returns the fields that changed"""
+        return self._update(device, "d", fields, timestamp)
+    
+    def take_diff(self):
+        """Changes since the last call as (seq, {device: {"r": {...}, "d": {...}}}), None if nothing changed"""
+        with self._lock:
+            if not self._pending:
+                return None
+            diff, self._pending = self._pending, {}
+            self.seq += 1
+            return self.seq, diff
+    
+    def get(self, device):
+        with self._lock:
+            shadow = self.shadows.get(device)
+            return shadow.to_dict() if shadow is not None else None
+    
+    def query(self, devices=None, kind=None, prefix=None):
+        """
+        Bulk query
+        
+        Args:
+            devices: Explicit device ids
+            kind: Only devices of this kind
+            prefix: Only devices whose id starts with prefix (e.g. "rooms/room_00042")
+        
+        Returns:
+            Dictionary device -> shadow
+        """
+        with self._lock:
+            if devices is not None:
+                candidates = [device for device in devices if device in self.shadows]
+            elif kind is not None:
+                candidates = self.by_kind.get(kind, ())
+            else:
+                candidates = self.shadows
+            return {
+                device: self.shadows[device].to_dict()
+                for device in candidates
+                if prefix is None or device.startswith(prefix)
+            }
+    
+    def snapshot(self):
+        """Full state, stamped with the last diff sequence it includes"""
+        with self._lock:
+            shadows = {device: shadow.to_dict() for device, shadow in self.shadows.items()}
+            return {"seq": self.seq, "shadows": shadows}
+    
+    def load_snapshot(self, snapshot):
+        """
+        Warm start from a snapshot published by a previous instance
+        Fields already known (from retained status that arrived first) are newer and kept
+        """
+        with self._lock:
+            for device, data in snapshot.get("shadows", {}).items():
+                shadow = self._shadow(device)
+                for key, value in data.get("reported", {}).items():
+                    shadow.reported.setdefault(key, value)
+                for key, value in data.get("desired", {}).items():
+                    shadow.desired.setdefault(key, value)
+                shadow.version = max(shadow.version, data.get("version", 0))
+                shadow.updated = max(shadow.updated, data.get("updated", 0.0))
+            self.seq = max(self.seq, snapshot.get("seq", 0))
+
+
+class ShadowService:
+    """Feeds a ShadowStore from MQTT and publishes diffs, snapshots and query replies"""
+    
+    def __init__(self, client, store=None):
+        self.client = client
+        self.store = store or ShadowStore()
+        self.snapshot_seq = None
+    
+    def on_message(self, client, userdata, msg):
+        topic = msg.topic
+        try:
+            if topic == GET_TOPIC:
+                self.handle_query(msg.payload)
+            elif topic == SNAPSHOT_TOPIC:
+                # Our own retained snapshot from before a restart (desired state is not retained elsewhere)
+                if msg.retain and msg.payload:
+                    self.store.load_snapshot(json.loads(msg.payload))
+            elif not topic.startswith((SHADOW_PREFIX, STATS_PREFIX)) and msg.payload and not is_media(topic):
+                # Rolled-up statistics are derived data, not device state
+                self.handle_device_message(topic, msg.payload)
+        except Exception as e:
+            logger.error(f"Error processing message from {topic}: {e}")
+    
+    def handle_device_message(self, topic, payload):
+        timestamp = clock.time()
+        if topic.endswith("/command"):
+            fields = desired_fields(payload)
+            if fields:
+                self.store.update_desired(device_for(topic), fields, timestamp)
+            return
+        
+        data = json.loads(payload)
+        if not isinstance(data, dict):
+            data = {"value": data}
+        timestamp = data.pop("timestamp", None) or timestamp
+        self.store.update_reported(device_for(topic), data, timestamp)
+    
+    def handle_query(self, payload):
+        """
+        Answer a query: {"id": ..., "reply_to": topic, "devices": [...] | "kind": ... | "prefix": ...}
+        With no filter the reply is a full snapshot.
+        """
+        request = json.loads(payload)
+        reply_to = request.get("reply_to")
+        if not reply_to:
+            return
+        if any(key in request for key in ("devices", "kind", "prefix")):
+            result = {"seq": self.store.seq,
+                      "shadows": self.store.query(request.get("devices"), request.get("kind"), request.get("prefix"))}
+        else:
+            result = self.store.snapshot()
+        result["id"] = request.get("id")
+        publish(self.client, reply_to, json.dumps(result, separators=(",", ":")), qos=1, retain=False)
+    
+    def publish_diff(self):
+        diff = self.store.take_diff()
+        if diff is None:
+            return False
+        seq, changes = diff
+        publish(self.client, DIFF_TOPIC, json.dumps({"seq": seq, "ts": clock.time(), "d": changes},
+                                                    separators=(",", ":")))
+        return True
+    
+    def publish_snapshot(self):
+        snapshot = self.store.snapshot()
+        if snapshot["seq"] == self.snapshot_seq:
+            return
+        publish(self.client, SNAPSHOT_TOPIC, json.dumps(snapshot, separators=(",", ":")))
+        self.snapshot_seq = snapshot["seq"]
+
+
+def query_shadow(client, devices=None, kind=None, prefix=None, timeout=1.0):
+    """
+    Ask the shadow service for device state
+    
+    Args:
+        client: Connected client created by create_mqtt_client
+        devices / kind / prefix: Filters as in ShadowStore.query, none for a full snapshot
+        timeout: Seconds to wait for the reply
+    
+    Returns:
+        Dictionary device -> shadow, or None if the service did not answer
+    """
+    request_id = uuid.uuid4().hex
+    reply_to = f"{SHADOW_PREFIX}reply/{request_id}"
+    reply = {}
+    done = threading.Event()
+    
+    def on_reply(client, userdata, msg):
+        reply.update(json.loads(msg.payload))
+        done.set()
+    
+    client.message_callback_add(reply_to, on_reply)
+    add_subscription(client, reply_to, qos=1)
+    client.ready.wait(timeout)
+    
+    request = {"id": request_id, "reply_to": reply_to}
+    if devices is not None:
+        request["devices"] = list(devices)
+    if kind is not None:
+        request["kind"] = kind
+    if prefix is not None:
+        request["prefix"] = prefix
+    publish(client, GET_TOPIC, json.dumps(request), qos=1, retain=False)
+    
+    answered = done.wait(timeout)
+    client.message_callback_remove(reply_to)
+    client.subscriptions.pop(reply_to, None)
+    client.unsubscribe(reply_to)
+    return reply.get("shadows") if answered else None
+
+
+def run_shadow_service():
+    """
+    Main function for the shadow service
+    Subscribes to every home topic and keeps the last-value cache
+    """
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    client_id = os.getenv("CLIENT_ID", "shadow_service")
+    diff_interval = float(os.getenv("DIFF_INTERVAL", "0.2"))
+    snapshot_interval = float(os.getenv("SNAPSHOT_INTERVAL", "30"))
+    
+    logger.info("=" * 60)
+    logger.info("Starting Device Shadow Service")
+    logger.info("=" * 60)
+    logger.info(f"Broker: {broker}:{port}")
+    logger.info(f"Diffs on {DIFF_TOPIC} every {diff_interval}s, snapshot on {SNAPSHOT_TOPIC} every {snapshot_interval}s")
+    
+    client = create_mqtt_client(client_id, broker, port)
+    service = ShadowService(client)
+    client.on_message = service.on_message
+    
+    if not connect_with_retry(client, broker, port):
+        logger.error("Failed to connect. Exiting.")
+        return
+    
+    # Retained status messages (and our own last snapshot) warm the cache on subscribe.
+    # home/# also covers GET_TOPIC; a second, overlapping subscription could deliver queries twice
+    add_subscription(client, "home/#", qos=1)
+    client.loop_start()
+    
+    next_snapshot = clock.monotonic() + snapshot_interval
+    try:
+        while True:
+            clock.sleep(diff_interval)
+            service.publish_diff()
+            if clock.monotonic() >= next_snapshot:
+                next_snapshot += snapshot_interval
+                service.publish_snapshot()
+                logger.info(f"📊 {len(service.store.shadows)} device shadows, diff seq {service.store.seq}")
+    
+    except KeyboardInterrupt:
+        logger.info("Shutting down shadow service...")
+    finally:
+        service.publish_snapshot()
+        client.loop_stop()
+        client.disconnect()
+        logger.info("Shadow service stopped.")
+
+
+if __name__ == "__main__":
+    run_shadow_service()
@@ -0,0 +1,157 @@
+"""
+Simulation Clock
+Single place where devices and the controller read time and sleep
+Swap the real-time clock for a discrete-event virtual clock to run faster than wall clock
+"""
+
+import os
+import time as _time
+import heapq
+import random
+import threading
+import logging
+
+logger = logging.getLogger("SimClock")
+
+
+class RealClock:
+    """Wall-clock time, the default for normal operation"""
+
+    def time(self):
+        return _time.time()
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def sleep(self, seconds):
+        _time.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    Discrete-event virtual clock
+
+    Time only moves when every thread that uses the clock is blocked in sleep().
+    The clock then jumps straight to the earliest wake-up time, so a 30 s timeout
+    costs no real time at all. Before jumping it waits `settle` real seconds with
+    no activity, giving MQTT network threads a chance to deliver in-flight messages;
+    settle=0 jumps immediately, which is fully deterministic for broker-less runs.
+    Threads waking at the same virtual time are released in the order they slept.
+    """
+
+    def __init__(self, start=0.0, settle=0.002):
+        self._now = float(start)
+        self.settle = settle
+        self._cond = threading.Condition()
+        self._wakeups = []          # heap of (wake_time, sequence)
+        self._sequence = 0
+        self._participants = {}     # thread ident -> Thread
+        self._sleeping = 0
+
+    def time(self):
+        return self._now
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        """Block the calling thread until virtual time has advanced by `seconds`"""
+        with self._cond:
+            thread = threading.current_thread()
+            self._participants[thread.ident] = thread
+
+            wake = self._now + max(float(seconds), 0.0)
+            self._sequence += 1
+            entry = (wake, self._sequence)
+            heapq.heappush(self._wakeups, entry)
+            self._sleeping += 1
+
+            try:
+                while self._now < wake or self._wakeups[0] < entry:
+                    if self._wakeups[0][0] <= self._now or not self._all_asleep():
+                        # Someone is due to wake or still running, let them go first
+                        self._cond.wait(0.05)
+                    elif self.settle > 0:
+                        # Give real threads (MQTT callbacks) a moment before jumping
+                        activity = self._sequence
+                        self._cond.wait(self.settle)
+                        if activity == self._sequence and self._all_asleep():
+                            self._advance()
+                    else:
+                        self._advance()
+            finally:
+                self._sleeping -= 1
+                self._wakeups.remove(entry)
+                heapq.heapify(self._wakeups)
+                self._cond.notify_all()
+
+    def advance(self, seconds):
+        """Move virtual time forward from outside the simulated threads"""
+        with self._cond:
+            self._now += seconds
+            self._cond.notify_all()
+
+    def detach(self):
+        """Stop counting the calling thread as a participant"""
+        with self._cond:
+            self._participants.pop(threading.get_ident(), None)
+            self._cond.notify_all()
+
+    def _all_asleep(self):
+        # Threads that exited never sleep again, forget them
+        for ident, thread in list(self._participants.items()):
+            if not thread.is_alive():
+                del self._participants[ident]
+        return self._sleeping >= len(self._participants)
+
+    def _advance(self):
+        self._now = self._wakeups[0][0]
+        self._cond.notify_all()
+
+
+def clock_from_env():
+    """
+    Build the clock selected by environment variables
+    SIM_CLOCK=virtual selects VirtualClock starting at SIM_START (default: now)
+    SIM_SETTLE is the real time allowed for MQTT delivery before each jump (0 = none)
+    SIM_SEED seeds the random module so simulated sensors are reproducible
+    """
+    seed = os.getenv("SIM_SEED")
+    if seed is not None:
+        random.seed(int(seed))
+
+    if os.getenv("SIM_CLOCK", "real").lower() == "virtual":
+        start = float(os.getenv("SIM_START", str(int(_time.time()))))
+        settle = float(os.getenv("SIM_SETTLE", "0.002"))
+        logger.info(f"⏱️  Using virtual clock starting at {start}")
+        return VirtualClock(start=start, settle=settle)
+    return RealClock()
+
+
+_active = clock_from_env()
+
+
+def get_clock():
+    """Return the clock every component is currently using"""
+    return _active
+
+
+def set_clock(clock):
+    """Install a clock for all components (call before starting them)"""
+    global _active
+    _active = clock
+
+
+def time():
+    """Current time in seconds since the epoch on the active clock"""
+    return _active.time()
+
+
+def monotonic():
+    """Monotonic seconds on the active clock, for measuring intervals"""
+    return _active.monotonic()
+
+
+def sleep(seconds):
+    """Sleep on the active clock"""
+    _active.sleep(seconds)
@@ -3,11 +3,11 @@ Smart Lamp Actuator
 Subscribes to command topic and publishes status updates
 """
 
-import time
 import json
 import os
 import logging
-from utils import create_mqtt_client, connect_with_retry
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+import sim_clock as clock
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("SmartLamp")
@@ -40,7 +40,7 @@ class SmartLamp:
             payload = msg.payload.decode('utf-8')
             
             # Only handle lamp command messages (automation handled by Node-RED)
-            logger.info(f"📥 Received command: {payload} on {msg.topic}")
+            logger.info("📥 Received command: %s on %s", payload, msg.topic)
             
             # Try to parse as JSON first
             try:
@@ -60,14 +60,14 @@ class SmartLamp:
                 self.lamp_state = "OFF"
                 logger.info("💡 Lamp turned OFF")
             else:
-                logger.warning(f"Unknown command: {command}")
+                logger.warning("Unknown command: %s", command)
                 return
             
             # Publish status update
             self.publish_status()
             
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
     
     def publish_status(self):
         """
@@ -77,21 +77,17 @@ class SmartLamp:
             "device": "smart_lamp",
             "state": self.lamp_state,
             "brightness": self.brightness,
-            "timestamp": time.time()
+            "timestamp": clock.time()
         }
         
-        result = self.client.publish(
-            self.status_topic,
-            json.dumps(status_payload),
-            qos=1,
-            retain=True  # Retain status for new subscribers
-        )
+        # Status topics are retained for new subscribers (see topic_policy)
+        result = publish(self.client, self.status_topic, json.dumps(status_payload))
         
         if result.rc == 0:
             icon = "🟢" if self.lamp_state == "ON" else "🔴"
-            logger.info(f"📤 Published status: {icon} {self.lamp_state} to {self.status_topic}")
+            logger.info("📤 Published status: %s %s to %s", icon, self.lamp_state, self.status_topic)
         else:
-            logger.error(f"Failed to publish status. RC: {result.rc}")
+            logger.error("Failed to publish status. RC: %s", result.rc)
     
     def run(self):
         """
@@ -108,7 +104,7 @@ class SmartLamp:
             return
         
         # Subscribe to command topic
-        self.client.subscribe(self.command_topic, qos=1)
+        add_subscription(self.client, self.command_topic, qos=1)
         logger.info(f"✓ Subscribed to {self.command_topic}")
         
         # Publish initial status
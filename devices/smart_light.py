@@ -4,11 +4,11 @@ Subscribes to light commands and publishes light status
 Can be controlled via MQTT messages (ON/OFF)
 """
 
-import time
 import json
 import os
 import logging
-from utils import create_mqtt_client, connect_with_retry
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+import sim_clock as clock
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("SmartLight")
@@ -26,22 +26,22 @@ class SmartLight:
         """Turn the light ON"""
         self.state = "ON"
         self.brightness = 100
-        logger.info(f"💡 Light {self.light_id} turned ON")
+        logger.info("💡 Light %s turned ON", self.light_id)
         
     def turn_off(self):
         """Turn the light OFF"""
         self.state = "OFF"
         self.brightness = 0
-        logger.info(f"🌑 Light {self.light_id} turned OFF")
+        logger.info("🌑 Light %s turned OFF", self.light_id)
         
     def set_brightness(self, level):
         """Set brightness level (0-100)"""
         if 0 <= level <= 100:
             self.brightness = level
             self.state = "ON" if level > 0 else "OFF"
-            logger.info(f"💡 Light {self.light_id} brightness set to {level}%")
+            logger.info("💡 Light %s brightness set to %s%%", self.light_id, level)
         else:
-            logger.warning(f"Invalid brightness level: {level}")
+            logger.warning("Invalid brightness level: %s", level)
     
     def get_status(self):
         """Get current light status"""
@@ -49,7 +49,7 @@ class SmartLight:
             "light_id": self.light_id,
             "state": self.state,
             "brightness": self.brightness,
-            "timestamp": time.time()
+            "timestamp": clock.time()
         }
 
 
@@ -81,7 +81,7 @@ def run_smart_light():
         """Handle incoming MQTT messages"""
         try:
             payload = msg.payload.decode()
-            logger.info(f"📩 Received command: {payload}")
+            logger.info("📩 Received command: %s", payload)
             
             # Handle JSON commands
             try:
@@ -98,7 +98,7 @@ def run_smart_light():
                 elif command == "STATUS":
                     pass  # Just publish status
                 else:
-                    logger.warning(f"Unknown command: {command}")
+                    logger.warning("Unknown command: %s", command)
                     
             except json.JSONDecodeError:
                 # Handle simple text commands
@@ -108,15 +108,15 @@ def run_smart_light():
                 elif command == "OFF":
                     light.turn_off()
                 else:
-                    logger.warning(f"Unknown command: {payload}")
+                    logger.warning("Unknown command: %s", payload)
             
             # Publish status after command
             status = light.get_status()
-            client.publish(status_topic, json.dumps(status), qos=1)
-            logger.info(f"📤 Published status: {status['state']} ({status['brightness']}%)")
+            publish(client, status_topic, json.dumps(status))
+            logger.info("📤 Published status: %s (%s%%)", status['state'], status['brightness'])
             
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
     
     # Set message callback
     client.on_message = on_message
@@ -127,12 +127,12 @@ def run_smart_light():
         return
     
     # Subscribe to command topic
-    client.subscribe(command_topic)
+    add_subscription(client, command_topic, qos=1)
     logger.info(f"✓ Subscribed to {command_topic}")
     
     # Publish initial status
     status = light.get_status()
-    client.publish(status_topic, json.dumps(status), qos=1)
+    publish(client, status_topic, json.dumps(status))
     logger.info(f"📤 Published initial status: {status['state']}")
     
     # Start MQTT loop
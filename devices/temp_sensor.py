@@ -1,14 +1,15 @@
 """
 Temperature Sensor Device
 Publishes random temperature readings to MQTT broker
+With THERMAL_MODEL=1 readings come from a room model driven by the HVAC state
 """
 
-import time
 import random
 import json
 import os
 import logging
-from utils import create_mqtt_client, connect_with_retry
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+import sim_clock as clock
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("TempSensor")
@@ -25,6 +26,8 @@ def run_temp_sensor():
     client_id = os.getenv("CLIENT_ID", "temp_sensor")
     topic = os.getenv("TOPIC", "home/sensor/temperature")
     interval = int(os.getenv("INTERVAL", "5"))
+    use_model = os.getenv("THERMAL_MODEL", "0") == "1"
+    hvac_topic = os.getenv("HVAC_TOPIC", "home/hvac/command")
     
     logger.info(f"Starting Temperature Sensor")
     logger.info(f"Broker: {broker}:{port}")
@@ -34,42 +37,66 @@ def run_temp_sensor():
     # Create MQTT client
     client = create_mqtt_client(client_id, broker, port)
     
+    model = None
+    if use_model:
+        from thermal_model import RoomThermalModel
+        model = RoomThermalModel(1)
+        
+        def on_message(client, userdata, msg):
+            """Feed thermostat HVAC commands into the room model"""
+            try:
+                data = json.loads(msg.payload.decode())
+                model.set_hvac(0, data.get("command", "OFF"))
+            except Exception as e:
+                logger.error("Error processing HVAC command: %s", e)
+        
+        client.on_message = on_message
+        logger.info("Thermal model enabled, following %s", hvac_topic)
+    
     # Connect to broker with retry
     if not connect_with_retry(client, broker, port):
         logger.error("Failed to connect. Exiting.")
         return
     
+    if model is not None:
+        add_subscription(client, hvac_topic, qos=1)
+    
     # Start MQTT loop in background
     client.loop_start()
     
     try:
         while True:
-            # Generate random temperature between 18 and 32 degrees Celsius
-            temperature = round(random.uniform(18.0, 32.0), 2)
+            if model is not None:
+                # Advance the room model and read it like a real sensor
+                model.step(interval)
+                temperature = round(float(model.readings()[0]), 2)
+            else:
+                # Generate random temperature between 18 and 32 degrees Celsius
+                temperature = round(random.uniform(18.0, 32.0), 2)
             
             # Create payload
             payload = {
                 "sensor": "temperature",
                 "value": temperature,
                 "unit": "°C",
-                "timestamp": time.time()
+                "timestamp": clock.time()
             }
             
             # Publish to MQTT topic
-            result = client.publish(topic, json.dumps(payload), qos=1)
+            result = publish(client, topic, json.dumps(payload))
             
             if result.rc == 0:
-                logger.info(f"📤 Published: {temperature}°C to {topic}")
+                logger.info("📤 Published: %s°C to %s", temperature, topic)
             else:
-                logger.error(f"Failed to publish. RC: {result.rc}")
+                logger.error("Failed to publish. RC: %s", result.rc)
             
             # Wait before next reading
-            time.sleep(interval)
+            clock.sleep(interval)
             
     except KeyboardInterrupt:
         logger.info("Shutting down temperature sensor...")
     except Exception as e:
-        logger.error(f"Error: {e}")
+        logger.error("Error: %s", e)
     finally:
         client.loop_stop()
         client.disconnect()
@@ -0,0 +1,205 @@
+"""
+Room Thermal Model
+Lumped RC thermal model for many rooms, stepped in one vectorized NumPy update
+Closes the control loop: rooms heat/cool according to the HVAC state the thermostat publishes
+"""
+
+import math
+import json
+import os
+import time
+import logging
+import numpy as np
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+import sim_clock as clock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("ThermalModel")
+
+# HVAC command strings published on home/hvac/command -> heat direction
+HVAC_STATES = {"OFF": 0, "HEATING": 1, "COOLING": -1}
+
+
+class RoomThermalModel:
+    """
+    First-order thermal model for N rooms held in parallel arrays
+    
+    Each room relaxes towards its equilibrium temperature
+        T_eq = T_outdoor + hvac * hvac_gain + occupancy * person_gain
+    with time constant tau (= R*C). The exact exponential solution is used, so the
+    update stays stable for any step length, including large virtual-clock jumps.
+    """
+    
+    def __init__(self, n_rooms, initial_temp=26.0, outdoor_mean=27.0, outdoor_swing=5.0, seed=None):
+        self.n_rooms = n_rooms
+        self.outdoor_mean = outdoor_mean
+        self.outdoor_swing = outdoor_swing
+        self.rng = np.random.default_rng(seed)
+        
+        # State
+        self.temp = np.full(n_rooms, initial_temp, dtype=np.float64)
+        self.hvac = np.zeros(n_rooms, dtype=np.int8)
+        self.occupancy = np.zeros(n_rooms, dtype=np.int16)
+        
+        # Per-room physical parameters, varied so rooms do not move in lockstep
+        self.tau = self.rng.uniform(2 * 3600, 6 * 3600, n_rooms)      # seconds
+        self.hvac_gain = self.rng.uniform(10.0, 16.0, n_rooms)         # °C offset at full HVAC power
+        self.person_gain = self.rng.uniform(0.3, 0.7, n_rooms)         # °C offset per occupant
+        
+        # Preallocated work buffers, reused every step
+        self._equilibrium = np.empty(n_rooms, dtype=np.float64)
+        self._work = np.empty(n_rooms, dtype=np.float64)
+        self._decay = None
+        self._decay_dt = None
+    
+    def outdoor_temperature(self, timestamp):
+        """Daily sinusoid peaking mid-afternoon (15:00 local)"""
+        local_seconds = (timestamp - time.timezone) % 86400
+        phase = 2 * math.pi * (local_seconds - 9 * 3600) / 86400
+        return self.outdoor_mean + self.outdoor_swing * math.sin(phase)
+    
+    def set_hvac(self, room, state):
+        """Apply an HVAC command string (OFF/HEATING/COOLING) to one room"""
+        self.hvac[room] = HVAC_STATES.get(state.upper(), 0)
+    
+    def set_occupancy(self, room, people):
+        self.occupancy[room] = people
+    
+    def randomize_occupancy(self, change_probability=0.01, max_people=4):
+        """Let a random subset of rooms gain or lose occupants"""
+        changed = self.rng.random(self.n_rooms) < change_probability
+        count = int(changed.sum())
+        if count:
+            self.occupancy[changed] = self.rng.integers(0, max_people + 1, count)
+    
+    def step(self, dt, outdoor=None):
+        """Advance every room by dt seconds in one vectorized pass"""
+        if outdoor is None:
+            outdoor = self.outdoor_temperature(clock.time())
+        
+        if dt != self._decay_dt:
+            self._decay = np.exp(-dt / self.tau)
+            self._decay_dt = dt
+        
+        eq = self._equilibrium
+        np.multiply(self.hvac, self.hvac_gain, out=eq)
+        np.multiply(self.occupancy, self.person_gain, out=self._work)
+        eq += self._work
+        eq += outdoor
+        
+        # T = T_eq + (T - T_eq) * exp(-dt / tau)
+        self.temp -= eq
+        self.temp *= self._decay
+        self.temp += eq
+    
+    def readings(self, noise=0.1):
+        """Sensor readings with gaussian noise, returned in a reused buffer"""
+        out = self._work
+        self.rng.standard_normal(out=out)
+        out *= noise
+        out += self.temp
+        return out
+
+
+def room_id(index):
+    return f"room_{index:05d}"
+
+
+def benchmark_step(n_rooms=100_000, steps=200, dt=5.0):
+    """
+    Measure the cost of one model step
+    
+    Returns:
+        Dictionary with rooms, steps and milliseconds per step
+    """
+    model = RoomThermalModel(n_rooms, seed=0)
+    model.hvac[::3] = 1
+    model.hvac[1::3] = -1
+    model.step(dt, outdoor=27.0)  # warm up the decay cache
+    
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.step(dt, outdoor=27.0)
+    elapsed = time.perf_counter() - start
+    
+    return {
+        "rooms": n_rooms,
+        "steps": steps,
+        "ms_per_step": round(elapsed / steps * 1000, 3),
+        "room_updates_per_s": round(n_rooms * steps / elapsed),
+    }
+
+
+def run_thermal_fleet():
+    """
+    Main function for the simulated room fleet
+    Steps the model every INTERVAL seconds and publishes home/rooms/<room>/temperature,
+    applying HVAC commands received on home/rooms/<room>/hvac
+    """
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    client_id = os.getenv("CLIENT_ID", "thermal_fleet")
+    n_rooms = int(os.getenv("ROOMS", "100"))
+    interval = float(os.getenv("INTERVAL", "5"))
+    noise = float(os.getenv("SENSOR_NOISE", "0.1"))
+    
+    logger.info(f"Starting Thermal Fleet: {n_rooms} rooms")
+    logger.info(f"Broker: {broker}:{port}")
+    logger.info(f"Interval: {interval} seconds")
+    
+    model = RoomThermalModel(n_rooms)
+    room_ids = [room_id(i) for i in range(n_rooms)]
+    room_index = {rid: i for i, rid in enumerate(room_ids)}
+    temp_topics = [f"home/rooms/{rid}/temperature" for rid in room_ids]
+    
+    client = create_mqtt_client(client_id, broker, port)
+    
+    def on_message(client, userdata, msg):
+        """Apply HVAC commands to the addressed room"""
+        try:
+            room = msg.topic.split("/")[2]
+            index = room_index.get(room)
+            if index is not None:
+                data = json.loads(msg.payload.decode())
+                model.set_hvac(index, data.get("command", "OFF"))
+        except Exception as e:
+            logger.error(f"Error processing HVAC command on {msg.topic}: {e}")
+    
+    client.on_message = on_message
+    
+    if not connect_with_retry(client, broker, port):
+        logger.error("Failed to connect. Exiting.")
+        return
+    
+    add_subscription(client, "home/rooms/+/hvac", qos=1)
+    logger.info("✓ Subscribed to home/rooms/+/hvac")
+    client.loop_start()
+    
+    try:
+        while True:
+            model.randomize_occupancy()
+            model.step(interval)
+            values = np.round(model.readings(noise), 2).tolist()
+            timestamp = clock.time()
+            
+            for topic, value in zip(temp_topics, values):
+                payload = {"sensor": "temperature", "value": value, "unit": "°C", "timestamp": timestamp}
+                publish(client, topic, json.dumps(payload))
+            
+            clock.sleep(interval)
+    
+    except KeyboardInterrupt:
+        logger.info("Shutting down thermal fleet...")
+    except Exception as e:
+        logger.error(f"Error: {e}")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        logger.info("Thermal fleet stopped.")
+
+
+if __name__ == "__main__":
+    if os.getenv("BENCHMARK"):
+        logger.info(f"📊 {benchmark_step(int(os.getenv('ROOMS', '100000')))}")
+    else:
+        run_thermal_fleet()
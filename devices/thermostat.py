@@ -4,11 +4,12 @@ Controls heating/cooling based on temperature readings
 Subscribes to temperature sensor and controls HVAC system
 """
 
-import time
 import json
 import os
 import logging
-from utils import create_mqtt_client, connect_with_retry
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+from dispatch import dispatch_messages, dispatcher_from_env
+import sim_clock as clock
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("Thermostat")
@@ -54,27 +55,27 @@ class Thermostat:
             if temp_diff > self.temp_threshold:
                 # Too hot - turn on cooling
                 self.hvac_state = "COOLING"
-                logger.info(f"❄️ COOLING: Current {self.current_temp}°C > Target {self.target_temp}°C")
+                logger.info("❄️ COOLING: Current %s°C > Target %s°C", self.current_temp, self.target_temp)
             elif temp_diff < -self.temp_threshold:
                 # Too cold - turn on heating
                 self.hvac_state = "HEATING"
-                logger.info(f"🔥 HEATING: Current {self.current_temp}°C < Target {self.target_temp}°C")
+                logger.info("🔥 HEATING: Current %s°C < Target %s°C", self.current_temp, self.target_temp)
             else:
                 # Temperature OK
                 self.hvac_state = "OFF"
-                logger.info(f"✓ Temperature OK: {self.current_temp}°C")
+                logger.info("✓ Temperature OK: %s°C", self.current_temp)
                 
         elif self.mode == "COOL":
             if temp_diff > self.temp_threshold:
                 self.hvac_state = "COOLING"
-                logger.info(f"❄️ COOLING: {self.current_temp}°C")
+                logger.info("❄️ COOLING: %s°C", self.current_temp)
             else:
                 self.hvac_state = "OFF"
                 
         elif self.mode == "HEAT":
             if temp_diff < -self.temp_threshold:
                 self.hvac_state = "HEATING"
-                logger.info(f"🔥 HEATING: {self.current_temp}°C")
+                logger.info("🔥 HEATING: %s°C", self.current_temp)
             else:
                 self.hvac_state = "OFF"
     
@@ -86,7 +87,7 @@ class Thermostat:
             "target_temp": self.target_temp,
             "mode": self.mode,
             "hvac_state": self.hvac_state,
-            "timestamp": time.time()
+            "timestamp": clock.time()
         }
 
 
@@ -132,13 +133,13 @@ def run_thermostat():
                     # Publish HVAC command
                     hvac_command = {
                         "command": thermostat.hvac_state,
-                        "timestamp": time.time()
+                        "timestamp": clock.time()
                     }
-                    client.publish(hvac_topic, json.dumps(hvac_command), qos=1)
+                    publish(client, hvac_topic, json.dumps(hvac_command))
                     
                     # Publish thermostat status
                     status = thermostat.get_status()
-                    client.publish(status_topic, json.dumps(status), qos=1)
+                    publish(client, status_topic, json.dumps(status))
             
             # Handle thermostat commands
             elif msg.topic == command_topic:
@@ -153,18 +154,18 @@ def run_thermostat():
                 elif command == "STATUS":
                     pass  # Just publish status
                 else:
-                    logger.warning(f"Unknown command: {command}")
+                    logger.warning("Unknown command: %s", command)
                 
                 # Publish status after command
                 status = thermostat.get_status()
-                client.publish(status_topic, json.dumps(status), qos=1)
-                logger.info(f"📤 Published status: Mode={status['mode']}, HVAC={status['hvac_state']}")
+                publish(client, status_topic, json.dumps(status))
+                logger.info("📤 Published status: Mode=%s, HVAC=%s", status['mode'], status['hvac_state'])
             
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
     
-    # Set message callback
-    client.on_message = on_message
+    # Set message callback: handled off the network thread, one message at a time in arrival order
+    client.on_message = dispatch_messages(on_message, dispatcher_from_env("thermostat"), key=lambda msg: thermostat_id)
     
     # Connect to broker with retry
     if not connect_with_retry(client, broker, port):
@@ -172,14 +173,14 @@ def run_thermostat():
         return
     
     # Subscribe to topics
-    client.subscribe(temp_topic)
-    client.subscribe(command_topic)
+    add_subscription(client, temp_topic)
+    add_subscription(client, command_topic, qos=1)
     logger.info(f"✓ Subscribed to {temp_topic}")
     logger.info(f"✓ Subscribed to {command_topic}")
     
     # Publish initial status
     status = thermostat.get_status()
-    client.publish(status_topic, json.dumps(status), qos=1)
+    publish(client, status_topic, json.dumps(status))
     logger.info(f"📤 Published initial status: Target={status['target_temp']}°C, Mode={status['mode']}")
     
     # Start MQTT loop
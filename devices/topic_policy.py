@@ -0,0 +1,138 @@
+"""
+Topic Policy Registry
+Central table mapping topic patterns to QoS, retain, MQTT 5 message expiry and priority
+Every publish goes through utils.publish, which looks the policy up here
+"""
+
+import os
+import json
+import logging
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger("TopicPolicy")
+
+# Offline queue drop policies
+KEEP_LATEST = "latest"
+KEEP_ALL = "all"
+
+
+class TopicPolicy:
+    """Delivery policy for a class of topics"""
+    
+    __slots__ = ("name", "qos", "retain", "expiry", "priority", "queue_class")
+    
+    def __init__(self, name, qos, retain=False, expiry=None, priority=0, queue_class=KEEP_LATEST):
+        self.name = name
+        self.qos = qos
+        self.retain = retain
+        self.expiry = expiry            # seconds, MQTT 5 Message Expiry Interval
+        self.priority = priority        # higher drains first from the offline queue
+        self.queue_class = queue_class
+    
+    def __repr__(self):
+        return (f"TopicPolicy({self.name}, qos={self.qos}, retain={self.retain}, "
+                f"expiry={self.expiry}, priority={self.priority}, queue={self.queue_class})")
+
+
+# Commands must arrive exactly as sent: QoS 1, never retained, all kept while offline
+COMMAND = TopicPolicy("command", qos=1, retain=False, expiry=300, priority=3, queue_class=KEEP_ALL)
+# Motion events drive automations, deliver them but they go stale quickly
+EVENT = TopicPolicy("event", qos=1, retain=False, expiry=60, priority=2)
+# Status is state: retained so new subscribers get it immediately
+STATUS = TopicPolicy("status", qos=1, retain=True, priority=1)
+# Telemetry is superseded by the next reading within seconds: no PUBACK round trip
+TELEMETRY = TopicPolicy("telemetry", qos=0, retain=False, expiry=30, priority=0)
+# Clip chunks are large and resumable by offset: lowest priority, never worth queueing twice
+MEDIA = TopicPolicy("media", qos=1, retain=False, expiry=300, priority=0)
+
+DEFAULT_POLICY = TopicPolicy("default", qos=1)
+
+# First match wins
+POLICY_TABLE = [
+    ("home/+/command", COMMAND),
+    ("home/+/+/command", COMMAND),
+    ("home/rooms/+/+/command", COMMAND),
+    ("home/rooms/+/hvac", COMMAND),
+    ("home/+/status", STATUS),
+    ("home/+/+/status", STATUS),
+    ("home/rooms/+/+/status", STATUS),
+    ("home/security/camera/+/status", STATUS),
+    ("home/security/camera/+/thumbnail", STATUS),
+    ("home/security/camera/+/clip", EVENT),
+    ("home/security/camera/+/clip/+", MEDIA),
+    ("home/security/motion", EVENT),
+    ("home/sensor/#", TELEMETRY),
+    ("home/rooms/+/temperature", TELEMETRY),
+    ("home/shadow/snapshot", STATUS),
+    ("home/shadow/diff", EVENT),
+    ("home/stats/#", STATUS),
+    ("home/anomaly/#", EVENT),
+    ("homes/+/+/command", COMMAND),
+    ("homes/+/+/+/command", COMMAND),
+    ("cluster/+/members/+", STATUS),
+    ("cluster/+/nodes/+/inbox", COMMAND),
+]
+
+_cache = {}
+_CACHE_LIMIT = 200_000
+
+
+def policy_for(topic):
+    """
+    Look up the policy for a topic
+    
+    Args:
+        topic: Concrete topic being published
+    
+    Returns:
+        TopicPolicy of the first matching pattern, DEFAULT_POLICY otherwise
+    """
+    policy = _cache.get(topic)
+    if policy is not None:
+        return policy
+    
+    policy = DEFAULT_POLICY
+    for pattern, candidate in POLICY_TABLE:
+        if mqtt.topic_matches_sub(pattern, topic):
+            policy = candidate
+            break
+    
+    if len(_cache) >= _CACHE_LIMIT:
+        _cache.clear()
+    _cache[topic] = policy
+    return policy
+
+
+def add_policy(pattern, policy, first=True):
+    """Register a policy for a pattern, ahead of the built-in rules by default"""
+    if first:
+        POLICY_TABLE.insert(0, (pattern, policy))
+    else:
+        POLICY_TABLE.append((pattern, policy))
+    _cache.clear()
+
+
+def load_policy_file(path):
+    """
+    Load extra rules from a JSON file:
+    [{"pattern": "home/garage/#", "qos": 0, "retain": false, "expiry": 10, "priority": 0, "queue": "latest"}]
+    """
+    with open(path) as f:
+        rules = json.load(f)
+    
+    # Keep file order: the first rule in the file is matched first
+    for rule in reversed(rules):
+        policy = TopicPolicy(
+            rule.get("name", rule["pattern"]),
+            qos=int(rule.get("qos", 1)),
+            retain=bool(rule.get("retain", False)),
+            expiry=rule.get("expiry"),
+            priority=int(rule.get("priority", 0)),
+            queue_class=rule.get("queue", KEEP_LATEST),
+        )
+        add_policy(rule["pattern"], policy)
+    logger.info(f"Loaded {len(rules)} topic policy rule(s) from {path}")
+
+
+if os.getenv("TOPIC_POLICY_FILE"):
+    load_policy_file(os.getenv("TOPIC_POLICY_FILE"))
@@ -0,0 +1,391 @@
+"""
+MQTT Traffic Recorder and Replayer
+Captures home/# traffic into a compact append-only binary log
+Replays the log to a broker or straight into message handlers at 1x, Nx or max speed
+"""
+
+import time
+import struct
+import json
+import os
+import sys
+import logging
+from collections import deque
+from utils import create_mqtt_client, connect_with_retry, add_subscription
+import sim_clock as clock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("TrafficLog")
+
+# File layout: MAGIC, then a stream of records. Every record starts with a kind byte.
+# Topics are interned: the first time a topic is seen a TOPIC record assigns it an id,
+# MESSAGE records then only carry the 2 byte id instead of the full topic string.
+MAGIC = b"SHTL\x01"
+KIND_TOPIC = 0
+KIND_MESSAGE = 1
+
+TOPIC_HEADER = struct.Struct("<BHH")        # kind, topic_id, topic_len
+MESSAGE_HEADER = struct.Struct("<BdHIB")    # kind, receive_time, topic_id, payload_len, flags
+
+
+class ReplayMessage:
+    """Minimal stand-in for paho's MQTTMessage handed to on_message handlers"""
+    
+    __slots__ = ("topic", "payload", "qos", "retain", "timestamp")
+    
+    def __init__(self, topic, payload, qos=0, retain=False, timestamp=0.0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.timestamp = timestamp
+
+
+class CaptureClient:
+    """
+    Client stand-in for handler replay
+    Counts the publishes a handler makes instead of sending them to a broker
+    """
+    
+    class _Result:
+        rc = 0
+        mid = 0
+    
+    def __init__(self, keep=False):
+        self.keep = keep
+        self.published = []
+        self.publish_count = 0
+    
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.publish_count += 1
+        if self.keep:
+            self.published.append((topic, payload, qos, retain))
+        return self._Result()
+    
+    def is_connected(self):
+        return True
+
+
+class TrafficRecorder:
+    """Append-only binary writer for MQTT traffic"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.topic_ids = {}
+        self.message_count = 0
+        
+        # Re-open an existing log for append: rebuild the topic table first
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            end = len(MAGIC)
+            for record, end in _iter_records(path, offsets=True):
+                if record[0] == KIND_TOPIC:
+                    self.topic_ids[record[2]] = record[1]
+            self.file = open(path, "r+b")
+            # Cut off a partial record left by a killed recorder, new records would be misread behind it
+            if self.file.seek(0, os.SEEK_END) > end:
+                logger.warning(f"Dropping {self.file.tell() - end} bytes of a partial record at the end of {path}")
+                self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(MAGIC)
+    
+    def record(self, topic, payload, qos=0, retain=False, receive_time=None):
+        """Append one message to the log"""
+        if receive_time is None:
+            receive_time = clock.time()
+        
+        topic_id = self.topic_ids.get(topic)
+        if topic_id is None:
+            topic_id = len(self.topic_ids)
+            if topic_id > 0xFFFF:
+                raise ValueError("Too many distinct topics for one log file")
+            self.topic_ids[topic] = topic_id
+            encoded = topic.encode("utf-8")
+            self.file.write(TOPIC_HEADER.pack(KIND_TOPIC, topic_id, len(encoded)))
+            self.file.write(encoded)
+        
+        flags = (qos & 0x03) | (0x04 if retain else 0)
+        self.file.write(MESSAGE_HEADER.pack(KIND_MESSAGE, receive_time, topic_id, len(payload), flags))
+        self.file.write(payload)
+        self.message_count += 1
+    
+    def on_message(self, client, userdata, msg):
+        """paho on_message callback recording every received message"""
+        self.record(msg.topic, msg.payload, msg.qos, msg.retain)
+    
+    def flush(self):
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+
+
+def _iter_records(path, offsets=False):
+    """
+    Yield raw records from a log file, stopping cleanly at a truncated tail
+    With offsets=True yields (record, offset just past the record) instead
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a traffic log")
+        
+        while True:
+            kind = f.read(1)
+            if not kind:
+                return
+            
+            if kind[0] == KIND_TOPIC:
+                header = kind + f.read(TOPIC_HEADER.size - 1)
+                if len(header) < TOPIC_HEADER.size:
+                    return
+                _, topic_id, topic_len = TOPIC_HEADER.unpack(header)
+                topic = f.read(topic_len)
+                if len(topic) < topic_len:
+                    return
+                record = KIND_TOPIC, topic_id, topic.decode("utf-8")
+            
+            elif kind[0] == KIND_MESSAGE:
+                header = kind + f.read(MESSAGE_HEADER.size - 1)
+                if len(header) < MESSAGE_HEADER.size:
+                    return
+                _, receive_time, topic_id, payload_len, flags = MESSAGE_HEADER.unpack(header)
+                payload = f.read(payload_len)
+                if len(payload) < payload_len:
+                    # Recorder was killed mid-write, ignore the partial record
+                    return
+                record = KIND_MESSAGE, receive_time, topic_id, payload, flags
+            
+            else:
+                raise ValueError(f"Corrupt traffic log {path}: unknown record kind {kind[0]}")
+            yield (record, f.tell()) if offsets else record
+
+
+def read_log(path):
+    """
+    Read all messages from a traffic log
+    
+    Args:
+        path: Log file written by TrafficRecorder
+    
+    Returns:
+        Generator of ReplayMessage in recording order
+    """
+    topics = {}
+    for record in _iter_records(path):
+        if record[0] == KIND_TOPIC:
+            topics[record[1]] = record[2]
+        else:
+            _, receive_time, topic_id, payload, flags = record
+            yield ReplayMessage(topics[topic_id], payload, flags & 0x03, bool(flags & 0x04), receive_time)
+
+
+class TrafficReplayer:
+    """
+    Replays a recorded log at a chosen speed
+    speed=1 is real time, speed=N is N times faster, speed=0 replays as fast as possible
+    """
+    
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+    
+    def _paced(self):
+        """Yield messages, sleeping to honour the original spacing divided by speed"""
+        start_wall = None
+        start_recorded = None
+        
+        for msg in read_log(self.path):
+            if self.speed > 0:
+                if start_wall is None:
+                    start_wall = clock.monotonic()
+                    start_recorded = msg.timestamp
+                due = start_wall + (msg.timestamp - start_recorded) / self.speed
+                delay = due - clock.monotonic()
+                if delay > 0:
+                    clock.sleep(delay)
+            yield msg
+    
+    def replay_to_broker(self, client, drain_timeout=30.0):
+        """
+        Re-publish the log with its original QoS and retain flags
+        
+        Returns once every message was written to the socket (QoS 0) or
+        acknowledged (QoS 1/2), so the throughput only counts sent messages;
+        whatever is still in flight after drain_timeout is reported as unsent.
+        The client's network loop must be running.
+        """
+        count = 0
+        in_flight = deque()
+        start = time.perf_counter()
+        
+        for msg in self._paced():
+            in_flight.append(client.publish(msg.topic, msg.payload, qos=msg.qos, retain=msg.retain))
+            count += 1
+            while in_flight and _sent(in_flight[0]):
+                in_flight.popleft()
+        
+        deadline = time.monotonic() + drain_timeout
+        unsent = 0
+        for info in in_flight:
+            try:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+            except (ValueError, RuntimeError):
+                pass
+            if not _sent(info):
+                unsent += 1
+        
+        report = _report(count - unsent, time.perf_counter() - start, None)
+        report["unsent"] = unsent
+        return report
+    
+    def replay_to_handler(self, handler, client=None, userdata=None):
+        """
+        Feed the log into an on_message style handler
+        
+        Args:
+            handler: Callable taking (client, userdata, msg)
+            client: Client passed to the handler (defaults to a CaptureClient)
+            userdata: userdata passed to the handler
+        
+        Returns:
+            Dictionary with message count, elapsed time and throughput
+        """
+        if client is None:
+            client = CaptureClient()
+        
+        count = 0
+        handler_time = 0.0
+        start = time.perf_counter()
+        
+        for msg in self._paced():
+            t0 = time.perf_counter()
+            handler(client, userdata, msg)
+            handler_time += time.perf_counter() - t0
+            count += 1
+        
+        report = _report(count, time.perf_counter() - start, handler_time)
+        if isinstance(client, CaptureClient):
+            report["commands_published"] = client.publish_count
+        return report
+
+
+def _sent(info):
+    """True once a publish left the client; False if it is in flight or failed"""
+    try:
+        return info.is_published()
+    except (ValueError, RuntimeError):
+        return False
+
+
+def _report(count, elapsed, handler_time):
+    report = {
+        "messages": count,
+        "elapsed_s": round(elapsed, 6),
+        "messages_per_s": round(count / elapsed, 1) if elapsed > 0 else None,
+    }
+    if handler_time is not None:
+        report["handler_time_s"] = round(handler_time, 6)
+        report["handler_messages_per_s"] = round(count / handler_time, 1) if handler_time > 0 else None
+    return report
+
+
+def _load_handler(target):
+    """Resolve a replay target name to an on_message handler"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    
+    if target == "controller":
+        sys.path.insert(0, root)
+        from controller import AutomationController, create_message_handler
+        logging.getLogger("AutomationController").setLevel(logging.ERROR)
+        return create_message_handler(AutomationController())
+    
+    if target == "proxy":
+        sys.path.insert(0, os.path.join(root, "web_ui"))
+        import mqtt_proxy
+        return mqtt_proxy.on_message
+    
+    raise ValueError(f"Unknown replay target: {target}")
+
+
+def run_traffic_recorder():
+    """
+    Main function for traffic recorder
+    Subscribes to home/# and appends every message to the log file
+    """
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    client_id = os.getenv("CLIENT_ID", "traffic_recorder")
+    topic = os.getenv("TOPIC", "home/#")
+    log_file = os.getenv("LOG_FILE", "traffic.shtl")
+    
+    logger.info(f"Starting Traffic Recorder")
+    logger.info(f"Broker: {broker}:{port}")
+    logger.info(f"Recording {topic} to {log_file}")
+    
+    recorder = TrafficRecorder(log_file)
+    client = create_mqtt_client(client_id, broker, port)
+    client.on_message = recorder.on_message
+    
+    if not connect_with_retry(client, broker, port):
+        logger.error("Failed to connect. Exiting.")
+        return
+    
+    add_subscription(client, topic, qos=1)
+    logger.info(f"✓ Subscribed to {topic}")
+    
+    try:
+        client.loop_start()
+        while True:
+            time.sleep(1)
+            recorder.flush()
+    except KeyboardInterrupt:
+        logger.info("Shutting down traffic recorder...")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        recorder.close()
+        logger.info(f"Traffic recorder stopped. {recorder.message_count} messages recorded.")
+
+
+def run_traffic_replayer():
+    """
+    Main function for traffic replayer
+    TARGET=broker re-publishes the log, TARGET=controller|proxy feeds the handlers directly
+    SPEED=1 is real time, SPEED=N is N times faster, SPEED=max replays without pauses
+    """
+    log_file = os.getenv("LOG_FILE", "traffic.shtl")
+    target = os.getenv("TARGET", "broker")
+    speed_value = os.getenv("SPEED", "1")
+    speed = 0.0 if speed_value.lower() == "max" else float(speed_value)
+    
+    logger.info(f"Replaying {log_file} to {target} at {'max' if speed == 0 else speed}x speed")
+    replayer = TrafficReplayer(log_file, speed)
+    
+    if target == "broker":
+        broker = os.getenv("BROKER", "mosquitto")
+        port = int(os.getenv("PORT", "1883"))
+        client_id = os.getenv("CLIENT_ID", "traffic_replayer")
+        
+        client = create_mqtt_client(client_id, broker, port)
+        if not connect_with_retry(client, broker, port):
+            logger.error("Failed to connect. Exiting.")
+            return
+        client.loop_start()
+        try:
+            report = replayer.replay_to_broker(client)
+        finally:
+            client.loop_stop()
+            client.disconnect()
+    else:
+        report = replayer.replay_to_handler(_load_handler(target))
+    
+    logger.info(f"📊 Replay finished: {json.dumps(report)}")
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "replay":
+        run_traffic_replayer()
+    else:
+        run_traffic_recorder()
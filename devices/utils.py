@@ -4,73 +4,536 @@ Provides common MQTT client setup and connection handling
 """
 
 import paho.mqtt.client as mqtt
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
 import time
+from offline_queue import OfflineQueue
+from topic_policy import policy_for
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+LOG_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
+# Attributes every LogRecord has; anything else on a record came from extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
 
-def create_mqtt_client(client_id, broker, port=1883):
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields as top-level keys"""
+    
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "site": f"{record.module}:{record.lineno}",
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, noting records the rate limit dropped"""
+    
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (+{suppressed} similar suppressed)"
+        return text
+
+
+class CallSiteRateLimit(logging.Filter):
+    """
+    Token bucket per call site (file and line) for records below `level`
+    
+    A site may log `burst` records at once and `rate` per second after that.
+    Past the limit only every `sample`-th record gets through (0: none). The
+    next record that does get through carries the number dropped meanwhile as
+    `suppressed`, so the output still says how busy the site was.
+    """
+    
+    def __init__(self, rate=20.0, burst=50, sample=0, level=logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self.level = level
+        self._sites = {}    # (pathname, lineno) -> [tokens, last update, dropped, over limit]
+        self._lock = threading.Lock()
+    
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [self.burst, now, 0, 0]
+            tokens = min(self.burst, site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if tokens >= 1:
+                site[0] = tokens - 1
+            else:
+                site[0] = tokens
+                site[3] += 1
+                if not self.sample or site[3] % self.sample:
+                    site[2] += 1
+                    return False
+                record.sampled = self.sample
+            if site[2]:
+                record.suppressed = site[2]
+                site[2] = 0
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves all formatting to the writer thread
+    
+    The stock QueueHandler merges msg and args in the calling thread; this one
+    queues the record as it is, so `logger.info("x=%s", x)` costs the caller
+    only the record creation. Arguments are formatted later, so pass values
+    that are not mutated afterwards. The queue is a SimpleQueue (no locking
+    in Python); past `maxsize` queued records new ones are dropped and counted
+    instead of blocking the caller.
+    """
+    
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.SimpleQueue())
+        self.maxsize = maxsize
+        self.dropped = 0
+    
+    def prepare(self, record):
+        return record
+    
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
+
+
+_log_handler = None
+_log_listener = None
+
+
+def setup_logging(level=None, fmt=None, stream=None):
+    """
+    Configure the root logger: records are queued by the logging thread and
+    formatted and written by a background QueueListener
+    
+    Called when utils is imported, so every device, the controller and the
+    proxy share it; later logging.basicConfig calls are no-ops. Environment:
+    LOG_LEVEL (INFO), LOG_FORMAT (text or json), LOG_ASYNC (1; 0 writes in
+    the calling thread), LOG_QUEUE_SIZE (10000), and per call site limits for
+    records below WARNING: LOG_RATE records/s (20, 0 disables), LOG_BURST (50),
+    LOG_SAMPLE (0; N lets every Nth record over the limit through).
+    
+    Args:
+        level: Root level, overrides LOG_LEVEL
+        fmt: "text" or "json", overrides LOG_FORMAT
+        stream: Output stream (default stderr)
+    
+    Returns:
+        The handler installed on the root logger
+    """
+    global _log_handler, _log_listener
+    level = level or os.getenv("LOG_LEVEL", "INFO").upper()
+    fmt = fmt or os.getenv("LOG_FORMAT", "text")
+    
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(LOG_TEXT_FORMAT))
+    
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+    if os.getenv("LOG_ASYNC", "1") == "1":
+        handler = DeferredQueueHandler(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        _log_listener = logging.handlers.QueueListener(handler.queue, writer, respect_handler_level=True)
+        _log_listener.start()
+    else:
+        handler = writer
+    
+    rate = float(os.getenv("LOG_RATE", "20"))
+    if rate > 0:
+        handler.addFilter(CallSiteRateLimit(rate=rate, burst=int(os.getenv("LOG_BURST", "50")),
+                                            sample=int(os.getenv("LOG_SAMPLE", "0"))))
+    
+    root = logging.getLogger()
+    if _log_handler is not None:
+        root.removeHandler(_log_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _log_handler = handler
+    return handler
+
+
+def flush_logging():
+    """Write out every queued record (the writer thread is restarted)"""
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener.start()
+
+
+def _restart_log_writer():
+    """Forked children get a fresh queue and writer thread; the parent's thread does not exist there"""
+    global _log_listener
+    if _log_listener is None:
+        return
+    handlers = _log_listener.handlers
+    _log_handler.queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(_log_handler.queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+
+
+def _stop_log_writer():
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
+if not logging.getLogger().handlers:
+    setup_logging()
+    os.register_at_fork(after_in_child=_restart_log_writer)
+    atexit.register(_stop_log_writer)
+
+# Every client created in this process, keyed by client_id (for readiness checks)
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def create_mqtt_client(client_id, broker, port=1883, clean_session=None):
     """
     Create and configure MQTT client
     
+    The client gets a `ready` event that is set once the broker has acknowledged
+    the connection (CONNACK) and every subscription added with add_subscription
+    (SUBACK). Subscriptions are re-sent on every reconnect.
+    
+    Sessions are persistent by default (CLEAN_SESSION=0), so the broker keeps
+    QoS 1 messages for this client_id while it is offline. Messages published
+    with publish() while we are offline go to a bounded OfflineQueue
+    (OFFLINE_QUEUE_SIZE, OFFLINE_SPILL_DIR, OFFLINE_DRAIN_RATE).
+    
+    MQTT_VERSION=5 switches to MQTT 5: topic aliases for QoS 0 telemetry,
+    content type / trace id in user properties (MQTT_TRACE, MQTT_USER_PROPERTIES)
+    and receive-maximum flow control (MQTT_RECEIVE_MAXIMUM).
+    
     Args:
-        client_id: Unique identifier for this client
+        client_id: Unique identifier for this client (must be stable across restarts)
         broker: MQTT broker hostname or IP
         port: MQTT broker port (default 1883)
+        clean_session: Override the CLEAN_SESSION environment setting
     
     Returns:
         Configured MQTT client instance
     """
-    client = mqtt.Client(client_id=client_id)
+    if clean_session is None:
+        clean_session = os.getenv("CLEAN_SESSION", "0") == "1"
+    
+    if os.getenv("MQTT_VERSION", "3") == "5":
+        from mqtt5 import connect_properties, publisher_from_env
+        client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        client.clean_start = clean_session
+        client.connect_properties = connect_properties(
+            receive_maximum=int(os.getenv("MQTT_RECEIVE_MAXIMUM", "20")),
+            session_expiry=0 if clean_session else int(os.getenv("SESSION_EXPIRY", "3600")),
+        )
+        client.mqtt5 = publisher_from_env(client_id)
+    else:
+        client = mqtt.Client(client_id=client_id, clean_session=clean_session)
+        client.mqtt5 = None
+    client.ready = threading.Event()
+    client.subscriptions = {}
+    client.pending_subscribe_mid = None
+    
+    spill_dir = os.getenv("OFFLINE_SPILL_DIR")
+    client.offline_queue = OfflineQueue(
+        max_messages=int(os.getenv("OFFLINE_QUEUE_SIZE", "1000")),
+        spill_path=os.path.join(spill_dir, f"{client_id}.spill") if spill_dir else None,
+        drain_rate=float(os.getenv("OFFLINE_DRAIN_RATE", "50")),
+    )
+    
+    # Reconnect quickly after a broker blip instead of paho's 1 s minimum
+    client.reconnect_delay_set(min_delay=0.1, max_delay=5)
+    
+    # Liveness for supervisor.py: stamped by every network loop pass and reconnect
+    # attempt, so it stays fresh through a broker outage but not a hung or dead loop
+    client.last_progress = time.time()
+    _track_progress(client)
+    
+    with _clients_lock:
+        _clients[client_id] = client
+    
+    # On-demand profiling: handler timing and the admin topic (see profiling.py)
+    from profiling import attach_client
+    for topic in attach_client(client, client_id):
+        client.subscriptions[topic] = 1
     
     # Callback when connected
-    def on_connect(client, userdata, flags, rc):
+    def on_connect(client, userdata, flags, rc, properties=None):
         if rc == 0:
             logging.info(f"✓ Connected to broker {broker}:{port}")
+            if client.mqtt5 is not None:
+                client.mqtt5.on_connack(properties)
+            if client.subscriptions:
+                _send_subscriptions(client)
+            else:
+                client.ready.set()
+            client.offline_queue.start_drain(client)
         else:
             logging.error(f"✗ Connection failed with code {rc}")
     
+    # Callback when the broker acknowledged our subscriptions
+    def on_subscribe(client, userdata, mid, granted_qos, properties=None):
+        if mid == client.pending_subscribe_mid:
+            client.pending_subscribe_mid = None
+            client.ready.set()
+    
     # Callback when disconnected
-    def on_disconnect(client, userdata, rc):
+    def on_disconnect(client, userdata, rc, properties=None):
+        client.ready.clear()
         if rc != 0:
             logging.warning(f"Unexpected disconnection. Code: {rc}")
     
     client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
     client.on_disconnect = on_disconnect
     
     return client
 
 
-def connect_with_retry(client, broker, port=1883, max_retries=10, retry_delay=5):
+def _track_progress(client):
+    """Stamp client.last_progress whenever paho's network loop calls loop_misc() or reconnect()"""
+    for name in ("loop_misc", "reconnect"):
+        def tracked(*args, _method=getattr(client, name), **kwargs):
+            client.last_progress = time.time()
+            return _method(*args, **kwargs)
+        setattr(client, name, tracked)
+
+
+def _send_subscriptions(client):
+    """Subscribe to every registered topic in a single SUBSCRIBE packet"""
+    client.ready.clear()
+    result, mid = client.subscribe(list(client.subscriptions.items()))
+    if result == mqtt.MQTT_ERR_SUCCESS:
+        client.pending_subscribe_mid = mid
+
+
+def add_subscription(client, topic, qos=0):
+    """
+    Register a subscription that is (re)sent on every connect
+    
+    Args:
+        client: Client created by create_mqtt_client
+        topic: Topic filter to subscribe to
+        qos: Requested QoS
+    """
+    client.subscriptions[topic] = qos
+    if client.is_connected():
+        _send_subscriptions(client)
+
+
+def add_subscriptions(client, topics, qos=0):
+    """Register many subscriptions at once, sent in a single SUBSCRIBE packet"""
+    for topic in topics:
+        client.subscriptions[topic] = qos
+    if client.is_connected():
+        _send_subscriptions(client)
+
+
+class QueuedResult:
+    """Publish result for a message parked in the offline queue"""
+    rc = mqtt.MQTT_ERR_SUCCESS
+    mid = None
+    queued = True
+
+
+def publish(client, topic, payload, qos=None, retain=None):
+    """
+    Publish a message with the delivery policy of its topic
+    
+    QoS, retain and (on MQTT 5 clients) message expiry come from the topic
+    policy table unless given explicitly. While disconnected the message is
+    parked in the client's offline queue; while a backlog is draining new
+    messages join the queue too, so they are never sent ahead of older ones.
+    
+    Returns:
+        paho MQTTMessageInfo, or QueuedResult if the message was queued
+    """
+    policy = policy_for(topic)
+    if qos is None:
+        qos = policy.qos
+    if retain is None:
+        retain = policy.retain
+    
+    queue = getattr(client, "offline_queue", None)
+    if queue is not None and (not client.is_connected() or queue.pending()):
+        queue.put(topic, payload, qos, retain)
+        if client.is_connected():
+            queue.start_drain(client)
+        return QueuedResult()
+    
+    mqtt5 = getattr(client, "mqtt5", None)
+    if mqtt5 is not None:
+        with mqtt5.lock:
+            send_topic, properties = mqtt5.prepare(topic, qos, policy.expiry)
+            return client.publish(send_topic, payload, qos=qos, retain=retain, properties=properties)
+    return client.publish(topic, payload, qos=qos, retain=retain)
+
+
+def wait_until_ready(client, timeout=None):
+    """Block until the client is connected and subscribed, returns False on timeout"""
+    return client.ready.wait(timeout)
+
+
+def get_clients():
+    """Return all clients created in this process"""
+    with _clients_lock:
+        return list(_clients.values())
+
+
+def wait_for_clients(count, timeout=10.0):
+    """
+    Wait until at least `count` clients exist in this process and all are ready
+    
+    Returns:
+        True if every client became ready before the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        clients = get_clients()
+        if len(clients) >= count and all(client.ready.is_set() for client in clients):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.005)
+
+
+def connect_with_retry(client, broker, port=1883, max_retries=10, retry_delay=5, first_delay=0.1):
     """
     Connect to MQTT broker with retry mechanism
     
+    Retries back off exponentially from first_delay up to retry_delay, with
+    jitter so that many clients restarting together do not retry in lockstep.
+    
     Args:
         client: MQTT client instance
         broker: MQTT broker hostname
         port: MQTT broker port
         max_retries: Maximum number of connection attempts
-        retry_delay: Delay between retries in seconds
+        retry_delay: Maximum delay between retries in seconds
+        first_delay: Delay before the first retry in seconds
     
     Returns:
         True if connected successfully, False otherwise
     """
+    delay = first_delay
     for attempt in range(1, max_retries + 1):
         try:
             logging.info(f"Attempting to connect to {broker}:{port} (attempt {attempt}/{max_retries})...")
-            client.connect(broker, port, keepalive=60)
+            if getattr(client, "mqtt5", None) is not None:
+                client.connect(broker, port, keepalive=60, clean_start=client.clean_start,
+                               properties=client.connect_properties)
+            else:
+                client.connect(broker, port, keepalive=60)
             return True
         except Exception as e:
             logging.warning(f"Connection attempt {attempt} failed: {e}")
             if attempt < max_retries:
-                logging.info(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                wait = random.uniform(delay / 2, delay)
+                logging.info(f"Retrying in {wait:.2f} seconds...")
+                time.sleep(wait)
+                delay = min(delay * 2, retry_delay)
             else:
                 logging.error("Max retries reached. Could not connect to broker.")
                 return False
     
     return False
+
+
+def benchmark_logging(messages=20000, rate=20.0):
+    """
+    Time the logging cost inside a message callback, per message
+    
+    Each message logs like AutomationController.handle_motion does (three
+    records). Compared: the old setup (f-strings, formatted and written in the
+    calling thread), the queue handler with lazy arguments, and the queue
+    handler with the per call site rate limit. Output goes to os.devnull.
+    
+    Returns:
+        Dictionary mode -> {"hot_us": per-message time in the caller, "total_us": including the writer}
+    """
+    results = {}
+    devnull = open(os.devnull, "w")
+    camera_id, remaining = "front_door", 12.5
+    
+    def eager(log):
+        log.warning(f"🚨 Motion detected from {camera_id}!")
+        log.info(f"💡 Lights already ON, motion timer refreshed")
+        log.info(f"⏱️  Waiting for timeout: {remaining:.0f}s remaining")
+    
+    def lazy(log):
+        log.warning("🚨 Motion detected from %s!", camera_id)
+        log.info("💡 Lights already ON, motion timer refreshed")
+        log.info("⏱️  Waiting for timeout: %.0fs remaining", remaining)
+    
+    modes = {
+        "sync text": (eager, None, "text", 0),
+        "queued text": (lazy, 10 * messages * 3, "text", 0),
+        "queued json": (lazy, 10 * messages * 3, "json", 0),
+        "queued json + rate limit": (lazy, 10 * messages * 3, "json", rate),
+    }
+    for mode, (call, queue_size, fmt, limit) in modes.items():
+        log = logging.getLogger(f"benchmark.{mode}")
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        writer = logging.StreamHandler(devnull)
+        writer.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(LOG_TEXT_FORMAT))
+        listener = None
+        if queue_size:
+            handler = DeferredQueueHandler(maxsize=queue_size)
+            listener = logging.handlers.QueueListener(handler.queue, writer)
+        else:
+            handler = writer
+        if limit:
+            handler.addFilter(CallSiteRateLimit(rate=limit))
+        log.addHandler(handler)
+        
+        started = time.perf_counter()
+        if listener is not None:
+            # Writer starts after the burst: the caller's cost alone (on one core the
+            # writer thread would otherwise share the time slices)
+            for _ in range(messages):
+                call(log)
+            hot = time.perf_counter() - started
+            listener.start()
+            listener.stop()
+        else:
+            for _ in range(messages):
+                call(log)
+            hot = time.perf_counter() - started
+        total = time.perf_counter() - started
+        log.removeHandler(handler)
+        results[mode] = {"hot_us": round(hot / messages * 1e6, 2), "total_us": round(total / messages * 1e6, 2)}
+    devnull.close()
+    return results
+
+
+if __name__ == "__main__":
+    # python devices/utils.py [messages]: logging hot-path benchmark
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, result in benchmark_logging(count).items():
+        print(f"{name:26s} hot path {result['hot_us']:7.2f} us/msg   incl. writer {result['total_us']:7.2f} us/msg")
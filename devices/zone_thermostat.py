@@ -0,0 +1,230 @@
+"""
+Multi-Zone Thermostat Engine
+Runs the Thermostat control logic for thousands of zones in one process
+Zone state lives in parallel NumPy arrays and a whole batch of readings is decided in one pass
+"""
+
+import threading
+import json
+import os
+import logging
+import numpy as np
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+import sim_clock as clock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("ZoneThermostat")
+
+# Mode and HVAC codes stored in the arrays
+MODES = ["OFF", "AUTO", "HEAT", "COOL"]
+MODE_CODES = {name: code for code, name in enumerate(MODES)}
+MODE_OFF, MODE_AUTO, MODE_HEAT, MODE_COOL = range(4)
+
+HVAC_NAMES = {0: "OFF", 1: "HEATING", -1: "COOLING"}
+
+
+class ZoneThermostatEngine:
+    """
+    Thermostat state for many zones in parallel arrays
+    Same rules as Thermostat.update_temperature, applied to a batch at once
+    """
+    
+    def __init__(self, zone_ids=(), target_temp=24.0, temp_threshold=1.0, capacity=1024):
+        self.default_target = target_temp
+        self.default_threshold = temp_threshold
+        self.zone_ids = []
+        self.index = {}
+        self.size = 0
+        
+        capacity = max(capacity, len(zone_ids), 1)
+        self.current_temp = np.full(capacity, np.nan, dtype=np.float64)
+        self.target_temp = np.full(capacity, target_temp, dtype=np.float64)
+        self.temp_threshold = np.full(capacity, temp_threshold, dtype=np.float64)
+        self.mode = np.full(capacity, MODE_AUTO, dtype=np.int8)
+        self.hvac_state = np.zeros(capacity, dtype=np.int8)
+        
+        for zone_id in zone_ids:
+            self.zone_index(zone_id)
+    
+    def zone_index(self, zone_id):
+        """Return the array index of a zone, adding it on first sight"""
+        idx = self.index.get(zone_id)
+        if idx is not None:
+            return idx
+        
+        if self.size == len(self.mode):
+            self._grow(len(self.mode) * 2)
+        
+        idx = self.size
+        self.size += 1
+        self.index[zone_id] = idx
+        self.zone_ids.append(zone_id)
+        return idx
+    
+    def _grow(self, capacity):
+        old = self.size
+        for name, fill in (("current_temp", np.nan), ("target_temp", self.default_target),
+                           ("temp_threshold", self.default_threshold), ("mode", MODE_AUTO),
+                           ("hvac_state", 0)):
+            array = getattr(self, name)
+            grown = np.full(capacity, fill, dtype=array.dtype)
+            grown[:old] = array[:old]
+            setattr(self, name, grown)
+    
+    def set_target_temperature(self, idx, temp):
+        self.target_temp[idx] = temp
+    
+    def set_mode(self, idx, mode):
+        """Set a zone's mode, returns False for unknown modes"""
+        code = MODE_CODES.get(mode)
+        if code is None:
+            return False
+        self.mode[idx] = code
+        return True
+    
+    def update_batch(self, indices, temps):
+        """
+        Apply a batch of readings and recompute HVAC state
+        
+        Args:
+            indices: Zone indices (each zone at most once per batch)
+            temps: Temperatures in the same order
+        
+        Returns:
+            Array of zone indices whose HVAC state changed
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        temps = np.asarray(temps, dtype=np.float64)
+        self.current_temp[indices] = temps
+        
+        diff = temps - self.target_temp[indices]
+        threshold = self.temp_threshold[indices]
+        mode = self.mode[indices]
+        
+        may_cool = (mode == MODE_AUTO) | (mode == MODE_COOL)
+        may_heat = (mode == MODE_AUTO) | (mode == MODE_HEAT)
+        
+        new_state = np.zeros(len(indices), dtype=np.int8)
+        new_state[may_cool & (diff > threshold)] = -1
+        new_state[may_heat & (diff < -threshold)] = 1
+        
+        changed = new_state != self.hvac_state[indices]
+        self.hvac_state[indices] = new_state
+        return indices[changed]
+    
+    def get_status(self, idx):
+        """Get one zone's status in the single Thermostat format"""
+        current = self.current_temp[idx]
+        return {
+            "thermostat_id": self.zone_ids[idx],
+            "current_temp": None if np.isnan(current) else float(current),
+            "target_temp": float(self.target_temp[idx]),
+            "mode": MODES[self.mode[idx]],
+            "hvac_state": HVAC_NAMES[int(self.hvac_state[idx])],
+            "timestamp": clock.time()
+        }
+
+
+def run_zone_thermostat():
+    """
+    Main function for the multi-zone thermostat
+    Subscribes to home/rooms/+/temperature and home/rooms/+/thermostat/command,
+    decides every BATCH_INTERVAL seconds and publishes home/rooms/<room>/hvac only on change
+    """
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    client_id = os.getenv("CLIENT_ID", "zone_thermostat")
+    batch_interval = float(os.getenv("BATCH_INTERVAL", "0.2"))
+    
+    logger.info(f"Starting Multi-Zone Thermostat")
+    logger.info(f"Broker: {broker}:{port}")
+    logger.info(f"Batch interval: {batch_interval} seconds")
+    
+    engine = ZoneThermostatEngine()
+    engine_lock = threading.Lock()
+    pending = {}
+    pending_lock = threading.Lock()
+    
+    client = create_mqtt_client(client_id, broker, port)
+    
+    def publish_status(idx):
+        zone_id = engine.zone_ids[idx]
+        publish(client, f"home/rooms/{zone_id}/thermostat/status", json.dumps(engine.get_status(idx)))
+    
+    def on_message(client, userdata, msg):
+        """Queue readings for the next batch, apply commands immediately"""
+        try:
+            parts = msg.topic.split("/")
+            zone_id = parts[2]
+            data = json.loads(msg.payload.decode())
+            
+            if parts[-1] == "temperature":
+                if "value" in data:
+                    with pending_lock:
+                        pending[zone_id] = float(data["value"])
+            
+            elif parts[-1] == "command":
+                command = data.get("command", "").upper()
+                with engine_lock:
+                    idx = engine.zone_index(zone_id)
+                    if command == "SET_TARGET":
+                        engine.set_target_temperature(idx, float(data.get("target", 24.0)))
+                    elif command == "SET_MODE":
+                        mode = data.get("mode", "AUTO").upper()
+                        if not engine.set_mode(idx, mode):
+                            logger.warning(f"Invalid mode for {zone_id}: {mode}")
+                    elif command != "STATUS":
+                        logger.warning(f"Unknown command for {zone_id}: {command}")
+                    publish_status(idx)
+        
+        except Exception as e:
+            logger.error(f"Error processing message on {msg.topic}: {e}")
+    
+    client.on_message = on_message
+    
+    if not connect_with_retry(client, broker, port):
+        logger.error("Failed to connect. Exiting.")
+        return
+    
+    add_subscription(client, "home/rooms/+/temperature")
+    add_subscription(client, "home/rooms/+/thermostat/command", qos=1)
+    logger.info("✓ Subscribed to home/rooms/+/temperature")
+    logger.info("✓ Subscribed to home/rooms/+/thermostat/command")
+    client.loop_start()
+    
+    try:
+        while True:
+            clock.sleep(batch_interval)
+            
+            with pending_lock:
+                if not pending:
+                    continue
+                batch = pending.copy()
+                pending.clear()
+            
+            with engine_lock:
+                indices = [engine.zone_index(zone_id) for zone_id in batch]
+                changed = engine.update_batch(indices, list(batch.values()))
+                
+                timestamp = clock.time()
+                for idx in changed.tolist():
+                    zone_id = engine.zone_ids[idx]
+                    command = {"command": HVAC_NAMES[int(engine.hvac_state[idx])], "timestamp": timestamp}
+                    publish(client, f"home/rooms/{zone_id}/hvac", json.dumps(command))
+                    publish_status(idx)
+            
+            if len(changed):
+                logger.info(f"🌡️ Batch of {len(batch)} readings, {len(changed)} zone(s) changed HVAC state")
+    
+    except KeyboardInterrupt:
+        logger.info("Shutting down multi-zone thermostat...")
+    except Exception as e:
+        logger.error(f"Error: {e}")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        logger.info("Multi-zone thermostat stopped.")
+
+
+if __name__ == "__main__":
+    run_zone_thermostat()
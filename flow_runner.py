@@ -0,0 +1,742 @@
+"""
+Native Node-RED Flow Runner
+Loads Node-RED flow exports (complete-flow.json, nodered-flow.json) and executes
+them in this Python process, so automations run next to the controller without
+a Node-RED container in the decision path.
+
+Supported nodes: mqtt in, mqtt out, json, switch, change, debug, inject and
+function nodes that have a Python port registered with @flow_function (function
+bodies are JavaScript and are not interpreted). Dashboard (ui_*) nodes and any
+other type are reported at load time; messages wired into them are dropped.
+
+Run either this runner or the Node-RED flow, not both, or every command is sent twice.
+"""
+
+import argparse
+import copy
+import json
+import os
+import re
+import sys
+import time
+import base64
+import threading
+import logging
+from collections import deque
+from functools import lru_cache
+
+# Shared device helpers (topic policy, publish)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'devices'))
+from utils import create_mqtt_client, connect_with_retry, add_subscription, publish
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("FlowRunner")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Configuration and layout nodes: no runtime behaviour, never reported
+CONFIG_TYPES = {"tab", "mqtt-broker", "ui_group", "ui_tab", "ui_base", "ui_spacer", "comment", "group"}
+
+# Python ports of function nodes, by node name
+FUNCTIONS = {}
+
+
+def flow_function(name):
+    """Register fn(msg, context) as the implementation of the function node called `name`"""
+    def register(fn):
+        FUNCTIONS[name] = fn
+        return fn
+    return register
+
+
+class UnsupportedNode(Exception):
+    """Raised while building a node whose configuration cannot be executed natively"""
+
+
+_PATH_TOKEN = re.compile(r"""\[(\d+)\]|\[["']([^"']*)["']\]|\.?([^.\[\]]+)""")
+
+
+@lru_cache(maxsize=1024)
+def parse_path(path):
+    """'payload.value' / 'payload["a b"][0]' -> ('payload', 'value') / ('payload', 'a b', 0)"""
+    keys = []
+    for index, quoted, name in _PATH_TOKEN.findall(path):
+        keys.append(int(index) if index else quoted or name)
+    return tuple(keys)
+
+
+def get_property(obj, path):
+    for key in parse_path(path):
+        try:
+            obj = obj[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return obj
+
+
+def set_property(obj, path, value):
+    keys = parse_path(path)
+    for key in keys[:-1]:
+        child = obj.get(key) if isinstance(obj, dict) else None
+        if not isinstance(child, (dict, list)):
+            child = obj[key] = {}
+        obj = child
+    obj[keys[-1]] = value
+
+
+def delete_property(obj, path):
+    keys = parse_path(path)
+    for key in keys[:-1]:
+        obj = obj.get(key) if isinstance(obj, dict) else None
+    if isinstance(obj, dict):
+        obj.pop(keys[-1], None)
+
+
+class FlowContext:
+    """Node-RED flow and global context stores"""
+    
+    def __init__(self):
+        self.flows = {}
+        self.global_ = {}
+    
+    def store(self, kind, node):
+        if kind == "global":
+            return self.global_
+        return self.flows.setdefault(node.tab, {})
+
+
+def typed_value(value, vtype):
+    """
+    Constant of a Node-RED typed input, or a callable (msg, node) -> value for
+    references resolved per message
+    """
+    if vtype in ("str", None, ""):
+        return value
+    if vtype == "num":
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    if vtype == "bool":
+        return str(value).lower() == "true"
+    if vtype == "json":
+        return json.loads(value)
+    if vtype == "env":
+        return os.getenv(value, "")
+    if vtype == "re":
+        return re.compile(value)
+    if vtype == "msg":
+        return lambda msg, node: copy.deepcopy(get_property(msg, value))
+    if vtype in ("flow", "global"):
+        return lambda msg, node: copy.deepcopy(get_property(node.runner.context.store(vtype, node), value))
+    if vtype == "date":
+        return lambda msg, node: int(time.time() * 1000)
+    raise UnsupportedNode(f"value type '{vtype}' is not supported")
+
+
+def resolve(value, msg, node):
+    return value(msg, node) if callable(value) else value
+
+
+def loose_equal(a, b):
+    """JavaScript == for the values flows compare (numbers against numeric strings)"""
+    if a == b:
+        return True
+    if isinstance(a, (int, float)) != isinstance(b, (int, float)):
+        try:
+            return float(a) == float(b)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class Node:
+    """Base node: receive(msg) returns one entry per output port (msg, list of msgs or None)"""
+    
+    def __init__(self, config, runner):
+        self.id = config["id"]
+        self.type = config["type"]
+        self.name = config.get("name") or self.type
+        self.tab = config.get("z")
+        self.wires = config.get("wires", [])
+        self.runner = runner
+        self.received = 0
+        self.errors = 0
+    
+    def receive(self, msg):
+        return [msg]
+
+
+class MqttInNode(Node):
+    def __init__(self, config, runner):
+        super().__init__(config, runner)
+        self.topic = config["topic"]
+        self.qos = int(config.get("qos") or 0)
+        self.datatype = config.get("datatype", "auto-detect")
+        if self.datatype not in ("json", "utf8", "buffer", "base64", "auto", "auto-detect"):
+            raise UnsupportedNode(f"datatype '{self.datatype}'")
+    
+    def decode(self, payload):
+        if self.datatype == "buffer":
+            return payload
+        if self.datatype == "base64":
+            return base64.b64encode(payload).decode()
+        text = payload.decode("utf-8")
+        if self.datatype == "json":
+            return json.loads(text)
+        if self.datatype in ("auto", "auto-detect"):
+            try:
+                return json.loads(text)
+            except ValueError:
+                return text
+        return text
+
+
+class MqttOutNode(Node):
+    def __init__(self, config, runner):
+        super().__init__(config, runner)
+        self.topic = config.get("topic", "")
+        self.qos = int(config["qos"]) if config.get("qos", "") != "" else None
+        retain = config.get("retain", "")
+        self.retain = None if retain == "" else str(retain).lower() == "true"
+    
+    def receive(self, msg):
+        topic = self.topic or msg.get("topic")
+        if not topic:
+            raise ValueError("no topic set")
+        payload = msg.get("payload")
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload)
+        elif isinstance(payload, bool):
+            payload = "true" if payload else "false"
+        elif payload is None:
+            payload = ""
+        elif not isinstance(payload, (str, bytes, bytearray)):
+            payload = str(payload)
+        qos = self.qos if self.qos is not None else msg.get("qos")
+        retain = self.retain if self.retain is not None else msg.get("retain")
+        publish(self.runner.client, topic, payload, qos=qos, retain=retain)
+        self.runner.record_decision(msg)
+        return None
+
+
+class JsonNode(Node):
+    def __init__(self, config, runner):
+        super().__init__(config, runner)
+        self.property = config.get("property") or "payload"
+        self.action = config.get("action", "")
+        self.pretty = bool(config.get("pretty"))
+    
+    def receive(self, msg):
+        value = get_property(msg, self.property)
+        if isinstance(value, (str, bytes)):
+            if self.action in ("", "obj"):
+                set_property(msg, self.property, json.loads(value))
+        elif isinstance(value, (dict, list, int, float, bool)) or value is None:
+            if self.action in ("", "str"):
+                set_property(msg, self.property, json.dumps(value, indent=4 if self.pretty else None))
+        return [msg]
+
+
+class SwitchNode(Node):
+    OPERATORS = {
+        "eq": loose_equal,
+        "neq": lambda a, b: not loose_equal(a, b),
+        "lt": lambda a, b: a is not None and a < b,
+        "lte": lambda a, b: a is not None and a <= b,
+        "gt": lambda a, b: a is not None and a > b,
+        "gte": lambda a, b: a is not None and a >= b,
+        "cont": lambda a, b: a is not None and str(b) in a,
+        "regex": lambda a, b: a is not None and b.search(str(a)) is not None,
+        "true": lambda a, b: a is True,
+        "false": lambda a, b: a is False,
+        "null": lambda a, b: a is None,
+        "nnull": lambda a, b: a is not None,
+        "empty": lambda a, b: a in ("", [], {}),
+        "nempty": lambda a, b: isinstance(a, (str, list, dict)) and len(a) > 0,
+    }
+    
+    def __init__(self, config, runner):
+        super().__init__(config, runner)
+        if config.get("propertyType", "msg") != "msg":
+            raise UnsupportedNode(f"property type '{config.get('propertyType')}'")
+        self.property = config.get("property") or "payload"
+        self.checkall = str(config.get("checkall", "true")) == "true"
+        self.rules = []
+        for rule in config.get("rules", []):
+            kind = rule["t"]
+            if kind == "btwn":
+                low, high = typed_value(rule["v"], rule.get("vt")), typed_value(rule["v2"], rule.get("v2t"))
+                self.rules.append((kind, (low, high)))
+            elif kind == "else":
+                self.rules.append((kind, None))
+            elif kind in self.OPERATORS:
+                vtype = "re" if kind == "regex" else rule.get("vt")
+                self.rules.append((kind, typed_value(rule.get("v", ""), vtype)))
+            else:
+                raise UnsupportedNode(f"switch rule '{kind}'")
+    
+    def receive(self, msg):
+        value = get_property(msg, self.property)
+        outputs = [None] * len(self.rules)
+        matched = False
+        for port, (kind, operand) in enumerate(self.rules):
+            if kind == "else":
+                hit = not matched
+            elif kind == "btwn":
+                low, high = resolve(operand[0], msg, self), resolve(operand[1], msg, self)
+                hit = value is not None and low <= value <= high
+            else:
+                try:
+                    hit = self.OPERATORS[kind](value, resolve(operand, msg, self))
+                except TypeError:
+                    hit = False
+            if hit:
+                outputs[port] = msg
+                matched = True
+                if not self.checkall:
+                    break
+        return outputs
+
+
+class ChangeNode(Node):
+    def __init__(self, config, runner):
+        super().__init__(config, runner)
+        self.rules = []
+        for rule in config.get("rules", []):
+            kind, target = rule["t"], rule.get("pt", "msg")
+            if target not in ("msg", "flow", "global"):
+                raise UnsupportedNode(f"target type '{target}'")
+            if kind == "set":
+                self.rules.append((kind, target, rule["p"], typed_value(rule.get("to", ""), rule.get("tot"))))
+            elif kind == "change":
+                if rule.get("fromt") == "re":
+                    pattern = re.compile(rule["from"])
+                else:
+                    pattern = re.compile(re.escape(str(typed_value(rule["from"], rule.get("fromt")))))
+                self.rules.append((kind, target, rule["p"], (pattern, typed_value(rule.get("to", ""), rule.get("tot")))))
+            elif kind == "delete":
+                self.rules.append((kind, target, rule["p"], None))
+            elif kind == "move":
+                self.rules.append((kind, target, rule["p"], (rule.get("tot", "msg"), rule["to"])))
+            else:
+                raise UnsupportedNode(f"change rule '{kind}'")
+    
+    def _store(self, target, msg):
+        return msg if target == "msg" else self.runner.context.store(target, self)
+    
+    def receive(self, msg):
+        for kind, target, path, operand in self.rules:
+            store = self._store(target, msg)
+            if kind == "set":
+                set_property(store, path, resolve(operand, msg, self))
+            elif kind == "change":
+                current = get_property(store, path)
+                if isinstance(current, str):
+                    pattern, replacement = operand
+                    set_property(store, path, pattern.sub(str(resolve(replacement, msg, self)), current))
+            elif kind == "delete":
+                delete_property(store, path)
+            elif kind == "move":
+                value = get_property(store, path)
+                delete_property(store, path)
+                set_property(self._store(operand[0], msg), operand[1], value)
+        return [msg]
+
+
+class FunctionNode(Node):
+    def __init__(self, config, runner):
+        super().__init__(config, runner)
+        self.function = FUNCTIONS.get(config.get("name"))
+        if self.function is None:
+            raise UnsupportedNode("JavaScript function without a Python port (register one with @flow_function)")
+        self.outputs = int(config.get("outputs", 1))
+        self.context = {}
+    
+    def receive(self, msg):
+        result = self.function(msg, self.context)
+        if result is None:
+            return None
+        if self.outputs == 1 and not isinstance(result, list):
+            return [result]
+        return result if isinstance(result, list) else [result]
+
+
+class DebugNode(Node):
+    def __init__(self, config, runner):
+        super().__init__(config, runner)
+        self.active = config.get("active", True)
+        self.complete = config.get("complete", "payload")
+        self.level = logging.INFO if config.get("console") else logging.DEBUG
+    
+    def receive(self, msg):
+        if self.active and logger.isEnabledFor(self.level):
+            value = msg if self.complete == "true" else get_property(msg, self.complete)
+            logger.log(self.level, f"🐞 [{self.name}] {value}")
+        return None
+
+
+class InjectNode(Node):
+    def __init__(self, config, runner):
+        super().__init__(config, runner)
+        if config.get("crontab"):
+            raise UnsupportedNode("crontab schedules")
+        props = config.get("props") or [{"p": "payload"}, {"p": "topic", "vt": "str"}]
+        self.props = []
+        for prop in props:
+            name = prop["p"]
+            if name == "payload":
+                value = typed_value(config.get("payload", ""), prop.get("vt") or config.get("payloadType", "str"))
+            elif name == "topic":
+                value = config.get("topic", "")
+            else:
+                value = typed_value(prop.get("v", ""), prop.get("vt"))
+            self.props.append((name, value))
+        self.repeat = float(config["repeat"]) if config.get("repeat") else None
+        self.once_delay = float(config.get("onceDelay") or 0.1) if config.get("once") else None
+    
+    def create_message(self):
+        msg = {"_msgid": self.runner.next_msgid()}
+        for name, value in self.props:
+            set_property(msg, name, resolve(value, msg, self))
+        return msg
+
+
+NODE_TYPES = {
+    "mqtt in": MqttInNode,
+    "mqtt out": MqttOutNode,
+    "json": JsonNode,
+    "switch": SwitchNode,
+    "change": ChangeNode,
+    "function": FunctionNode,
+    "debug": DebugNode,
+    "inject": InjectNode,
+}
+
+
+@flow_function("Format Motion Status")
+def format_motion_status(msg, context):
+    if msg.get("payload") == "MOTION_DETECTED":
+        msg["payload"] = '<span class="status-motion">🚨 MOTION DETECTED!</span>'
+    else:
+        msg["payload"] = '<span class="status-online">✅ No Motion</span>'
+    return msg
+
+
+@flow_function("Format Lamp Status")
+def format_lamp_status(msg, context):
+    if msg.get("payload") == "ON":
+        msg["payload"] = '<span class="status-online">💡 Lamp is ON</span>'
+    else:
+        msg["payload"] = '<span class="status-offline">💡 Lamp is OFF</span>'
+    return msg
+
+
+def load_flows(paths, tabs=None):
+    """
+    Read flow exports
+    
+    Args:
+        paths: Flow JSON files
+        tabs: Optional tab labels to keep (all enabled tabs otherwise)
+    
+    Returns:
+        List of node configurations
+    """
+    nodes = []
+    for path in paths:
+        with open(path) as f:
+            nodes.extend(json.load(f))
+    disabled = {n["id"] for n in nodes if n["type"] == "tab" and (n.get("disabled") or (tabs and n.get("label") not in tabs))}
+    return [n for n in nodes if n.get("z") not in disabled and not n.get("d") and n["id"] not in disabled]
+
+
+class FlowRunner:
+    """
+    Executes flow nodes on MQTT messages
+    
+    A message is pushed through the graph synchronously in the MQTT network
+    thread; when a port fans out to several nodes every extra branch gets a
+    deep copy, as Node-RED does.
+    """
+    
+    def __init__(self, configs, client=None):
+        self.client = client
+        self.context = FlowContext()
+        self.nodes = {}
+        self.unsupported = {}      # id -> (type, name, reason)
+        self.dangling = []         # (from node, missing target id)
+        self.dropped = 0
+        self.decisions = deque(maxlen=10000)   # seconds from MQTT receive to publish
+        self._msgid = 0
+        self._timers = []
+        
+        for config in configs:
+            node_type = config["type"]
+            if node_type in CONFIG_TYPES:
+                continue
+            node_class = NODE_TYPES.get(node_type)
+            name = config.get("name") or node_type
+            if node_class is None:
+                reason = "dashboard node (rendered by Node-RED)" if node_type.startswith("ui_") else "node type not supported"
+                self.unsupported[config["id"]] = (node_type, name, reason)
+                continue
+            try:
+                self.nodes[config["id"]] = node_class(config, self)
+            except UnsupportedNode as e:
+                self.unsupported[config["id"]] = (node_type, name, str(e))
+        
+        for node in self.nodes.values():
+            for port in node.wires:
+                for target in port:
+                    if target not in self.nodes and target not in self.unsupported:
+                        self.dangling.append((node.name, target))
+    
+    def report(self):
+        """Log what will and will not run"""
+        logger.info(f"✓ {len(self.nodes)} node(s) run natively")
+        for node_type, name, reason in self.unsupported.values():
+            logger.warning(f"⚠️ Not executed: {node_type} '{name}': {reason}")
+        for name, target in self.dangling:
+            logger.warning(f"⚠️ '{name}' is wired to missing node {target}")
+        for node in self.nodes.values():
+            if isinstance(node, JsonNode) and node.action == "":
+                sources = [n for n in self.nodes.values() if isinstance(n, MqttInNode) and n.datatype == "json"
+                           and any(node.id in port for port in n.wires)]
+                if sources:
+                    logger.warning(f"⚠️ json node '{node.name}' gets parsed JSON from '{sources[0].name}' "
+                                   f"and will turn it back into a string (set its action to 'obj')")
+    
+    def next_msgid(self):
+        self._msgid += 1
+        return f"{self._msgid:x}"
+    
+    def deliver(self, node, msg):
+        """Run msg through node and everything downstream of it"""
+        stack = [(node, msg)]
+        nodes = self.nodes
+        while stack:
+            node, msg = stack.pop()
+            node.received += 1
+            try:
+                outputs = node.receive(msg)
+            except Exception as e:
+                node.errors += 1
+                logger.error(f"Node '{node.name}' ({node.type}) failed: {e}")
+                continue
+            if not outputs:
+                continue
+            for port, out in enumerate(outputs):
+                if out is None or port >= len(node.wires):
+                    continue
+                for item in (out if isinstance(out, list) else [out]):
+                    for i, target_id in enumerate(node.wires[port]):
+                        target = nodes.get(target_id)
+                        if target is None:
+                            self.dropped += 1
+                            continue
+                        stack.append((target, item if i == 0 else copy.deepcopy(item)))
+    
+    def record_decision(self, msg):
+        received = msg.get("_received")
+        if received is not None:
+            self.decisions.append(time.perf_counter() - received)
+    
+    def _mqtt_callback(self, inputs):
+        def on_message(client, userdata, mqtt_msg):
+            received = time.perf_counter()
+            for node in inputs:
+                try:
+                    payload = node.decode(mqtt_msg.payload)
+                except ValueError as e:
+                    node.errors += 1
+                    logger.error(f"Node '{node.name}': cannot decode payload on {mqtt_msg.topic}: {e}")
+                    continue
+                msg = {"topic": mqtt_msg.topic, "payload": payload, "qos": mqtt_msg.qos,
+                       "retain": mqtt_msg.retain, "_msgid": self.next_msgid(), "_received": received}
+                self.deliver(node, msg)
+        return on_message
+    
+    def attach(self, client):
+        """Subscribe the flow's mqtt in nodes on client (one callback per topic)"""
+        self.client = client
+        by_topic = {}
+        for node in self.nodes.values():
+            if isinstance(node, MqttInNode):
+                by_topic.setdefault(node.topic, []).append(node)
+        for topic, inputs in by_topic.items():
+            client.message_callback_add(topic, self._mqtt_callback(inputs))
+            add_subscription(client, topic, qos=max(node.qos for node in inputs))
+            logger.info(f"✓ Subscribed to {topic} ({len(inputs)} flow input(s))")
+    
+    def inject(self, name_or_id):
+        """Fire an inject node, like its button in the Node-RED editor"""
+        for node in self.nodes.values():
+            if isinstance(node, InjectNode) and name_or_id in (node.id, node.name):
+                self.deliver(node, node.create_message())
+                return True
+        return False
+    
+    def start(self):
+        """Start inject nodes configured to fire once and/or repeat"""
+        for node in self.nodes.values():
+            if isinstance(node, InjectNode):
+                if node.once_delay is not None:
+                    self._schedule(node, node.once_delay, repeat=False)
+                if node.repeat:
+                    self._schedule(node, node.repeat, repeat=True)
+    
+    def _schedule(self, node, delay, repeat):
+        def fire():
+            self.deliver(node, node.create_message())
+            if repeat and self._timers is not None:
+                self._schedule(node, delay, repeat)
+        timer = threading.Timer(delay, fire)
+        timer.daemon = True
+        self._timers.append(timer)
+        timer.start()
+    
+    def stop(self):
+        timers, self._timers = self._timers, None
+        for timer in timers or []:
+            timer.cancel()
+    
+    def stats(self):
+        decisions = sorted(self.decisions)
+        result = {"nodes": {node.name: node.received for node in self.nodes.values() if node.received},
+                  "errors": sum(node.errors for node in self.nodes.values()),
+                  "dropped": self.dropped}
+        if decisions:
+            result["decision_ms_p50"] = round(decisions[len(decisions) // 2] * 1000, 3)
+            result["decision_ms_p95"] = round(decisions[int(len(decisions) * 0.95)] * 1000, 3)
+        return result
+
+
+def measure_latency(broker, port, samples=200, trigger_topic="home/sensor/motion",
+                    response_topic="home/actuator/lamp/command", timeout=2.0):
+    """
+    End-to-end latency of whatever executes the motion -> lamp flow
+    (this runner, or Node-RED when it is running instead)
+    
+    Publishes alternating motion readings and times each until the lamp command
+    arrives. A plain echo through the broker is timed first as the baseline, so
+    the difference is the cost of the executor itself.
+    
+    Returns:
+        Dictionary with sample count, timeouts, p50/p95/max and baseline_p50 in milliseconds
+    """
+    client = create_mqtt_client("flow_latency_probe", broker, port)
+    echo_topic = "bench/flow_latency/echo"
+    arrived = threading.Event()
+    
+    def on_response(client, userdata, msg):
+        arrived.set()
+    
+    client.message_callback_add(response_topic, on_response)
+    client.message_callback_add(echo_topic, on_response)
+    if not connect_with_retry(client, broker, port):
+        return None
+    add_subscription(client, response_topic, qos=1)
+    add_subscription(client, echo_topic, qos=1)
+    client.loop_start()
+    client.ready.wait(5)
+    
+    def sample(topic, payload):
+        arrived.clear()
+        start = time.perf_counter()
+        publish(client, topic, payload, qos=1, retain=False)
+        return time.perf_counter() - start if arrived.wait(timeout) else None
+    
+    baseline = sorted(t for t in (sample(echo_topic, "ping") for _ in range(min(samples, 50))) if t is not None)
+    latencies = []
+    timeouts = 0
+    for i in range(samples):
+        value = (i + 1) % 2
+        payload = {"sensor_id": "latency_probe", "value": value,
+                   "status": "motion detected" if value else "no motion", "timestamp": time.time()}
+        elapsed = sample(trigger_topic, json.dumps(payload))
+        if elapsed is None:
+            timeouts += 1
+        else:
+            latencies.append(elapsed)
+    client.loop_stop()
+    client.disconnect()
+    
+    latencies.sort()
+    if not latencies:
+        return {"samples": 0, "timeouts": timeouts}
+    return {
+        "samples": len(latencies),
+        "timeouts": timeouts,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "baseline_p50_ms": round(baseline[len(baseline) // 2] * 1000, 2) if baseline else None,
+    }
+
+
+def run_flow_runner(argv=None):
+    """
+    Main function for the flow runner
+    FLOW_FILES (comma separated, default complete-flow.json) and FLOW_TABS (tab labels)
+    
+    Options:
+        --check          Report supported/unsupported nodes and exit
+        --benchmark N    Run the flows and measure N motion -> lamp round trips
+        --measure N      Only measure (against Node-RED or another running executor)
+    """
+    parser = argparse.ArgumentParser(description="Run Node-RED flows natively")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--benchmark", type=int, metavar="N")
+    parser.add_argument("--measure", type=int, metavar="N")
+    args = parser.parse_args(argv if argv is not None else [])
+    
+    files = [f.strip() for f in os.getenv("FLOW_FILES", "complete-flow.json").split(",") if f.strip()]
+    paths = [f if os.path.isabs(f) else os.path.join(BASE_DIR, f) for f in files]
+    tabs = [t for t in os.getenv("FLOW_TABS", "").split(",") if t] or None
+    configs = load_flows(paths, tabs)
+    broker_config = next((n for n in configs if n["type"] == "mqtt-broker"), {})
+    broker = os.getenv("BROKER", broker_config.get("broker", "mosquitto"))
+    port = int(os.getenv("PORT", broker_config.get("port", "1883")))
+    client_id = os.getenv("CLIENT_ID", "flow_runner")
+    
+    if args.measure:
+        logger.info(f"📊 Flow latency: {measure_latency(broker, port, args.measure)}")
+        return
+    
+    logger.info("=" * 60)
+    logger.info(f"Starting Flow Runner: {', '.join(files)}")
+    logger.info("=" * 60)
+    
+    runner = FlowRunner(configs)
+    runner.report()
+    if args.check:
+        return
+    
+    client = create_mqtt_client(client_id, broker, port)
+    if not connect_with_retry(client, broker, port):
+        logger.error("Failed to connect. Exiting.")
+        return
+    runner.attach(client)
+    client.loop_start()
+    runner.start()
+    
+    try:
+        if args.benchmark:
+            client.ready.wait(5)
+            result = measure_latency(broker, port, args.benchmark)
+            logger.info(f"📊 End-to-end (sensor -> broker -> runner -> broker -> lamp): {result}")
+            logger.info(f"📊 In-process decision time: {runner.stats()}")
+            return
+        while True:
+            time.sleep(60)
+            logger.info(f"📊 {runner.stats()}")
+    except KeyboardInterrupt:
+        logger.info("Shutting down flow runner...")
+    finally:
+        runner.stop()
+        client.loop_stop()
+        client.disconnect()
+        logger.info("Flow runner stopped.")
+
+
+if __name__ == "__main__":
+    run_flow_runner(sys.argv[1:])
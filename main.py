@@ -5,19 +5,19 @@ Demonstrates multi-threading for responsive device control
 """
 
 import threading
-import time
 import logging
+import socket
 import sys
 import os
+import time
 
 # Add devices directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'devices'))
 
-from devices.temp_sensor import run_temp_sensor
-from devices.smart_light import run_smart_light
-from devices.thermostat import run_thermostat
-from devices.security_camera import run_security_camera
-from controller import run_automation_controller
+from run_device import load_device
+from utils import wait_for_clients, get_clients
+from profiling import install_signal_handlers
+import sim_clock as clock
 
 logging.basicConfig(
     level=logging.INFO,
@@ -29,12 +29,15 @@ logger = logging.getLogger("MainApp")
 class SmartHomeSystem:
     """Main coordinator for smart home system using multi-threading"""
     
-    def __init__(self):
+    def __init__(self, ready_timeout=30.0):
         self.threads = []
         self.running = False
-        
-    def start_device_thread(self, target, name):
-        """Start a device in a separate thread"""
+        self.ready_timeout = ready_timeout
+        self.startup_time = None
+    
+    def start_device_thread(self, device_type, name):
+        """Start a device in a separate thread, importing its module inside the thread"""
+        target = lambda: load_device(device_type)()
         thread = threading.Thread(target=target, name=name, daemon=True)
         thread.start()
         self.threads.append(thread)
@@ -49,19 +52,26 @@ class SmartHomeSystem:
         logger.info("Starting all devices using multi-threading...")
         logger.info("")
         
-        # List of devices to start
+        # List of devices to start (keys of run_device.DEVICE_REGISTRY)
         devices = [
-            (run_temp_sensor, "TemperatureSensor"),
-            (run_smart_light, "SmartLight"),
-            (run_thermostat, "Thermostat"),
-            (run_security_camera, "SecurityCamera"),
-            (run_automation_controller, "AutomationController")
+            ("temp_sensor", "TemperatureSensor"),
+            ("smart_light", "SmartLight"),
+            ("thermostat", "Thermostat"),
+            ("security_camera", "SecurityCamera"),
+            ("automation_controller", "AutomationController")
         ]
         
-        # Start each device in its own thread
-        for device_func, device_name in devices:
-            self.start_device_thread(device_func, device_name)
-            time.sleep(0.5)  # Small delay between starts
+        # Start every device at once, they connect to the broker concurrently
+        start = time.perf_counter()
+        for device_type, device_name in devices:
+            self.start_device_thread(device_type, device_name)
+        
+        # Ready means CONNACK + SUBACK received, not a fixed sleep
+        if wait_for_clients(len(devices), timeout=self.ready_timeout):
+            self.startup_time = time.perf_counter() - start
+            logger.info(f"⚡ All devices connected and subscribed in {self.startup_time * 1000:.0f} ms")
+        else:
+            logger.warning(f"⚠️ Not all devices were ready after {self.ready_timeout}s")
         
         self.running = True
         
@@ -92,7 +102,7 @@ class SmartHomeSystem:
     def monitor_threads(self):
         """Monitor thread health"""
         while self.running:
-            time.sleep(10)
+            clock.sleep(10)
             
             # Check if all threads are alive
             dead_threads = [t for t in self.threads if not t.is_alive()]
@@ -122,9 +132,45 @@ class SmartHomeSystem:
         logger.info("=" * 70)
 
 
+def benchmark_startup():
+    """
+    Measure cold start and recovery after a broker blip
+    
+    Starts the system, waits until every client is ready, then drops every
+    client's connection and measures how long until all are ready again.
+    
+    Returns:
+        Dictionary with cold start and reconnect times in milliseconds
+    """
+    system = SmartHomeSystem(ready_timeout=30.0)
+    system.start_all_devices()
+    result = {"cold_start_ms": None, "reconnect_ms": None}
+    if system.startup_time is None:
+        return result
+    result["cold_start_ms"] = round(system.startup_time * 1000, 1)
+    
+    # Simulate a broker blip: kill every TCP connection, paho reconnects on its own
+    clients = get_clients()
+    start = time.perf_counter()
+    for client in clients:
+        sock = client.socket()
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    
+    # Wait for every client to notice the drop before waiting for readiness again
+    while any(client.ready.is_set() for client in clients):
+        time.sleep(0.001)
+    if wait_for_clients(len(clients), timeout=30.0):
+        result["reconnect_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    
+    logger.info(f"📊 Startup benchmark: {result}")
+    return result
+
+
 def main():
     """Main entry point"""
-    # Create smart home system
+    # Create smart home system (SIGUSR1/SIGUSR2 profile the running system, see devices/profiling.py)
+    install_signal_handlers()
     system = SmartHomeSystem()
     
     try:
@@ -133,7 +179,7 @@ def main():
         
         # Monitor threads
         system.monitor_threads()
-        
+    
     except KeyboardInterrupt:
         logger.info("\n\nReceived interrupt signal...")
     except Exception as e:
@@ -149,4 +195,11 @@ if __name__ == "__main__":
     if "PORT" not in os.environ:
         os.environ["PORT"] = "1883"
     
-    main()
+    if os.getenv("RUN_MODE", "threads") == "processes":
+        # One process per device with liveness checks and restarts, see supervisor.py
+        from supervisor import run_supervisor
+        run_supervisor()
+    elif os.getenv("STARTUP_BENCHMARK") == "1":
+        benchmark_startup()
+    else:
+        main()
@@ -0,0 +1,282 @@
+"""
+Process Supervisor
+Runs every component of the smart home in its own process (devices/run_device.py),
+so they no longer share one GIL, and keeps them running:
+
+- liveness: the process must be alive and keep its heartbeat file fresh, which
+  run_device does while the process' MQTT network loops make progress (they
+  keep retrying through a broker outage, so an outage alone restarts nothing)
+- restarts with exponential backoff and jitter; the backoff resets once a
+  component stayed up for SUPERVISOR_STABLE_SECONDS
+- graceful shutdown on SIGINT/SIGTERM: children get SIGINT (their normal
+  KeyboardInterrupt cleanup: checkpoints, disconnect), SIGKILL after
+  SUPERVISOR_STOP_TIMEOUT
+- optional CPU pinning per component
+
+Components come from SUPERVISOR_COMPONENTS, a comma separated list of
+DEVICE_REGISTRY keys with an optional CPU list, e.g.
+    temp_sensor,thermostat,automation_controller@0,camera_pool@1-3
+"""
+
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'devices'))
+
+from run_device import DEVICE_REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("Supervisor")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_COMPONENTS = "temp_sensor,smart_light,thermostat,security_camera,automation_controller"
+
+
+def parse_cpus(spec):
+    """'0,2-3' -> {0, 2, 3}"""
+    cpus = set()
+    for part in spec.split(","):
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def parse_components(spec):
+    """
+    Parse SUPERVISOR_COMPONENTS
+
+    Returns:
+        List of (device_type, cpus or None)
+    """
+    components = []
+    for entry in spec.replace(";", ",").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        device_type, _, cpus = entry.partition("@")
+        if device_type not in DEVICE_REGISTRY:
+            raise ValueError(f"Unknown component {device_type}, expected one of {', '.join(DEVICE_REGISTRY)}")
+        components.append((device_type, parse_cpus(cpus.replace("+", ",")) if cpus else None))
+    return components
+
+
+class Component:
+    """One supervised process and its restart bookkeeping"""
+
+    def __init__(self, device_type, cpus=None, heartbeat_path=None, first_backoff=1.0):
+        self.device_type = device_type
+        self.cpus = cpus
+        self.heartbeat_path = heartbeat_path
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.backoff = first_backoff
+        self.next_start = 0.0
+        self.last_exit = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def heartbeat_age(self, now):
+        """Seconds since the last heartbeat (or since start, before the first one)"""
+        try:
+            beat = os.stat(self.heartbeat_path).st_mtime
+        except OSError:
+            beat = 0.0
+        return now - max(beat, self.started or now)
+
+
+class Supervisor:
+    """
+    Start, watch and restart component processes
+
+    Args:
+        components: List of (device_type, cpus) from parse_components
+        liveness_timeout: Restart a component whose heartbeat is older (0 disables)
+        first_backoff / max_backoff: Restart delay bounds in seconds
+        stable_seconds: Uptime after which the backoff resets
+        stop_timeout: Grace period for SIGINT before SIGKILL
+    """
+
+    def __init__(self, components, liveness_timeout=30.0, first_backoff=1.0, max_backoff=60.0,
+                 stable_seconds=60.0, stop_timeout=10.0, heartbeat_interval=2.0):
+        self.heartbeat_dir = tempfile.mkdtemp(prefix="smarthome-supervisor-")
+        self.components = [
+            Component(device_type, cpus, os.path.join(self.heartbeat_dir, f"{index}-{device_type}"), first_backoff)
+            for index, (device_type, cpus) in enumerate(components)
+        ]
+        self.liveness_timeout = liveness_timeout
+        self.first_backoff = first_backoff
+        self.max_backoff = max_backoff
+        self.stable_seconds = stable_seconds
+        self.stop_timeout = stop_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.running = False
+
+    def start(self, component):
+        env = dict(os.environ)
+        env.update({
+            "DEVICE_TYPE": component.device_type,
+            "SUPERVISOR_HEARTBEAT_FILE": component.heartbeat_path,
+            "SUPERVISOR_HEARTBEAT_INTERVAL": str(self.heartbeat_interval),
+            "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.path.join(ROOT, "devices"),
+                                                        os.environ.get("PYTHONPATH")])),
+        })
+        # Own session: a terminal Ctrl+C reaches only the supervisor, which then stops children in order
+        component.process = subprocess.Popen([sys.executable, os.path.join(ROOT, "devices", "run_device.py")],
+                                             env=env, cwd=ROOT, start_new_session=True)
+        component.started = time.time()
+        if component.cpus:
+            self.pin(component)
+        logger.info("▶️ Started %s (pid %s%s)", component.device_type, component.process.pid,
+                    f", cpus {sorted(component.cpus)}" if component.cpus else "")
+
+    @staticmethod
+    def pin(component):
+        if not hasattr(os, "sched_setaffinity"):
+            logger.warning("CPU pinning is not supported on this platform, %s runs unpinned", component.device_type)
+            return
+        cpus = component.cpus & os.sched_getaffinity(0)
+        if not cpus:
+            logger.warning("None of cpus %s is available, %s runs unpinned", sorted(component.cpus),
+                           component.device_type)
+            return
+        try:
+            os.sched_setaffinity(component.process.pid, cpus)
+        except OSError as e:
+            logger.warning("Could not pin %s: %s", component.device_type, e)
+
+    def schedule_restart(self, component, reason):
+        component.last_exit = reason
+        component.process = None
+        component.restarts += 1
+        delay = random.uniform(component.backoff / 2, component.backoff)
+        component.next_start = time.monotonic() + delay
+        component.backoff = min(component.backoff * 2, self.max_backoff)
+        logger.warning("⚠️ %s %s, restart #%d in %.1fs", component.device_type, reason, component.restarts, delay)
+
+    def check(self, component):
+        """One supervision step for a component"""
+        now = time.monotonic()
+        if component.process is None:
+            if self.running and now >= component.next_start:
+                self.start(component)
+            return
+        code = component.process.poll()
+        if code is not None:
+            self.schedule_restart(component, f"exited with code {code}")
+            return
+        wall = time.time()
+        if self.liveness_timeout and component.heartbeat_age(wall) > self.liveness_timeout:
+            logger.warning("💤 %s missed its heartbeat for %.0fs, killing it", component.device_type,
+                           component.heartbeat_age(wall))
+            self.terminate([component])
+            self.schedule_restart(component, "was not live")
+            return
+        if component.backoff > self.first_backoff and wall - component.started > self.stable_seconds:
+            component.backoff = self.first_backoff
+
+    def terminate(self, components):
+        """SIGINT, then SIGKILL whatever is still running after stop_timeout"""
+        running = [component for component in components if component.alive()]
+        for component in running:
+            try:
+                component.process.send_signal(signal.SIGINT)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.stop_timeout
+        for component in running:
+            try:
+                component.process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning("%s did not stop in %.0fs, killing it", component.device_type, self.stop_timeout)
+                try:
+                    # The whole session: components with worker processes (camera_pool) leave no orphans
+                    os.killpg(component.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                component.process.wait()
+
+    def status(self):
+        wall = time.time()
+        return [{
+            "component": component.device_type,
+            "pid": component.process.pid if component.alive() else None,
+            "uptime": round(wall - component.started, 1) if component.alive() else None,
+            "restarts": component.restarts,
+            "last_exit": component.last_exit,
+            "heartbeat_age": round(component.heartbeat_age(wall), 1) if component.alive() else None,
+            "cpus": sorted(component.cpus) if component.cpus else None,
+        } for component in self.components]
+
+    def run(self, poll_interval=0.5, status_interval=60.0):
+        """Supervise until SIGINT/SIGTERM"""
+        self.running = True
+
+        def request_stop(signum, frame):
+            self.running = False
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+
+        logger.info("=" * 70)
+        logger.info("🏠 Supervising %d components, one process each", len(self.components))
+        logger.info("=" * 70)
+        next_status = time.monotonic() + status_interval
+        try:
+            while self.running:
+                for component in self.components:
+                    self.check(component)
+                if time.monotonic() >= next_status:
+                    next_status += status_interval
+                    for row in self.status():
+                        logger.info("📊 %s", row)
+                time.sleep(poll_interval)
+        finally:
+            logger.info("Stopping %d components...", len(self.components))
+            self.terminate(self.components)
+            for component in self.components:
+                try:
+                    os.unlink(component.heartbeat_path)
+                except OSError:
+                    pass
+            try:
+                os.rmdir(self.heartbeat_dir)
+            except OSError:
+                pass
+            logger.info("✓ Supervisor stopped")
+
+
+def run_supervisor():
+    """
+    Entry point (also used by main.py with RUN_MODE=processes)
+
+    Environment: SUPERVISOR_COMPONENTS, SUPERVISOR_LIVENESS_TIMEOUT (30 s, 0
+    disables heartbeats), SUPERVISOR_BACKOFF (1 s), SUPERVISOR_MAX_BACKOFF
+    (60 s), SUPERVISOR_STABLE_SECONDS (60), SUPERVISOR_STOP_TIMEOUT (10 s)
+    """
+    supervisor = Supervisor(
+        parse_components(os.getenv("SUPERVISOR_COMPONENTS", DEFAULT_COMPONENTS)),
+        liveness_timeout=float(os.getenv("SUPERVISOR_LIVENESS_TIMEOUT", "30")),
+        first_backoff=float(os.getenv("SUPERVISOR_BACKOFF", "1")),
+        max_backoff=float(os.getenv("SUPERVISOR_MAX_BACKOFF", "60")),
+        stable_seconds=float(os.getenv("SUPERVISOR_STABLE_SECONDS", "60")),
+        stop_timeout=float(os.getenv("SUPERVISOR_STOP_TIMEOUT", "10")),
+    )
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    if "BROKER" not in os.environ:
+        os.environ["BROKER"] = "localhost"
+    run_supervisor()
@@ -0,0 +1,84 @@
+"""
+Regression tests for the offline queue's spill-to-disk backlog
+Run with: python -m pytest -q tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'devices'))
+
+from offline_queue import OfflineQueue
+
+COMMAND_TOPIC = "home/light/command"    # KEEP_ALL: every message is kept, in order
+
+
+def drain(queue):
+    payloads = []
+    while True:
+        item = queue._pop()
+        if item is None:
+            return payloads
+        payloads.append(item[1])
+
+
+def test_spill_count_survives_end_of_previous_spill_file(tmp_path):
+    queue = OfflineQueue(max_messages=2, spill_path=str(tmp_path / "client.spill"))
+    for n in (1, 2, 3, 4):                       # 1, 2 in memory, 3, 4 spilled to the first file
+        queue.put(COMMAND_TOPIC, f"c{n}")
+    assert [queue._pop()[1] for _ in range(3)] == [b"c1", b"c2", b"c3"]
+    
+    for n in (5, 6, 7):                          # 5, 6 in memory, 7 spilled to a second file
+        queue.put(COMMAND_TOPIC, f"c{n}")
+    assert queue._pop()[1] == b"c4"              # the first spill file is exhausted after this
+    assert queue._pop()[1] == b"c5"
+    
+    assert len(queue) == 2
+    assert queue.pending()
+    assert drain(queue) == [b"c6", b"c7"]
+    assert len(queue) == 0
+
+
+def test_spilled_messages_are_recovered_after_restart(tmp_path):
+    spill_path = str(tmp_path / "client.spill")
+    queue = OfflineQueue(max_messages=1, spill_path=spill_path)
+    for n in (1, 2, 3):
+        queue.put(COMMAND_TOPIC, f"c{n}")
+    queue._spill_writer.close()                  # process exits, memory is lost
+    
+    restarted = OfflineQueue(max_messages=1, spill_path=spill_path)
+    assert len(restarted) == 2
+    restarted.put(COMMAND_TOPIC, "c4")           # queued behind the recovered backlog
+    assert drain(restarted) == [b"c2", b"c3", b"c4"]
+
+
+def test_spill_file_with_partial_last_record_is_recovered(tmp_path):
+    spill_path = str(tmp_path / "client.spill")
+    queue = OfflineQueue(max_messages=1, spill_path=spill_path)
+    for n in (1, 2, 3):
+        queue.put(COMMAND_TOPIC, f"c{n}")
+    queue._spill_writer.close()
+    with open(spill_path, "r+b") as f:               # killed while writing c3
+        f.truncate(os.path.getsize(spill_path) - 1)
+    
+    restarted = OfflineQueue(max_messages=1, spill_path=spill_path)
+    assert len(restarted) == 1
+    restarted.put(COMMAND_TOPIC, "c4")               # appended behind c2, not behind the partial c3
+    assert drain(restarted) == [b"c2", b"c4"]
+    assert len(restarted) == 0
+
+
+def test_corrupt_spill_file_does_not_stop_draining(tmp_path):
+    spill_path = str(tmp_path / "client.spill")
+    queue = OfflineQueue(max_messages=1, spill_path=spill_path)
+    for n in (1, 2, 3):
+        queue.put(COMMAND_TOPIC, f"c{n}")
+    queue._spill_writer.close()
+    with open(spill_path, "ab") as f:
+        f.write(b"\x10garbage")                       # not a record kind
+    os.replace(spill_path, spill_path + ".draining")
+    
+    restarted = OfflineQueue(max_messages=1, spill_path=spill_path)
+    restarted.put(COMMAND_TOPIC, "c4")
+    assert drain(restarted) == [b"c2", b"c3", b"c4"]
+    assert len(restarted) == 0
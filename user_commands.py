@@ -2,19 +2,90 @@
 User Commands Interface
 Interactive CLI for sending manual commands to IoT devices
 Allows users to control devices in real-time via MQTT
+Batch mode (--batch FILE|-) pushes scripted commands to many devices at once
 """
 
 import sys
 import json
 import time
+import fnmatch
+import argparse
+import threading
 import logging
 import os
-from utils import create_mqtt_client, connect_with_retry
+
+# Add devices directory to path for utils import
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'devices'))
+
+from utils import create_mqtt_client, connect_with_retry, add_subscription, add_subscriptions, publish
+from shadow import query_shadow, device_for, desired_fields
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("UserInterface")
 
 
+def build_light_payload(command):
+    """Light command text -> JSON payload, raises ValueError with usage on bad input"""
+    if command in ["on", "off"]:
+        return json.dumps({"command": command.upper()})
+    if command.startswith("brightness"):
+        try:
+            level = int(command.split()[1])
+        except (IndexError, ValueError):
+            raise ValueError("Usage: brightness <0-100>")
+        return json.dumps({"command": "BRIGHTNESS", "level": level})
+    raise ValueError(f"Unknown light command: {command}")
+
+
+def build_thermostat_payload(command):
+    """Thermostat command text -> JSON payload, raises ValueError with usage on bad input"""
+    if command.startswith("temp"):
+        try:
+            temp = float(command.split()[1])
+        except (IndexError, ValueError):
+            raise ValueError("Usage: temp <temperature>")
+        return json.dumps({"command": "SET_TARGET", "target": temp})
+    if command.startswith("mode"):
+        try:
+            mode = command.split()[1].upper()
+        except IndexError:
+            raise ValueError("Usage: mode <AUTO|HEAT|COOL|OFF>")
+        return json.dumps({"command": "SET_MODE", "mode": mode})
+    raise ValueError(f"Unknown thermostat command: {command}")
+
+
+def build_camera_payload(command):
+    """Camera command text -> JSON payload, raises ValueError with usage on bad input"""
+    if command in ["on", "activate"]:
+        return json.dumps({"command": "ACTIVATE"})
+    if command in ["off", "deactivate"]:
+        return json.dumps({"command": "DEACTIVATE"})
+    if command.startswith("sensitivity"):
+        try:
+            level = float(command.split()[1])
+        except (IndexError, ValueError):
+            raise ValueError("Usage: sensitivity <0.0-1.0>")
+        return json.dumps({"command": "SET_SENSITIVITY", "sensitivity": level})
+    raise ValueError(f"Unknown camera command: {command}")
+
+
+# Short names accepted in batch files -> device id (topic is home/<device id>/command)
+DEVICE_ALIASES = {
+    "light": "light",
+    "thermostat": "thermostat",
+    "camera": "security/camera",
+    "lamp": "actuator/lamp",
+}
+
+# Device kind (last segment of the device id) -> payload builder
+PAYLOAD_BUILDERS = {
+    "light": build_light_payload,
+    "lamp": build_light_payload,
+    "thermostat": build_thermostat_payload,
+    "camera": build_camera_payload,
+}
+
+
 class UserCommandInterface:
     """Interactive command interface for controlling smart home devices"""
     
@@ -23,12 +94,20 @@ class UserCommandInterface:
         self.port = port
         self.client = None
         self.running = False
-        
-    def connect(self):
-        """Connect to MQTT broker"""
+    
+    def connect(self, interactive=True):
+        """Connect to MQTT broker (batch mode skips the status printout)"""
         logger.info("Connecting to MQTT broker...")
         self.client = create_mqtt_client("user_interface", self.broker, self.port)
         
+        if not interactive:
+            if connect_with_retry(self.client, self.broker, self.port):
+                self.client.loop_start()
+                self.client.ready.wait(10)
+                return True
+            logger.error("Failed to connect to broker")
+            return False
+        
         # Subscribe to status topics for feedback
         def on_message(client, userdata, msg):
             try:
@@ -44,9 +123,9 @@ class UserCommandInterface:
         
         if connect_with_retry(self.client, self.broker, self.port):
             # Subscribe to status topics
-            self.client.subscribe("home/light/status")
-            self.client.subscribe("home/thermostat/status")
-            self.client.subscribe("home/security/camera/status")
+            add_subscription(self.client, "home/light/status")
+            add_subscription(self.client, "home/thermostat/status")
+            add_subscription(self.client, "home/security/camera/status")
             self.client.loop_start()
             logger.info("✓ Connected successfully!")
             return True
@@ -56,69 +135,24 @@ class UserCommandInterface:
     
     def send_light_command(self, command):
         """Send command to smart light"""
-        topic = "home/light/command"
-        
-        if command in ["on", "off"]:
-            payload = json.dumps({"command": command.upper()})
-        elif command.startswith("brightness"):
-            try:
-                level = int(command.split()[1])
-                payload = json.dumps({"command": "BRIGHTNESS", "level": level})
-            except:
-                logger.error("Usage: brightness <0-100>")
-                return
-        else:
-            logger.error(f"Unknown light command: {command}")
-            return
-        
-        self.client.publish(topic, payload, qos=1)
-        logger.info(f"✓ Sent: {payload} to {topic}")
+        self._send("home/light/command", build_light_payload, command)
     
     def send_thermostat_command(self, command):
         """Send command to thermostat"""
-        topic = "home/thermostat/command"
-        
-        if command.startswith("temp"):
-            try:
-                temp = float(command.split()[1])
-                payload = json.dumps({"command": "SET_TARGET", "target": temp})
-            except:
-                logger.error("Usage: temp <temperature>")
-                return
-        elif command.startswith("mode"):
-            try:
-                mode = command.split()[1].upper()
-                payload = json.dumps({"command": "SET_MODE", "mode": mode})
-            except:
-                logger.error("Usage: mode <AUTO|HEAT|COOL|OFF>")
-                return
-        else:
-            logger.error(f"Unknown thermostat command: {command}")
-            return
-        
-        self.client.publish(topic, payload, qos=1)
-        logger.info(f"✓ Sent: {payload} to {topic}")
+        self._send("home/thermostat/command", build_thermostat_payload, command)
     
     def send_camera_command(self, command):
         """Send command to security camera"""
-        topic = "home/security/camera/command"
-        
-        if command in ["on", "activate"]:
-            payload = json.dumps({"command": "ACTIVATE"})
-        elif command in ["off", "deactivate"]:
-            payload = json.dumps({"command": "DEACTIVATE"})
-        elif command.startswith("sensitivity"):
-            try:
-                level = float(command.split()[1])
-                payload = json.dumps({"command": "SET_SENSITIVITY", "sensitivity": level})
-            except:
-                logger.error("Usage: sensitivity <0.0-1.0>")
-                return
-        else:
-            logger.error(f"Unknown camera command: {command}")
+        self._send("home/security/camera/command", build_camera_payload, command)
+    
+    def _send(self, topic, build_payload, command):
+        try:
+            payload = build_payload(command)
+        except ValueError as e:
+            logger.error(str(e))
             return
         
-        self.client.publish(topic, payload, qos=1)
+        publish(self.client, topic, payload)
         logger.info(f"✓ Sent: {payload} to {topic}")
     
     def show_help(self):
@@ -144,10 +178,21 @@ class UserCommandInterface:
         print("=" * 70 + "\n")
     
     def request_status(self):
-        """Request status from all devices"""
-        self.client.publish("home/light/command", json.dumps({"command": "STATUS"}), qos=1)
-        self.client.publish("home/thermostat/command", json.dumps({"command": "STATUS"}), qos=1)
-        self.client.publish("home/security/camera/command", json.dumps({"command": "STATUS"}), qos=1)
+        """Show the status of all devices from the shadow service, asking the devices only as a fallback"""
+        shadows = query_shadow(self.client)
+        if shadows is not None:
+            logger.info(f"📊 {len(shadows)} device(s) in the shadow:")
+            for device, shadow in sorted(shadows.items()):
+                reported = {key: value for key, value in shadow["reported"].items() if key != "timestamp"}
+                logger.info(f"   {device}: {reported}")
+                if shadow["delta"]:
+                    logger.info(f"      pending: {shadow['delta']}")
+            return
+        
+        logger.info("Shadow service not available, asking devices directly")
+        publish(self.client, "home/light/command", json.dumps({"command": "STATUS"}))
+        publish(self.client, "home/thermostat/command", json.dumps({"command": "STATUS"}))
+        publish(self.client, "home/security/camera/command", json.dumps({"command": "STATUS"}))
         logger.info("✓ Status requested from all devices")
         time.sleep(1)  # Wait for responses
     
@@ -199,10 +244,10 @@ class UserCommandInterface:
                     if user_input:
                         if not self.process_command(user_input):
                             break
-                    
+                
                 except EOFError:
                     break
-                
+        
         except KeyboardInterrupt:
             print("\n\nReceived interrupt signal...")
         finally:
@@ -213,6 +258,200 @@ class UserCommandInterface:
             logger.info("User interface stopped.")
 
 
+class BatchRunner:
+    """
+    Non-interactive command runner
+    
+    Each line of a batch is "<device or pattern> <command>", for example:
+        
+        thermostat mode cool
+        rooms/room_00*/thermostat temp 21.5
+        camera sensitivity 0.7
+    
+    Patterns are matched against the device ids known to the shadow service.
+    All commands are published back to back (QoS 1, PUBACKs awaited once at the
+    end); with wait_ack the runner also waits until each device reports a status
+    that reflects its commands.
+    """
+    
+    def __init__(self, client, wait_ack=False, ack_timeout=5.0, publish_timeout=10.0):
+        self.client = client
+        self.wait_ack = wait_ack
+        self.ack_timeout = ack_timeout
+        self.publish_timeout = publish_timeout
+        self._known_devices = None
+        
+        self.expected = {}          # device -> fields its status must report
+        self.acked = set()
+        self._ack_lock = threading.Lock()
+        self._all_acked = threading.Event()
+    
+    def known_devices(self):
+        if self._known_devices is None:
+            shadows = query_shadow(self.client)
+            self._known_devices = sorted(shadows) if shadows is not None else []
+        return self._known_devices
+    
+    def resolve(self, target):
+        """Device ids addressed by a name, alias or glob pattern"""
+        target = DEVICE_ALIASES.get(target, target)
+        if not any(char in target for char in "*?["):
+            return [target]
+        if not self.known_devices():
+            raise ValueError(f"Cannot expand pattern {target}: no devices known (is the shadow service running?)")
+        return [device for device in fnmatch.filter(self.known_devices(), target)
+                if device.rsplit("/", 1)[-1] in PAYLOAD_BUILDERS]
+    
+    def parse(self, lines):
+        """
+        Parse a batch into (device, payload) pairs
+        
+        Returns:
+            (commands, errors) where errors are (line number, message)
+        """
+        commands = []
+        errors = []
+        for number, line in enumerate(lines, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(maxsplit=1)
+            if len(parts) < 2:
+                errors.append((number, f"Missing command: {line}"))
+                continue
+            target, command = parts[0], parts[1].lower()
+            try:
+                devices = self.resolve(target)
+                if not devices:
+                    raise ValueError(f"No device matches {target}")
+                for device in devices:
+                    build_payload = PAYLOAD_BUILDERS.get(device.rsplit("/", 1)[-1])
+                    if build_payload is None:
+                        raise ValueError(f"Unknown device type: {device}")
+                    commands.append((device, build_payload(command)))
+            except ValueError as e:
+                errors.append((number, str(e)))
+        return commands, errors
+    
+    def on_status(self, client, userdata, msg):
+        """Count a device as acknowledged once its status shows every commanded field"""
+        if msg.retain:
+            return   # state from before our commands
+        device = device_for(msg.topic)
+        try:
+            reported = json.loads(msg.payload)
+        except ValueError:
+            return
+        with self._ack_lock:
+            fields = self.expected.get(device)
+            if fields is None or device in self.acked:
+                return
+            if all(str(reported.get(key)).upper() == str(value).upper() for key, value in fields.items()):
+                self.acked.add(device)
+                if len(self.acked) == len(self.expected):
+                    self._all_acked.set()
+    
+    def run(self, lines):
+        """
+        Publish every command in the batch
+        
+        Returns:
+            Summary dictionary (counts, throughput, failed devices, parse errors)
+        """
+        commands, errors = self.parse(lines)
+        for number, message in errors:
+            logger.error(f"Line {number}: {message}")
+        
+        if self.wait_ack:
+            for device, payload in commands:
+                self.expected.setdefault(device, {}).update(desired_fields(payload.encode()) or {})
+            status_topics = [f"home/{device}/status" for device in self.expected]
+            for topic in status_topics:
+                self.client.message_callback_add(topic, self.on_status)
+            add_subscriptions(self.client, status_topics)
+            self.client.ready.wait(self.ack_timeout)
+        
+        # Pipeline: no waiting between publishes, PUBACKs are collected afterwards
+        started = time.perf_counter()
+        pending = []
+        failed = {}
+        queued = 0
+        for device, payload in commands:
+            info = publish(self.client, f"home/{device}/command", payload)
+            if getattr(info, "queued", False):
+                queued += 1
+            elif info.rc != 0:
+                failed[device] = f"publish error {info.rc}"
+            else:
+                pending.append((device, info))
+        published = time.perf_counter()
+        
+        deadline = time.monotonic() + self.publish_timeout
+        for device, info in pending:
+            try:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+                if not info.is_published():
+                    failed[device] = "no PUBACK"
+            except (RuntimeError, ValueError) as e:
+                failed[device] = str(e)
+        delivered = time.perf_counter()
+        
+        if self.wait_ack and self.expected:
+            self._all_acked.wait(self.ack_timeout)
+            with self._ack_lock:
+                for device in self.expected:
+                    if device not in self.acked and device not in failed:
+                        failed[device] = "no acknowledgement"
+        
+        elapsed = delivered - started
+        return {
+            "commands": len(commands),
+            "devices": len({device for device, _ in commands}),
+            "parse_errors": len(errors),
+            "queued_offline": queued,
+            "publish_seconds": round(published - started, 4),
+            "delivered_seconds": round(elapsed, 4),
+            "commands_per_second": round(len(commands) / elapsed, 1) if elapsed > 0 else None,
+            "acknowledged": len(self.acked) if self.wait_ack else None,
+            "failed": failed,
+        }
+
+
+def run_batch(lines, wait_ack=False, ack_timeout=5.0):
+    """Connect, run a batch and log its summary; returns True if nothing failed"""
+    broker = os.getenv("BROKER", "mosquitto")
+    port = int(os.getenv("PORT", "1883"))
+    
+    interface = UserCommandInterface(broker, port)
+    if not interface.connect(interactive=False):
+        return False
+    # Keep many QoS 1 commands in flight instead of paho's default of 20
+    interface.client.max_inflight_messages_set(int(os.getenv("BATCH_INFLIGHT", "200")))
+    
+    try:
+        summary = BatchRunner(interface.client, wait_ack=wait_ack, ack_timeout=ack_timeout).run(lines)
+    finally:
+        interface.client.loop_stop()
+        interface.client.disconnect()
+    
+    logger.info("=" * 60)
+    logger.info(f"📊 {summary['commands']} command(s) to {summary['devices']} device(s) "
+                f"in {summary['delivered_seconds']}s ({summary['commands_per_second']} cmd/s)")
+    if summary["queued_offline"]:
+        logger.warning(f"{summary['queued_offline']} command(s) were queued while offline")
+    if wait_ack:
+        logger.info(f"✓ {summary['acknowledged']} device(s) acknowledged")
+    if summary["parse_errors"]:
+        logger.error(f"✗ {summary['parse_errors']} line(s) could not be parsed")
+    failed = sorted(summary["failed"].items())
+    for device, reason in failed[:20]:
+        logger.error(f"✗ {device}: {reason}")
+    if len(failed) > 20:
+        logger.error(f"✗ ... and {len(failed) - 20} more failed device(s)")
+    logger.info("=" * 60)
+    return not summary["failed"] and not summary["parse_errors"]
+
+
 def run_user_commands():
     """Main function for user command interface"""
     # Get configuration from environment variables
@@ -225,7 +464,16 @@ def run_user_commands():
 
 
 if __name__ == "__main__":
-    # Add devices directory to path for utils import
-    sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'devices'))
+    parser = argparse.ArgumentParser(description="Smart home command interface")
+    parser.add_argument("--batch", metavar="FILE", help="run commands from FILE ('-' for stdin) and exit")
+    parser.add_argument("--ack", action="store_true", help="wait for each device to report the new state")
+    parser.add_argument("--ack-timeout", type=float, default=5.0, help="seconds to wait for acknowledgements")
+    args = parser.parse_args()
+    
+    if args.batch:
+        source = sys.stdin if args.batch == "-" else open(args.batch)
+        with source:
+            lines = source.readlines()
+        sys.exit(0 if run_batch(lines, args.ack, args.ack_timeout) else 1)
     
     run_user_commands()
@@ -8,12 +8,27 @@ Connects to MQTT broker and exposes REST API
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 import paho.mqtt.client as mqtt
+import hmac
 import json
+import logging
+import os
+import sys
 import threading
 import time
 from collections import deque
 from datetime import datetime
 
+# Shared device helpers (topic policy, publish)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'devices'))
+from utils import publish
+from profiling import attach_client, get_profiler, install_signal_handlers
+from dispatch import dispatch_messages, dispatcher_from_env
+from state_journal import StateJournal, EPOCH
+from tenants import TENANT_PREFIX, HomeIndex, parse_home_topic
+from shm_state import StatsTable
+
+logger = logging.getLogger("MqttProxy")
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
@@ -22,112 +37,131 @@ MQTT_BROKER = "localhost"  # Use "mosquitto" if running in Docker
 MQTT_PORT = 1883
 MQTT_CLIENT_ID = "web_dashboard_proxy"
 
-# Store latest sensor readings
-sensor_data = {
+# Latest sensor readings, versioned so pollers can fetch only what changed
+sensor_data = StateJournal({
     "temperature": None,
     "motion": None,
     "light_status": None,
     "thermostat_status": None,
     "camera_status": None,
     "timestamp": None
-}
+}, size=int(os.getenv("STATE_JOURNAL_SIZE", "1000")))
 
 # Store event log (last 100 events)
 event_log = deque(maxlen=100)
 
+# Profiling over HTTP (devices/profiling.py) is opt-in: the API is unauthenticated and CORS-enabled.
+# With PROFILE_TOKEN set, requests must also carry it in the X-Profile-Token header.
+PROFILE_HTTP = os.getenv("PROFILE_HTTP", "false").lower() in ("1", "true", "yes")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+
+# Rolling per-room statistics from the rollup service (devices/rollup.py), room -> latest summary
+STATS_PREFIX = "home/stats/rooms/"
+room_stats = StatsTable()
+
+# Multi-home mode: also follow homes/<home_id>/... and keep one small state per home
+MULTI_HOME = os.getenv("PROXY_MULTI_HOME", "false").lower() in ("1", "true", "yes")
+homes = HomeIndex(journal_size=int(os.getenv("HOME_JOURNAL_SIZE", "16")),
+                  events_size=int(os.getenv("HOME_EVENTS", "10")))
+
 # MQTT Client
 mqtt_client = None
 
+# Worker pool for on_message, keyed by topic (by home in multi-home mode)
+dispatcher = None
+
+# Set once the broker acknowledged our subscriptions (SUBACK)
+mqtt_ready = threading.Event()
+subscribe_mid = None
+
+# Profiling admin topics, answered by this process (see devices/profiling.py)
+admin_topics = []
+
+# Topics the dashboard follows
+PROXY_TOPICS = [
+    "home/sensor/temperature",
+    "home/sensor/motion",
+    "home/security/motion",
+    "home/security/camera/status",
+    "home/light/status",
+    "home/actuator/lamp/status",
+    "home/thermostat/status",
+    "home/hvac/command",
+    STATS_PREFIX + "+",
+]
+
 def on_connect(client, userdata, flags, rc):
+    global subscribe_mid
     print(f"✅ Connected to MQTT broker with result code {rc}")
-    # Subscribe to all smart home topics
-    client.subscribe("home/sensor/temperature")
-    client.subscribe("home/sensor/motion")
-    client.subscribe("home/security/motion")
-    client.subscribe("home/security/camera/status")
-    client.subscribe("home/light/status")
-    client.subscribe("home/actuator/lamp/status")
-    client.subscribe("home/thermostat/status")
-    client.subscribe("home/hvac/command")
-    print("✅ Subscribed to all topics")
+    # Subscribe to all smart home topics in one SUBSCRIBE packet
+    topics = PROXY_TOPICS + ([TENANT_PREFIX + "#"] if MULTI_HOME else []) + admin_topics
+    result, subscribe_mid = client.subscribe([(topic, 0) for topic in topics])
 
-def on_message(client, userdata, msg):
-    topic = msg.topic
-    payload = msg.payload.decode()
-    
-    try:
-        # Try to parse as JSON
-        data = json.loads(payload)
-    except:
-        data = {"raw": payload}
-    
-    timestamp = datetime.now().isoformat()
+def on_subscribe(client, userdata, mid, granted_qos):
+    if mid == subscribe_mid:
+        mqtt_ready.set()
+        print("✅ Subscribed to all topics")
+
+def log_event(events, source, role, event_type, value):
+    """Append an event as a compact tuple; event_dict turns it into the API shape"""
+    events.append((datetime.now().strftime("%H:%M:%S"), source, role, event_type, value))
+
+def event_dict(event):
+    time_, source, role, event_type, value = event
+    return {"time": time_, "source": source, "role": role, "type": event_type, "value": value}
+
+def handle_reading(state, events, topic, data, timestamp, verbose=True):
+    """
+    Apply one message to a home's state and event log, as one state version
+    `topic` is in single-home form (home/sensor/temperature, ...)
+    """
+    changes = {}
     
     # Store data based on topic
     if topic == "home/sensor/temperature":
-        sensor_data["temperature"] = {
+        changes["temperature"] = {
             "value": data.get("value"),
             "unit": data.get("unit", "°C"),
             "timestamp": timestamp
         }
-        event_log.append({
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "source": "Temperature Sensor",
-            "role": "Publisher",
-            "type": "Reading",
-            "value": f"{data.get('value', 0):.1f}°C"
-        })
-        print(f"🌡️  Temperature: {data.get('value')}°C")
+        log_event(events, "Temperature Sensor", "Publisher", "Reading", f"{data.get('value', 0):.1f}°C")
+        if verbose:
+            logger.info("🌡️  Temperature: %s°C", data.get('value'))
     
     elif topic == "home/sensor/motion":
         # Motion sensor from devices/motion_sensor.py
         motion_value = data.get("value", 0)
-        motion_status = data.get("status", "unknown")
         
         # Always update motion status (detected or not detected)
-        sensor_data["motion"] = {
+        changes["motion"] = {
             "detected": motion_value == 1,
             "camera_id": "motion_sensor",
             "timestamp": timestamp
         }
         
         if motion_value == 1:
-            event_log.append({
-                "time": datetime.now().strftime("%H:%M:%S"),
-                "source": "Motion Sensor",
-                "role": "Publisher",
-                "type": "Motion Detected",
-                "value": "🚨 Motion Alert"
-            })
-            print(f"🚨 Motion detected (value=1)")
+            log_event(events, "Motion Sensor", "Publisher", "Motion Detected", "🚨 Motion Alert")
+            if verbose:
+                logger.info("🚨 Motion detected (value=1)")
         else:
-            event_log.append({
-                "time": datetime.now().strftime("%H:%M:%S"),
-                "source": "Motion Sensor",
-                "role": "Publisher",
-                "type": "No Motion",
-                "value": "✓ Clear"
-            })
-            print(f"✓ No motion detected (value=0)")
+            log_event(events, "Motion Sensor", "Publisher", "No Motion", "✓ Clear")
+            if verbose:
+                logger.info("✓ No motion detected (value=0)")
     
     elif topic == "home/security/motion":
         # Security camera motion
-        sensor_data["motion"] = {
+        changes["motion"] = {
             "detected": True,
             "camera_id": data.get("camera_id"),
             "timestamp": timestamp
         }
-        event_log.append({
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "source": f"Camera {data.get('camera_id', 'Unknown')}",
-            "role": "Publisher",
-            "type": "Motion Detected",
-            "value": "⚠️ Motion Alert"
-        })
-        print(f"🚨 Motion detected from {data.get('camera_id')}")
+        log_event(events, f"Camera {data.get('camera_id', 'Unknown')}", "Publisher", "Motion Detected",
+                  "⚠️ Motion Alert")
+        if verbose:
+            logger.info("🚨 Motion detected from %s", data.get('camera_id'))
     
     elif topic == "home/security/camera/status":
-        sensor_data["camera_status"] = {
+        changes["camera_status"] = {
             "active": data.get("active"),
             "recording": data.get("recording"),
             "camera_id": data.get("camera_id"),
@@ -136,66 +170,94 @@ def on_message(client, userdata, msg):
         
         status_text = "Active" if data.get("active") else "Inactive"
         recording_text = " | Recording" if data.get("recording") else ""
-        
-        event_log.append({
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "source": f"Camera {data.get('camera_id', 'Unknown')}",
-            "role": "Publisher",
-            "type": "Status Change",
-            "value": f"{status_text}{recording_text}"
-        })
-        print(f"📷 Camera status: {data.get('active')}")
+        log_event(events, f"Camera {data.get('camera_id', 'Unknown')}", "Publisher", "Status Change",
+                  f"{status_text}{recording_text}")
+        if verbose:
+            logger.info("📷 Camera status: %s", data.get('active'))
     
     elif topic == "home/light/status" or topic == "home/actuator/lamp/status":
-        state = data.get("state", "UNKNOWN")
+        light_state = data.get("state", "UNKNOWN")
         brightness = data.get("brightness", 0)
         
-        sensor_data["light_status"] = {
-            "state": state,
+        changes["light_status"] = {
+            "state": light_state,
             "brightness": brightness,
             "light_id": data.get("light_id", "smart_lamp"),
             "timestamp": timestamp
         }
-        
-        # Add to event log
-        event_log.append({
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "source": "Smart Lamp",
-            "role": "Subscriber",
-            "type": "Status Change",
-            "value": f"💡 {state} ({brightness}%)"
-        })
-        print(f"💡 Light: {state} - {brightness}%")
+        log_event(events, "Smart Lamp", "Subscriber", "Status Change", f"💡 {light_state} ({brightness}%)")
+        if verbose:
+            logger.info("💡 Light: %s - %s%%", light_state, brightness)
     
     elif topic == "home/thermostat/status":
-        sensor_data["thermostat_status"] = {
+        changes["thermostat_status"] = {
             "current_temp": data.get("current_temp"),
             "target_temp": data.get("target_temp"),
             "mode": data.get("mode"),
             "hvac_state": data.get("hvac_state"),
             "timestamp": timestamp
         }
-        event_log.append({
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "source": "Thermostat",
-            "role": "Subscriber",
-            "type": "Status Update",
-            "value": f"Mode: {data.get('mode')} | HVAC: {data.get('hvac_state')}"
-        })
-        print(f"🌡️  Thermostat: {data.get('mode')} - {data.get('hvac_state')}")
+        log_event(events, "Thermostat", "Subscriber", "Status Update",
+                  f"Mode: {data.get('mode')} | HVAC: {data.get('hvac_state')}")
+        if verbose:
+            logger.info("🌡️  Thermostat: %s - %s", data.get('mode'), data.get('hvac_state'))
+    
+    elif topic.startswith("home/rooms/"):
+        # home/rooms/<room>/<reading...>: one section per room, one key per reading
+        parts = topic.split("/", 3)
+        if len(parts) == 4 and parts[2]:
+            section = f"room:{parts[2]}"
+            room = dict(state.get(section) or {})
+            room[parts[3]] = data
+            changes[section] = room
     
-    sensor_data["timestamp"] = timestamp
+    changes["timestamp"] = timestamp
+    state.update(changes)
+
+def on_message(client, userdata, msg):
+    topic = msg.topic
+    payload = msg.payload.decode()
+    
+    try:
+        # Try to parse as JSON
+        data = json.loads(payload)
+    except:
+        data = {"raw": payload}
+    if not isinstance(data, dict):
+        data = {"value": data}
+    
+    timestamp = datetime.now().isoformat()
+    
+    if topic.startswith(STATS_PREFIX):
+        room_stats[topic[len(STATS_PREFIX):]] = data
+        return
+    
+    if topic.startswith(TENANT_PREFIX):
+        parsed = parse_home_topic(topic)
+        if parsed is not None:
+            home_id, home_topic = parsed
+            home = homes.home(home_id)
+            home.last_seen = timestamp
+            handle_reading(home.state, home.events, home_topic, data, timestamp, verbose=False)
+        return
+    
+    handle_reading(sensor_data, event_log, topic, data, timestamp)
 
 def on_disconnect(client, userdata, rc):
+    mqtt_ready.clear()
     if rc != 0:
         print(f"⚠️ Unexpected disconnection: {rc}")
 
 def connect_mqtt():
-    global mqtt_client
+    global mqtt_client, admin_topics, dispatcher
     mqtt_client = mqtt.Client(client_id=MQTT_CLIENT_ID)
+    admin_topics = attach_client(mqtt_client, MQTT_CLIENT_ID)
+    dispatcher = dispatcher_from_env("proxy")
     mqtt_client.on_connect = on_connect
-    mqtt_client.on_message = on_message
+    mqtt_client.on_subscribe = on_subscribe
+    mqtt_client.on_message = dispatch_messages(on_message, dispatcher)
     mqtt_client.on_disconnect = on_disconnect
+    mqtt_client.reconnect_delay_set(min_delay=0.1, max_delay=5)
     
     try:
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
@@ -209,15 +271,20 @@ def connect_mqtt():
 
 @app.route('/api/data', methods=['GET'])
 def get_data():
-    """Get current sensor readings"""
-    return jsonify({
-        "temperature": sensor_data.get("temperature"),
-        "motion": sensor_data.get("motion"),
-        "light_status": sensor_data.get("light_status"),
-        "thermostat_status": sensor_data.get("thermostat_status"),
-        "camera_status": sensor_data.get("camera_status"),
-        "timestamp": sensor_data.get("timestamp")
-    })
+    """
+    Get current sensor readings
+    With ?since=<version>&epoch=<epoch> only the changes after that version are returned:
+    {"epoch": E, "version": N, "ops": [{"op": "replace", "path": "/temperature/value", "value": 23.5}, ...]}
+    or {"epoch": E, "version": N, "full": {...}} when the change journal does not reach back that far
+    or the epoch is not this proxy start's
+    """
+    since = request.args.get("since", type=int)
+    if since is not None:
+        return jsonify(sensor_data.changes_since(since, request.args.get("epoch")))
+    state, version = sensor_data.snapshot()
+    state["version"] = version
+    state["epoch"] = EPOCH
+    return jsonify(state)
 
 @app.route('/api/temperature', methods=['GET'])
 def get_temperature():
@@ -243,12 +310,12 @@ def control_light():
         
         if command in ["ON", "OFF"]:
             payload = json.dumps({"command": command})
-            mqtt_client.publish("home/actuator/lamp/command", payload, qos=1)
+            publish(mqtt_client, "home/actuator/lamp/command", payload)
             return jsonify({"status": "success", "command": command}), 200
         elif command == "BRIGHTNESS":
             level = data.get("level", 100)
             payload = json.dumps({"command": "BRIGHTNESS", "level": level})
-            mqtt_client.publish("home/actuator/lamp/command", payload, qos=1)
+            publish(mqtt_client, "home/actuator/lamp/command", payload)
             return jsonify({"status": "success", "command": command, "level": level}), 200
         else:
             return jsonify({"status": "error", "message": "Invalid command"}), 400
@@ -268,7 +335,7 @@ def control_thermostat():
         command = data.get("command", "").upper()
         
         payload = json.dumps(data)
-        mqtt_client.publish("home/thermostat/command", payload, qos=1)
+        publish(mqtt_client, "home/thermostat/command", payload)
         return jsonify({"status": "success", "command": command}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -284,7 +351,7 @@ def control_camera():
     try:
         data = request.get_json()
         payload = json.dumps(data)
-        mqtt_client.publish("home/security/camera/command", payload, qos=1)
+        publish(mqtt_client, "home/security/camera/command", payload)
         return jsonify({"status": "success"}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -293,7 +360,85 @@ def control_camera():
 def get_events():
     """Get event log"""
     limit = request.args.get("limit", 50, type=int)
-    return jsonify(list(event_log)[-limit:])
+    return jsonify([event_dict(event) for event in list(event_log)[-limit:]])
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Rolling statistics of every room (1m / 15m / 1h windows, see devices/rollup.py)"""
+    return jsonify(dict(room_stats))
+
+@app.route('/api/stats/<room>', methods=['GET'])
+def get_room_stats(room):
+    """Rolling statistics of one room"""
+    stats = room_stats.get(room)
+    if stats is None:
+        return jsonify({"status": "error", "message": f"No statistics for room {room}"}), 404
+    return jsonify(stats)
+
+# Multi-home API: the single-home routes, namespaced per home
+
+def home_or_404(home_id):
+    home = homes.get(home_id)
+    if home is None:
+        return None, (jsonify({"status": "error", "message": f"Unknown home {home_id}"}), 404)
+    return home, None
+
+@app.route('/api/homes', methods=['GET'])
+def get_homes():
+    """List known homes - ?offset=0&limit=100"""
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", 100, type=int)
+    return jsonify({"count": len(homes), "offset": offset, "homes": homes.ids(offset, limit)})
+
+@app.route('/api/homes/<home_id>/data', methods=['GET'])
+def get_home_data(home_id):
+    """Current readings of one home; supports ?since=<version> like /api/data"""
+    home, error = home_or_404(home_id)
+    if error:
+        return error
+    since = request.args.get("since", type=int)
+    if since is not None:
+        return jsonify(home.state.changes_since(since, request.args.get("epoch")))
+    state, version = home.state.snapshot()
+    state["version"] = version
+    state["epoch"] = EPOCH
+    state["last_seen"] = home.last_seen
+    return jsonify(state)
+
+@app.route('/api/homes/<home_id>/events', methods=['GET'])
+def get_home_events(home_id):
+    """Recent events of one home"""
+    home, error = home_or_404(home_id)
+    if error:
+        return error
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify([event_dict(event) for event in list(home.events)[-limit:]])
+
+@app.route('/api/homes/<home_id>/light/control', methods=['POST'])
+def control_home_light(home_id):
+    """Control a home's lamp - same body as /api/light/control"""
+    try:
+        data = request.get_json()
+        command = data.get("command", "").upper()
+        if command not in ["ON", "OFF", "BRIGHTNESS"]:
+            return jsonify({"status": "error", "message": "Invalid command"}), 400
+        message = {"command": command}
+        if command == "BRIGHTNESS":
+            message["level"] = data.get("level", 100)
+        publish(mqtt_client, f"{TENANT_PREFIX}{home_id}/actuator/lamp/command", json.dumps(message))
+        return jsonify({"status": "success", **message}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/homes/<home_id>/thermostat/control', methods=['POST'])
+def control_home_thermostat(home_id):
+    """Control a home's thermostat - same body as /api/thermostat/control"""
+    try:
+        data = request.get_json()
+        publish(mqtt_client, f"{TENANT_PREFIX}{home_id}/thermostat/command", json.dumps(data))
+        return jsonify({"status": "success", "command": data.get("command", "").upper()}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
@@ -302,21 +447,126 @@ def get_status():
         "mqtt_connected": mqtt_client.is_connected() if mqtt_client else False,
         "broker": MQTT_BROKER,
         "port": MQTT_PORT,
-        "uptime": "running"
+        "uptime": "running",
+        "dispatch": dispatcher.stats() if dispatcher is not None else None
     })
 
+def profile_denied():
+    """Error response unless PROFILE_HTTP is on and the PROFILE_TOKEN (if any) matches, else None"""
+    if not PROFILE_HTTP:
+        return jsonify({"status": "error", "message": "Profiling over HTTP is disabled (PROFILE_HTTP=true)"}), 404
+    if PROFILE_TOKEN and not hmac.compare_digest(request.headers.get("X-Profile-Token", ""), PROFILE_TOKEN):
+        return jsonify({"status": "error", "message": "Invalid or missing X-Profile-Token"}), 403
+    return None
+
+@app.route('/api/admin/profile', methods=['GET'])
+def get_profile():
+    """Profiler status and the latest results of this process (report text included)"""
+    denied = profile_denied()
+    if denied:
+        return denied
+    profiler = get_profiler()
+    return jsonify({**profiler.status(), "latest": profiler.results[-1] if profiler.results else None})
+
+@app.route('/api/admin/profile', methods=['POST'])
+def start_profile():
+    """
+    Profile this process - POST {'action': 'cpu'|'cprofile'|'timing'|'memory'|'stop', 'seconds': 10}
+    With 'wait': true the response is sent when the session ends and contains the report
+    """
+    denied = profile_denied()
+    if denied:
+        return denied
+    try:
+        data = request.get_json() or {}
+        profiler = get_profiler()
+        reply = profiler.handle_command(data)
+        if data.get("wait") and reply.get("status") == "started":
+            reply = profiler.wait(timeout=reply["seconds"] + 30)
+        return jsonify(reply), 400 if reply.get("status") == "error" else 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check"""
     return jsonify({"status": "ok"}), 200
 
+def serve_workers(workers, host='0.0.0.0', port=5000):
+    """
+    Multi-worker deployment
+    This process is the only MQTT client: it ingests into a shared-memory segment
+    and forwards commands. `workers` forked processes accept HTTP on one shared
+    listening socket and read the segment lock-free.
+    """
+    global sensor_data, event_log, mqtt_client, publish
+    import multiprocessing
+    import socket
+    from werkzeug.serving import make_server
+    from shm_state import (SharedStateWriter, SharedStateReader, SharedEventLog, SharedStats, ForwardingClient,
+                           forward_publish, run_ingest_loop)
+    
+    ctx = multiprocessing.get_context("fork")
+    writer = SharedStateWriter(size=int(os.getenv("SHM_STATE_BYTES", str(4 << 20))))
+    commands = ctx.Queue()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    
+    def worker(index):
+        global sensor_data, event_log, room_stats, mqtt_client, publish
+        reader = SharedStateReader(writer.shm)
+        sensor_data = reader
+        event_log = SharedEventLog(reader)
+        room_stats = SharedStats(reader)
+        mqtt_client = ForwardingClient(reader, commands)
+        publish = forward_publish
+        server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+        print(f"👷 Worker {index} (pid {os.getpid()}) serving on {host}:{port}")
+        server.serve_forever()
+    
+    # Fork before the MQTT network thread exists
+    processes = [ctx.Process(target=worker, args=(i,), name=f"ProxyWorker-{i}", daemon=True) for i in range(workers)]
+    for process in processes:
+        process.start()
+    listener.close()
+    
+    try:
+        if not connect_mqtt():
+            print("❌ Failed to connect to MQTT")
+            return
+        print(f"✅ MQTT Connected! Ingesting into shared memory for {workers} workers")
+        run_ingest_loop(writer, sensor_data, event_log, mqtt_client, commands, publish,
+                        interval=float(os.getenv("SHM_PUBLISH_INTERVAL", "0.02")), stats=room_stats)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join(timeout=2)
+        if mqtt_client is not None:
+            mqtt_client.loop_stop()
+        writer.close()
+
 if __name__ == '__main__':
     print("🚀 Starting MQTT Proxy Server...")
     print(f"📡 Connecting to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}")
     
-    if connect_mqtt():
+    install_signal_handlers()
+    workers = int(os.getenv("PROXY_WORKERS", "1"))
+    if MULTI_HOME:
+        if workers > 1:
+            # Per-home state lives only in the ingest process; workers would serve empty /api/homes
+            print("❌ PROXY_MULTI_HOME needs PROXY_WORKERS=1, multi-home state is not shared with workers")
+            sys.exit(2)
+        print(f"🏘️  Multi-home mode: following {TENANT_PREFIX}<home_id>/...")
+    if workers > 1:
+        serve_workers(workers)
+    elif connect_mqtt():
         print("✅ MQTT Connected!")
-        time.sleep(2)  # Wait for initial connection
+        if not mqtt_ready.wait(timeout=10):  # Serve once subscriptions are acknowledged
+            print("⚠️ Subscriptions not acknowledged yet, serving anyway")
         app.run(host='0.0.0.0', port=5000, debug=False)
     else:
         print("❌ Failed to connect to MQTT")
@@ -11,6 +11,21 @@ let temperatureChart = null;
 let motionChart = null;
 let lastMotionTime = 0;
 
+// Local copy of the proxy state, its version (-1 = nothing loaded yet) and the
+// proxy start it came from (versions restart at 0 when the proxy restarts)
+let dashboardState = {};
+let stateVersion = -1;
+let stateEpoch = null;
+
+// State section -> widget renderer; only sections touched by a patch are redrawn
+const SECTION_RENDERERS = {
+    temperature: data => updateTemperature(data),
+    motion: data => updateMotion(data),
+    light_status: data => updateLightStatus(data),
+    thermostat_status: data => updateThermostat(data),
+    camera_status: data => updateCamera(data)
+};
+
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', () => {
     console.log('✅ DOM loaded - initializing dashboard...');
@@ -41,7 +56,10 @@ function startPolling() {
 }
 
 function pollOnce() {
-    fetch(`${API_URL}/api/data`)
+    const url = stateVersion < 0
+        ? `${API_URL}/api/data`
+        : `${API_URL}/api/data?since=${stateVersion}&epoch=${encodeURIComponent(stateEpoch)}`;
+    fetch(url)
         .then(response => {
             if (!response.ok) throw new Error(`HTTP ${response.status}`);
             return response.json();
@@ -49,15 +67,33 @@ function pollOnce() {
         .then(data => {
             updateConnectionStatus('Connected', 'connected');
             
-            // Update all displays
-            if (data.temperature) updateTemperature(data.temperature);
-            if (data.motion) updateMotion(data.motion);
-            if (data.light_status) updateLightStatus(data.light_status);
-            if (data.thermostat_status) updateThermostat(data.thermostat_status);
-            if (data.camera_status) updateCamera(data.camera_status);
+            if (data.ops && data.epoch !== stateEpoch) {
+                // Proxy restarted: our version means nothing there, fetch everything again
+                stateVersion = -1;
+                pollOnce();
+                return;
+            }
+            
+            let changed;
+            if (data.ops) {
+                changed = applyPatch(dashboardState, data.ops);
+            } else {
+                // Full state: first poll, proxy restart, or we fell behind the proxy's change journal
+                const { version, epoch, full, ...rest } = data;
+                dashboardState = full || rest;
+                changed = new Set(Object.keys(SECTION_RENDERERS));
+            }
+            stateVersion = data.version;
+            stateEpoch = data.epoch;
+            
+            // Redraw only the widgets whose data changed
+            changed.forEach(section => {
+                const render = SECTION_RENDERERS[section];
+                if (render && dashboardState[section]) render(dashboardState[section]);
+            });
             
             // Update chart
-            addChartData(data);
+            addChartData(dashboardState);
         })
         .catch(error => {
             console.error('❌ Poll failed:', error.message);
@@ -65,6 +101,29 @@ function pollOnce() {
         });
 }
 
+// ===== STATE PATCHES =====
+// Apply JSON-Patch-style ops ({op, path, value}) from /api/data?since=
+// Returns the set of top-level sections that changed
+function applyPatch(state, ops) {
+    const changed = new Set();
+    ops.forEach(({ op, path, value }) => {
+        const keys = path.split('/').slice(1).map(key => key.replace(/~1/g, '/').replace(/~0/g, '~'));
+        const last = keys.pop();
+        let target = state;
+        for (const key of keys) {
+            if (target[key] === null || typeof target[key] !== 'object') target[key] = {};
+            target = target[key];
+        }
+        if (op === 'remove') {
+            delete target[last];
+        } else {
+            target[last] = value;
+        }
+        changed.add(keys.length ? keys[0] : last);
+    });
+    return changed;
+}
+
 // ===== LOAD EVENTS FROM API =====
 function loadEvents() {
     fetch(`${API_URL}/api/events`)
@@ -0,0 +1,245 @@
+"""
+Shared-memory dashboard state for the multi-worker proxy
+One ingest process owns the MQTT connection and publishes the latest state,
+change journal and event log into a shared-memory segment; HTTP worker
+processes read it without locks.
+
+Segment layout:
+    [0:8]    sequence counter (seqlock: odd while the writer is updating)
+    [8:24]   state length, events length, journal length, flags (uint32 each)
+    [64:]    state JSON (sections, version, room statistics) | events JSON | journal JSON
+
+A reader copies the bytes it needs and retries if the sequence counter was odd
+or changed meanwhile, so readers never block the writer or each other. Each
+worker decodes a part only when the sequence moved, so a poll that finds
+nothing new costs one 8-byte read.
+"""
+
+import json
+import time
+import threading
+import struct
+from collections.abc import Mapping
+from multiprocessing import shared_memory
+from state_journal import patch_since
+
+HEADER = struct.Struct("<IIII")     # state, events and journal lengths, flags
+HEADER_OFFSET = 8
+DATA_OFFSET = 64
+FLAG_CONNECTED = 1
+
+
+class SharedStateWriter:
+    """
+    Ingest side: serializes the proxy state into the segment
+    
+    Journal entries never change once written, so each is encoded once and
+    cached; a publish re-encodes only the state sections and the event log.
+    """
+    
+    def __init__(self, size=4 << 20, name=None):
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        self.capacity = size - DATA_OFFSET
+        self._seq = self.shm.buf[:8].cast("Q")
+        self._seq[0] = 0
+        self._encoded = {}     # journal version -> encoded entry
+        self.publishes = 0
+    
+    def publish(self, state, version, journal, events, connected, stats=None):
+        state_bytes = json.dumps({"state": state, "version": version, "stats": stats or {}},
+                                 separators=(",", ":")).encode()
+        events_bytes = json.dumps(events, separators=(",", ":")).encode()
+        
+        encoded = {}
+        for entry_version, ops in journal:
+            entry = self._encoded.get(entry_version)
+            if entry is None:
+                entry = json.dumps([entry_version, ops], separators=(",", ":"))
+            encoded[entry_version] = entry
+        self._encoded = encoded
+        entries = list(encoded.values())
+        journal_bytes = ("[" + ",".join(entries) + "]").encode()
+        # Keep the newest entries if the segment is too small; older clients get a full resync
+        while len(state_bytes) + len(events_bytes) + len(journal_bytes) > self.capacity and entries:
+            entries = entries[len(entries) // 2 + 1:]
+            journal_bytes = ("[" + ",".join(entries) + "]").encode()
+        
+        total = len(state_bytes) + len(events_bytes) + len(journal_bytes)
+        if total > self.capacity:
+            raise ValueError(f"state needs {total} bytes, segment holds {self.capacity}")
+        
+        buf = self.shm.buf
+        self._seq[0] += 1        # odd: update in progress
+        HEADER.pack_into(buf, HEADER_OFFSET, len(state_bytes), len(events_bytes), len(journal_bytes),
+                         FLAG_CONNECTED if connected else 0)
+        start = DATA_OFFSET
+        for part in (state_bytes, events_bytes, journal_bytes):
+            buf[start:start + len(part)] = part
+            start += len(part)
+        self._seq[0] += 1        # even: consistent again
+        self.publishes += 1
+    
+    def close(self):
+        self._seq.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedStateReader:
+    """
+    Worker side: lock-free reads with per-worker decoded caches
+    
+    Exposes the same read interface the proxy routes use on StateJournal
+    (get, snapshot, changes_since) plus events() and connected().
+    """
+    
+    def __init__(self, shm):
+        self.shm = shm
+        self._seq = shm.buf[:8].cast("Q")
+        self._cache = None      # (seq, flags, parts, decoded parts), replaced as a whole
+        self.retries = 0
+    
+    def _snapshot(self):
+        """Consistent copy of the segment, cached per sequence number"""
+        cache = self._cache
+        if cache is not None and cache[0] == self._seq[0]:
+            return cache
+        buf = self.shm.buf
+        while True:
+            seq = self._seq[0]
+            if seq & 1:
+                self.retries += 1
+                time.sleep(0)
+                continue
+            state_len, events_len, journal_len, flags = HEADER.unpack_from(buf, HEADER_OFFSET)
+            end = DATA_OFFSET + state_len + events_len + journal_len
+            data = bytes(buf[DATA_OFFSET:end]) if end <= len(buf) else b""
+            if self._seq[0] == seq and len(data) == end - DATA_OFFSET:
+                break
+            self.retries += 1
+        parts = (data[:state_len], data[state_len:state_len + events_len], data[state_len + events_len:])
+        cache = self._cache = (seq, flags, parts, {})
+        return cache
+    
+    @staticmethod
+    def _decode(cache, index):
+        decoded = cache[3]
+        value = decoded.get(index)
+        if value is None:
+            value = decoded[index] = json.loads(cache[2][index] or b"null")
+        return value
+    
+    def _state(self, cache):
+        return self._decode(cache, 0) or {"state": {}, "version": 0}
+    
+    def get(self, section):
+        return self._state(self._snapshot())["state"].get(section)
+    
+    def snapshot(self):
+        state = self._state(self._snapshot())
+        return dict(state["state"]), state["version"]
+    
+    def changes_since(self, since, epoch=None):
+        cache = self._snapshot()
+        state = self._state(cache)
+        return patch_since(state["state"], state["version"], self._decode(cache, 2) or [], since, epoch)
+    
+    def events(self):
+        return self._decode(self._snapshot(), 1) or []
+    
+    def stats(self):
+        return self._state(self._snapshot()).get("stats") or {}
+    
+    def connected(self):
+        return bool(self._snapshot()[1] & FLAG_CONNECTED)
+
+
+class SharedEventLog:
+    """Read-only stand-in for the proxy's event_log deque in worker processes"""
+    
+    def __init__(self, reader):
+        self.reader = reader
+    
+    def __iter__(self):
+        return iter(self.reader.events())
+    
+    def __len__(self):
+        return len(self.reader.events())
+
+
+class StatsTable(dict):
+    """room -> latest rollup summary, counting updates so the ingest loop sees changes"""
+    
+    updates = 0
+    
+    def __setitem__(self, room, summary):
+        super().__setitem__(room, summary)
+        self.updates += 1
+
+
+class SharedStats(Mapping):
+    """Read-only stand-in for the proxy's room_stats in worker processes"""
+    
+    def __init__(self, reader):
+        self.reader = reader
+    
+    def __getitem__(self, room):
+        return self.reader.stats()[room]
+    
+    def __iter__(self):
+        return iter(self.reader.stats())
+    
+    def __len__(self):
+        return len(self.reader.stats())
+
+
+class ForwardingClient:
+    """
+    Stand-in for the MQTT client in worker processes: publishes are handed to
+    the ingest process, which owns the only broker connection
+    """
+    
+    def __init__(self, reader, commands):
+        self.reader = reader
+        self.commands = commands
+    
+    def is_connected(self):
+        return self.reader.connected()
+    
+    def forward(self, topic, payload):
+        self.commands.put((topic, payload))
+
+
+def forward_publish(client, topic, payload, qos=None, retain=None):
+    """utils.publish replacement for worker processes"""
+    client.forward(topic, payload)
+
+
+def run_ingest_loop(writer, journal, event_log, client, commands, publish, interval=0.02, stop=None,
+                    stats=None):
+    """
+    Ingest process loop: republish the segment when state, events or room
+    statistics (a StatsTable) changed (at most every `interval` seconds) and
+    send commands forwarded by workers
+    """
+    def drain_commands():
+        while True:
+            topic, payload = commands.get()
+            if topic is None:
+                return
+            publish(client, topic, payload)
+    
+    threading.Thread(target=drain_commands, name="CommandForwarder", daemon=True).start()
+    
+    last = None
+    while stop is None or not stop.is_set():
+        connected = client.is_connected()
+        marker = (journal.version, len(event_log), id(event_log[-1]) if event_log else None, connected,
+                  stats.updates if stats is not None else None)
+        if marker != last:
+            state, version, entries = journal.export()
+            writer.publish(state, version, entries, list(event_log), connected,
+                           dict(stats) if stats is not None else None)
+            last = marker
+        time.sleep(interval)
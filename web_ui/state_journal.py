@@ -0,0 +1,143 @@
+"""
+Versioned dashboard state with a bounded change journal
+Every update bumps the version and records JSON-Patch-style operations
+(add / replace / remove on JSON Pointer paths), so a poller that knows its
+last version only downloads what changed since then.
+
+Operations are stored as (op, path[, value]) tuples and only turned into
+{"op", "path", "value"} objects when a patch is served.
+
+Versions restart at 0 whenever the proxy starts, so every response also
+carries EPOCH; a client whose version belongs to another epoch gets the full
+state instead of a patch.
+"""
+
+import sys
+import time
+import threading
+from collections import deque
+
+# Identifies this proxy start (forked HTTP workers inherit it)
+EPOCH = f"{time.time_ns():x}"
+
+
+def escape_pointer(key):
+    """Escape a key for use in a JSON Pointer (RFC 6901)"""
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def diff(old, new, path, ops):
+    """Append the operations turning old into new at path; dicts are diffed key by key"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            # Interned: the same few paths recur in every journal entry (and every home)
+            child = sys.intern(f"{path}/{escape_pointer(key)}")
+            if key not in old:
+                ops.append(("add", child, value))
+            else:
+                diff(old[key], value, child, ops)
+        for key in old:
+            if key not in new:
+                ops.append(("remove", f"{path}/{escape_pointer(key)}"))
+    elif old != new:
+        ops.append(("replace", path, new))
+
+
+def op_dict(op):
+    """(op, path[, value]) -> JSON Patch operation object"""
+    if len(op) > 2:
+        return {"op": op[0], "path": op[1], "value": op[2]}
+    return {"op": op[0], "path": op[1]}
+
+
+def coalesce(ops):
+    """Drop operations superseded by a later one on the same path or a parent path"""
+    latest = {}
+    for op in ops:
+        path = op[1]
+        prefix = path + "/"
+        for existing in [p for p in latest if p == path or p.startswith(prefix)]:
+            del latest[existing]
+        latest[path] = op
+    return [op_dict(op) for op in latest.values()]
+
+
+class StateJournal:
+    """
+    Top-level state sections plus the journal of changes to them
+    
+    The journal keeps the last `size` versions; a client further behind (or
+    ahead, after a proxy restart) gets the full state instead of a patch.
+    """
+    
+    __slots__ = ("state", "version", "journal", "_lock")
+    
+    def __init__(self, sections, size=1000):
+        self.state = dict(sections)
+        self.version = 0
+        self.journal = deque(maxlen=size)    # (version, ops)
+        self._lock = threading.Lock()
+    
+    def set(self, section, value):
+        """Replace one section, recording only the fields that changed. Returns the new version"""
+        return self.update({section: value})
+    
+    def update(self, sections):
+        """Replace several sections under a single version. Returns the new version"""
+        with self._lock:
+            ops = []
+            for section, value in sections.items():
+                diff(self.state.get(section), value, f"/{escape_pointer(section)}", ops)
+                self.state[section] = value
+            if ops:
+                self.version += 1
+                self.journal.append((self.version, ops))
+            return self.version
+    
+    def get(self, section):
+        with self._lock:
+            return self.state.get(section)
+    
+    def snapshot(self):
+        with self._lock:
+            return dict(self.state), self.version
+    
+    def changes_since(self, version, epoch=None):
+        """Patch from version to now, see patch_since"""
+        with self._lock:
+            return patch_since(self.state, self.version, self.journal, version, epoch)
+    
+    def export(self):
+        """(state, version, journal entries) for publishing to other processes"""
+        with self._lock:
+            return dict(self.state), self.version, list(self.journal)
+
+
+def patch_since(state, version, journal, since, epoch=None):
+    """
+    Patch from version `since` to `version`
+    
+    Args:
+        state: Current state sections
+        version: Current version
+        journal: (version, ops) entries, oldest first
+        since: Version the client has
+        epoch: EPOCH the client's version came from (None: assume this one)
+    
+    Returns:
+        {"epoch": e, "version": v, "ops": [...]} or, when the journal no longer
+        reaches back that far or the epoch differs, {"epoch": e, "version": v, "full": state}
+    """
+    if epoch is not None and epoch != EPOCH:
+        return {"epoch": EPOCH, "version": version, "full": dict(state)}
+    if since == version:
+        return {"epoch": EPOCH, "version": version, "ops": []}
+    oldest = journal[0][0] if journal else version + 1
+    if since > version or since < oldest - 1:
+        return {"epoch": EPOCH, "version": version, "full": dict(state)}
+    entries = []
+    for entry_version, entry_ops in reversed(journal):
+        if entry_version <= since:
+            break
+        entries.append(entry_ops)
+    return {"epoch": EPOCH, "version": version, "ops": coalesce([op for entry in reversed(entries) for op in entry])}